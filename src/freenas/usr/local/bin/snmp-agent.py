@@ -3,7 +3,6 @@ from middlewared.utils import osc
 
 from collections import defaultdict
 import copy
-from datetime import datetime, timedelta
 from decimal import Decimal
 import os
 import subprocess
@@ -363,6 +362,258 @@ zfs_zilstat_ops1 = agent.Counter64(oidstr="FREENAS-MIB::zfsZilstatOps1sec")
 zfs_zilstat_ops5 = agent.Counter64(oidstr="FREENAS-MIB::zfsZilstatOps5sec")
 zfs_zilstat_ops10 = agent.Counter64(oidstr="FREENAS-MIB::zfsZilstatOps10sec")
 
+refresh_table = agent.Table(
+    oidstr="FREENAS-MIB::snmpAgentRefreshTable",
+    indexes=[
+        agent.Integer32(),
+    ],
+    columns=[
+        (1, agent.Integer32()),
+        (2, agent.DisplayString()),
+        (3, agent.Counter64()),
+        (4, agent.Counter64()),
+        (5, agent.Counter64()),
+    ]
+)
+
+
+class DiffTable:
+    """
+    Keeps an agent table in sync with rows identified by a key (e.g. dataset name) rather than by their position.
+
+    Only rows that appeared are added, only rows that disappeared are removed and only cells which values have
+    changed are set, so the index of an object does not change while it exists.
+    """
+
+    def __init__(self, table, index_column=True):
+        self.table = table
+        self.index_column = index_column
+        self.rows = {}
+        self.next_index = 1
+
+    def sync(self, rows):
+        """
+        `rows` is a dict of `key: {column: (agent type, value)}`. Returns the number of rows added, updated or removed.
+        """
+        changed = 0
+
+        for key in self.rows.keys() - rows.keys():
+            index, row, values = self.rows.pop(key)
+            # netsnmpagent only offers clearing the whole table, remove the single row through net-snmp itself
+            netsnmpagent.libnsX.netsnmp_table_dataset_remove_and_delete_row(self.table._dataset, row._table_row)
+            changed += 1
+
+        for key, columns in rows.items():
+            values = {column: value for column, (type_, value) in columns.items()}
+            if key in self.rows:
+                index, row, old_values = self.rows[key]
+                updated = [column for column, value in values.items() if old_values.get(column) != value]
+                if not updated:
+                    continue
+            else:
+                index = self.next_index
+                self.next_index += 1
+                row = self.table.addRow([agent.Integer32(index)])
+                if self.index_column:
+                    row.setRowCell(1, agent.Integer32(index))
+                updated = list(values)
+
+            for column in updated:
+                type_, value = columns[column]
+                row.setRowCell(column, type_(value))
+
+            self.rows[key] = (index, row, values)
+            changed += 1
+
+        return changed
+
+
+class Refresher:
+    """
+    Refreshes a group of objects when they are requested and are older than `ttl` seconds, keeping track of how
+    much it costs.
+
+    `func` returns the number of table rows it has changed.
+    """
+
+    def __init__(self, name, ttl, func):
+        self.name = name
+        self.ttl = ttl
+        self.func = func
+
+        self.refreshed_at = None
+        self.refreshes = 0
+        self.time = 0
+        self.rows_changed = 0
+
+    def refresh_if_stale(self, now):
+        if self.refreshed_at is not None and now - self.refreshed_at < self.ttl:
+            return False
+
+        started_at = time.monotonic()
+        self.rows_changed += self.func()
+        self.refreshed_at = time.monotonic()
+        self.refreshes += 1
+        self.time += int((self.refreshed_at - started_at) * 1000000)
+        return True
+
+
+def refresh_zpools(zfs, zpool_io_thread, zpool_table):
+    zpool_io_overall, zpool_io_1sec = zpool_io_thread.get_values()
+
+    rows = {}
+    for zpool in zfs.pools:
+        allocation_units, \
+            (
+                size,
+                used,
+                available
+            ) = calculate_allocation_units(
+                int(zpool.properties["size"].rawvalue),
+                int(zpool.properties["allocated"].rawvalue),
+                int(zpool.properties["free"].rawvalue),
+            )
+        rows[zpool.name] = {
+            2: (agent.DisplayString, zpool.properties["name"].value),
+            3: (agent.Integer32, allocation_units),
+            4: (agent.Integer32, size),
+            5: (agent.Integer32, used),
+            6: (agent.Integer32, available),
+            7: (agent.Integer32, zpool_health_type.namedValues.getValue(zpool.properties["health"].value.lower())),
+            8: (agent.Counter64, zpool_io_overall[zpool.name]["read_ops"]),
+            9: (agent.Counter64, zpool_io_overall[zpool.name]["write_ops"]),
+            10: (agent.Counter64, zpool_io_overall[zpool.name]["read_bytes"]),
+            11: (agent.Counter64, zpool_io_overall[zpool.name]["write_bytes"]),
+            12: (agent.Counter64, zpool_io_1sec[zpool.name]["read_ops"]),
+            13: (agent.Counter64, zpool_io_1sec[zpool.name]["write_ops"]),
+            14: (agent.Counter64, zpool_io_1sec[zpool.name]["read_bytes"]),
+            15: (agent.Counter64, zpool_io_1sec[zpool.name]["write_bytes"]),
+        }
+
+    return zpool_table.sync(rows)
+
+
+def refresh_datasets(zfs, dataset_table, zvol_table):
+    datasets = {}
+    zvols = {}
+    for zpool in zfs.pools:
+        for dataset in zpool.root_dataset.children_recursive:
+            if dataset.type == libzfs.DatasetType.FILESYSTEM:
+                allocation_units, (
+                    size,
+                    used,
+                    available
+                ) = calculate_allocation_units(
+                    int(dataset.properties["used"].rawvalue) + int(dataset.properties["available"].rawvalue),
+                    int(dataset.properties["used"].rawvalue),
+                    int(dataset.properties["available"].rawvalue),
+                )
+                datasets[dataset.name] = {
+                    2: (agent.DisplayString, dataset.properties["name"].value),
+                    3: (agent.Integer32, allocation_units),
+                    4: (agent.Integer32, size),
+                    5: (agent.Integer32, used),
+                    6: (agent.Integer32, available),
+                }
+            if dataset.type == libzfs.DatasetType.VOLUME:
+                allocation_units, (
+                    volsize,
+                    used,
+                    available,
+                    referenced
+                ) = calculate_allocation_units(
+                    int(dataset.properties["volsize"].rawvalue),
+                    int(dataset.properties["used"].rawvalue),
+                    int(dataset.properties["available"].rawvalue),
+                    int(dataset.properties["referenced"].rawvalue),
+                )
+                zvols[dataset.name] = {
+                    2: (agent.DisplayString, dataset.properties["name"].value),
+                    3: (agent.Integer32, allocation_units),
+                    4: (agent.Integer32, volsize),
+                    5: (agent.Integer32, used),
+                    6: (agent.Integer32, available),
+                    7: (agent.Integer32, referenced),
+                }
+
+    return dataset_table.sync(datasets) + zvol_table.sync(zvols)
+
+
+def refresh_temperatures(cpu_temp_thread, disk_temp_thread, lm_sensors_table, hdd_temp_table):
+    changed = 0
+
+    disk_temperatures = {}
+    if disk_temp_thread:
+        disk_temperatures = disk_temp_thread.temperatures.copy()
+
+    if lm_sensors_table:
+        temperatures = {}
+        if cpu_temp_thread:
+            for i, temp in enumerate(cpu_temp_thread.temperatures.copy()):
+                temperatures[f"CPU{i}"] = temp
+        temperatures.update(disk_temperatures)
+        changed += lm_sensors_table.sync({
+            name: {
+                2: (agent.DisplayString, name),
+                3: (agent.Unsigned32, temp),
+            }
+            for name, temp in temperatures.items()
+        })
+
+    if hdd_temp_table:
+        changed += hdd_temp_table.sync({
+            name: {
+                2: (agent.DisplayString, name),
+                3: (agent.Unsigned32, temp),
+            }
+            for name, temp in disk_temperatures.items()
+        })
+
+    return changed
+
+
+def refresh_zfs_scalars(zilstat_1_thread, zilstat_5_thread, zilstat_10_thread):
+    kstat = get_Kstat()
+    arc_efficiency = get_arc_efficiency(kstat)
+
+    zfs_arc_size.update(kstat["kstat.zfs.misc.arcstats.size"] / 1024)
+    zfs_arc_meta.update(kstat["kstat.zfs.misc.arcstats.arc_meta_used"] / 1024)
+    zfs_arc_data.update(kstat["kstat.zfs.misc.arcstats.data_size"] / 1024)
+    zfs_arc_hits.update(kstat["kstat.zfs.misc.arcstats.hits"] % 2 ** 32)
+    zfs_arc_misses.update(kstat["kstat.zfs.misc.arcstats.misses"] % 2 ** 32)
+    zfs_arc_c.update(kstat["kstat.zfs.misc.arcstats.c"] / 1024)
+    zfs_arc_p.update(kstat["kstat.zfs.misc.arcstats.p"] / 1024)
+    zfs_arc_miss_percent.update(str(get_zfs_arc_miss_percent(kstat)).encode("ascii"))
+    zfs_arc_cache_hit_ratio.update(str(arc_efficiency["cache_hit_ratio"]["per"][:-1]).encode("ascii"))
+    zfs_arc_cache_miss_ratio.update(str(arc_efficiency["cache_miss_ratio"]["per"][:-1]).encode("ascii"))
+
+    zfs_l2arc_hits.update(int(kstat["kstat.zfs.misc.arcstats.l2_hits"] % 2 ** 32))
+    zfs_l2arc_misses.update(int(kstat["kstat.zfs.misc.arcstats.l2_misses"] % 2 ** 32))
+    zfs_l2arc_read.update(int(kstat["kstat.zfs.misc.arcstats.l2_read_bytes"] / 1024 % 2 ** 32))
+    zfs_l2arc_write.update(int(kstat["kstat.zfs.misc.arcstats.l2_write_bytes"] / 1024 % 2 ** 32))
+    zfs_l2arc_size.update(int(kstat["kstat.zfs.misc.arcstats.l2_asize"] / 1024))
+
+    if zilstat_1_thread:
+        zfs_zilstat_ops1.update(zilstat_1_thread.value["ops"])
+    if zilstat_5_thread:
+        zfs_zilstat_ops5.update(zilstat_5_thread.value["ops"])
+    if zilstat_10_thread:
+        zfs_zilstat_ops10.update(zilstat_10_thread.value["ops"])
+
+    return 0
+
+
+def update_refresh_table(refreshers, refresh_table):
+    return refresh_table.sync({
+        refresher.name: {
+            2: (agent.DisplayString, refresher.name),
+            3: (agent.Counter64, refresher.refreshes),
+            4: (agent.Counter64, refresher.time),
+            5: (agent.Counter64, refresher.rows_changed),
+        }
+        for refresher in refreshers
+    })
+
 
 class ZpoolIoThread(threading.Thread):
     def __init__(self):
@@ -558,141 +809,36 @@ if __name__ == "__main__":
     disk_temp_thread = DiskTempThread(300)
     disk_temp_thread.start()
 
+    zpool_diff_table = DiffTable(zpool_table)
+    dataset_diff_table = DiffTable(dataset_table)
+    zvol_diff_table = DiffTable(zvol_table)
+    lm_sensors_diff_table = DiffTable(lm_sensors_table) if lm_sensors_table else None
+    hdd_temp_diff_table = DiffTable(hdd_temp_table, index_column=False)
+    refresh_diff_table = DiffTable(refresh_table)
+
+    # Objects are only refreshed in response to requests so an idle agent does not walk thousands of datasets over
+    # and over again. Walking datasets is also the most expensive refresh and capacity changes slowly, hence the
+    # longest TTL.
+    refreshers = [
+        Refresher("zpool", 1, lambda: refresh_zpools(zfs, zpool_io_thread, zpool_diff_table)),
+        Refresher("dataset", 30, lambda: refresh_datasets(zfs, dataset_diff_table, zvol_diff_table)),
+        Refresher("temperature", 10, lambda: refresh_temperatures(
+            cpu_temp_thread, disk_temp_thread, lm_sensors_diff_table, hdd_temp_diff_table,
+        )),
+        Refresher("zfs", 1, lambda: refresh_zfs_scalars(zilstat_1_thread, zilstat_5_thread, zilstat_10_thread)),
+    ]
+
     agent.start()
 
-    last_update_at = datetime.min
     while True:
+        now = time.monotonic()
+        refreshed = False
+        for refresher in refreshers:
+            if refresher.refresh_if_stale(now):
+                refreshed = True
+        if refreshed:
+            update_refresh_table(refreshers, refresh_diff_table)
+
+        # Blocks until a request is received. A request is served with objects refreshed after the previous one,
+        # a walk spanning several requests gets fresh objects from the second one on.
         agent.check_and_process()
-
-        if datetime.utcnow() - last_update_at > timedelta(seconds=1):
-            zpool_io_overall, zpool_io_1sec = zpool_io_thread.get_values()
-
-            datasets = []
-            zvols = []
-            zpool_table.clear()
-            for i, zpool in enumerate(zfs.pools):
-                row = zpool_table.addRow([agent.Integer32(i + 1)])
-                row.setRowCell(1, agent.Integer32(i + 1))
-                row.setRowCell(2, agent.DisplayString(zpool.properties["name"].value))
-                allocation_units, \
-                    (
-                        size,
-                        used,
-                        available
-                    ) = calculate_allocation_units(
-                        int(zpool.properties["size"].rawvalue),
-                        int(zpool.properties["allocated"].rawvalue),
-                        int(zpool.properties["free"].rawvalue),
-                    )
-                row.setRowCell(3, agent.Integer32(allocation_units))
-                row.setRowCell(4, agent.Integer32(size))
-                row.setRowCell(5, agent.Integer32(used))
-                row.setRowCell(6, agent.Integer32(available))
-                row.setRowCell(7, agent.Integer32(zpool_health_type.namedValues.getValue(
-                    zpool.properties["health"].value.lower())))
-                row.setRowCell(8, agent.Counter64(zpool_io_overall[zpool.name]["read_ops"]))
-                row.setRowCell(9, agent.Counter64(zpool_io_overall[zpool.name]["write_ops"]))
-                row.setRowCell(10, agent.Counter64(zpool_io_overall[zpool.name]["read_bytes"]))
-                row.setRowCell(11, agent.Counter64(zpool_io_overall[zpool.name]["write_bytes"]))
-                row.setRowCell(12, agent.Counter64(zpool_io_1sec[zpool.name]["read_ops"]))
-                row.setRowCell(13, agent.Counter64(zpool_io_1sec[zpool.name]["write_ops"]))
-                row.setRowCell(14, agent.Counter64(zpool_io_1sec[zpool.name]["read_bytes"]))
-                row.setRowCell(15, agent.Counter64(zpool_io_1sec[zpool.name]["write_bytes"]))
-
-                for dataset in zpool.root_dataset.children_recursive:
-                    if dataset.type == libzfs.DatasetType.FILESYSTEM:
-                        datasets.append(dataset)
-                    if dataset.type == libzfs.DatasetType.VOLUME:
-                        zvols.append(dataset)
-
-            dataset_table.clear()
-            for i, dataset in enumerate(datasets):
-                row = dataset_table.addRow([agent.Integer32(i + 1)])
-                row.setRowCell(1, agent.Integer32(i + 1))
-                row.setRowCell(2, agent.DisplayString(dataset.properties["name"].value))
-                allocation_units, (
-                    size,
-                    used,
-                    available
-                ) = calculate_allocation_units(
-                    int(dataset.properties["used"].rawvalue) + int(dataset.properties["available"].rawvalue),
-                    int(dataset.properties["used"].rawvalue),
-                    int(dataset.properties["available"].rawvalue),
-                )
-                row.setRowCell(3, agent.Integer32(allocation_units))
-                row.setRowCell(4, agent.Integer32(size))
-                row.setRowCell(5, agent.Integer32(used))
-                row.setRowCell(6, agent.Integer32(available))
-
-            zvol_table.clear()
-            for i, zvol in enumerate(zvols):
-                row = zvol_table.addRow([agent.Integer32(i + 1)])
-                row.setRowCell(1, agent.Integer32(i + 1))
-                row.setRowCell(2, agent.DisplayString(zvol.properties["name"].value))
-                allocation_units, (
-                    volsize,
-                    used,
-                    available,
-                    referenced
-                ) = calculate_allocation_units(
-                    int(zvol.properties["volsize"].rawvalue),
-                    int(zvol.properties["used"].rawvalue),
-                    int(zvol.properties["available"].rawvalue),
-                    int(zvol.properties["referenced"].rawvalue),
-                )
-                row.setRowCell(3, agent.Integer32(allocation_units))
-                row.setRowCell(4, agent.Integer32(volsize))
-                row.setRowCell(5, agent.Integer32(used))
-                row.setRowCell(6, agent.Integer32(available))
-                row.setRowCell(7, agent.Integer32(referenced))
-
-            if lm_sensors_table:
-                lm_sensors_table.clear()
-                temperatures = []
-                if cpu_temp_thread:
-                    for i, temp in enumerate(cpu_temp_thread.temperatures.copy()):
-                        temperatures.append((f"CPU{i}", temp))
-                if disk_temp_thread:
-                    temperatures.extend(list(disk_temp_thread.temperatures.items()))
-                for i, (name, temp) in enumerate(temperatures):
-                    row = lm_sensors_table.addRow([agent.Integer32(i + 1)])
-                    row.setRowCell(1, agent.Integer32(i + 1))
-                    row.setRowCell(2, agent.DisplayString(name))
-                    row.setRowCell(3, agent.Unsigned32(temp))
-
-            if hdd_temp_table:
-                hdd_temp_table.clear()
-                if disk_temp_thread:
-                    for i, (name, temp) in enumerate(list(disk_temp_thread.temperatures.items())):
-                        row = hdd_temp_table.addRow([agent.Integer32(i + 1)])
-                        row.setRowCell(2, agent.DisplayString(name))
-                        row.setRowCell(3, agent.Unsigned32(temp))
-
-            kstat = get_Kstat()
-            arc_efficiency = get_arc_efficiency(kstat)
-
-            zfs_arc_size.update(kstat["kstat.zfs.misc.arcstats.size"] / 1024)
-            zfs_arc_meta.update(kstat["kstat.zfs.misc.arcstats.arc_meta_used"] / 1024)
-            zfs_arc_data.update(kstat["kstat.zfs.misc.arcstats.data_size"] / 1024)
-            zfs_arc_hits.update(kstat["kstat.zfs.misc.arcstats.hits"] % 2 ** 32)
-            zfs_arc_misses.update(kstat["kstat.zfs.misc.arcstats.misses"] % 2 ** 32)
-            zfs_arc_c.update(kstat["kstat.zfs.misc.arcstats.c"] / 1024)
-            zfs_arc_p.update(kstat["kstat.zfs.misc.arcstats.p"] / 1024)
-            zfs_arc_miss_percent.update(str(get_zfs_arc_miss_percent(kstat)).encode("ascii"))
-            zfs_arc_cache_hit_ratio.update(str(arc_efficiency["cache_hit_ratio"]["per"][:-1]).encode("ascii"))
-            zfs_arc_cache_miss_ratio.update(str(arc_efficiency["cache_miss_ratio"]["per"][:-1]).encode("ascii"))
-
-            zfs_l2arc_hits.update(int(kstat["kstat.zfs.misc.arcstats.l2_hits"] % 2 ** 32))
-            zfs_l2arc_misses.update(int(kstat["kstat.zfs.misc.arcstats.l2_misses"] % 2 ** 32))
-            zfs_l2arc_read.update(int(kstat["kstat.zfs.misc.arcstats.l2_read_bytes"] / 1024 % 2 ** 32))
-            zfs_l2arc_write.update(int(kstat["kstat.zfs.misc.arcstats.l2_write_bytes"] / 1024 % 2 ** 32))
-            zfs_l2arc_size.update(int(kstat["kstat.zfs.misc.arcstats.l2_asize"] / 1024))
-
-            if zilstat_1_thread:
-                zfs_zilstat_ops1.update(zilstat_1_thread.value["ops"])
-            if zilstat_5_thread:
-                zfs_zilstat_ops5.update(zilstat_5_thread.value["ops"])
-            if zilstat_10_thread:
-                zfs_zilstat_ops10.update(zilstat_10_thread.value["ops"])
-
-            last_update_at = datetime.utcnow()
@@ -422,13 +422,15 @@ class FailoverService(ConfigService):
         # Journal thread will see that this is special value and will clear journal.
         sql_queue.put(None)
 
+        # Committed changes still in the write-ahead log would not be sent otherwise
+        self.middleware.get_service('datastore')._checkpoint()
+
         self.send_small_file(FREENAS_DATABASE, FREENAS_DATABASE + '.sync')
         self.middleware.call_sync('failover.call_remote', 'failover.receive_database')
 
     @private
     def receive_database(self):
-        os.rename(FREENAS_DATABASE + '.sync', FREENAS_DATABASE)
-        self.middleware.call_sync('datastore.setup')
+        self.middleware.call_sync('datastore.replace', FREENAS_DATABASE + '.sync')
 
     @private
     def send_small_file(self, path, dest=None):
@@ -23,7 +23,7 @@ class ZPoolHealthType(Integer):
 
 # Objects
 
-freeNas = ModuleIdentity((1, 3, 6, 1, 4, 1, 50536)).setRevisions(("2020-05-28 00:00",))
+freeNas = ModuleIdentity((1, 3, 6, 1, 4, 1, 50536)).setRevisions(("2026-10-16 00:00", "2020-05-28 00:00",))
 if mibBuilder.loadTexts: freeNas.setOrganization("www.ixsystems.com")
 if mibBuilder.loadTexts: freeNas.setContactInfo("postal:   2490 Kruse Dr\nSan Jose, CA 95131\n\nemail:    support@iXsystems.com")
 if mibBuilder.loadTexts: freeNas.setDescription("")
@@ -157,6 +157,21 @@ hddTempDevice = MibTableColumn((1, 3, 6, 1, 4, 1, 50536, 3, 1, 2), DisplayString
 if mibBuilder.loadTexts: hddTempDevice.setDescription("The name of the HDD we are reading temperature from.")
 hddTempValue = MibTableColumn((1, 3, 6, 1, 4, 1, 50536, 3, 1, 3), Gauge32()).setMaxAccess("readonly")
 if mibBuilder.loadTexts: hddTempValue.setDescription("The temperature of this HDD in mC.")
+snmpAgent = MibIdentifier((1, 3, 6, 1, 4, 1, 50536, 4))
+snmpAgentRefreshTable = MibTable((1, 3, 6, 1, 4, 1, 50536, 4, 1))
+if mibBuilder.loadTexts: snmpAgentRefreshTable.setDescription("Table of groups of objects the agent refreshes and how much refreshing them has cost.")
+snmpAgentRefreshEntry = MibTableRow((1, 3, 6, 1, 4, 1, 50536, 4, 1, 1)).setIndexNames((0, "FREENAS-MIB", "snmpAgentRefreshIndex"))
+if mibBuilder.loadTexts: snmpAgentRefreshEntry.setDescription("An entry containing a group of objects and its refresh counters.")
+snmpAgentRefreshIndex = MibTableColumn((1, 3, 6, 1, 4, 1, 50536, 4, 1, 1, 1), Integer32().subtype(subtypeSpec=ValueRangeConstraint(1, 2147483647))).setMaxAccess("readonly")
+if mibBuilder.loadTexts: snmpAgentRefreshIndex.setDescription("Reference index for each group of objects.")
+snmpAgentRefreshDescr = MibTableColumn((1, 3, 6, 1, 4, 1, 50536, 4, 1, 1, 2), DisplayString()).setMaxAccess("readonly")
+if mibBuilder.loadTexts: snmpAgentRefreshDescr.setDescription("The name of the group of objects.")
+snmpAgentRefreshCount = MibTableColumn((1, 3, 6, 1, 4, 1, 50536, 4, 1, 1, 3), Counter64()).setMaxAccess("readonly")
+if mibBuilder.loadTexts: snmpAgentRefreshCount.setDescription("The number of times this group of objects was refreshed.")
+snmpAgentRefreshTime = MibTableColumn((1, 3, 6, 1, 4, 1, 50536, 4, 1, 1, 4), Counter64()).setMaxAccess("readonly")
+if mibBuilder.loadTexts: snmpAgentRefreshTime.setDescription("The time spent refreshing this group of objects in microseconds.")
+snmpAgentRefreshRowsChanged = MibTableColumn((1, 3, 6, 1, 4, 1, 50536, 4, 1, 1, 5), Counter64()).setMaxAccess("readonly")
+if mibBuilder.loadTexts: snmpAgentRefreshRowsChanged.setDescription("The number of table rows added, updated or removed while refreshing this group of objects.")
 
 # Augmentions
 
@@ -176,7 +191,7 @@ mibBuilder.exportSymbols("FREENAS-MIB", PYSNMP_MODULE_ID=freeNas)
 mibBuilder.exportSymbols("FREENAS-MIB", AlertLevelType=AlertLevelType, ZPoolHealthType=ZPoolHealthType)
 
 # Objects
-mibBuilder.exportSymbols("FREENAS-MIB", freeNas=freeNas, zfs=zfs, zpool=zpool, zpoolTable=zpoolTable, zpoolEntry=zpoolEntry, zpoolIndex=zpoolIndex, zpoolDescr=zpoolDescr, zpoolAllocationUnits=zpoolAllocationUnits, zpoolSize=zpoolSize, zpoolUsed=zpoolUsed, zpoolAvailable=zpoolAvailable, zpoolHealth=zpoolHealth, zpoolReadOps=zpoolReadOps, zpoolWriteOps=zpoolWriteOps, zpoolReadBytes=zpoolReadBytes, zpoolWriteBytes=zpoolWriteBytes, zpoolReadOps1sec=zpoolReadOps1sec, zpoolWriteOps1sec=zpoolWriteOps1sec, zpoolReadBytes1sec=zpoolReadBytes1sec, zpoolWriteBytes1sec=zpoolWriteBytes1sec, dataset=dataset, datasetTable=datasetTable, datasetEntry=datasetEntry, datasetIndex=datasetIndex, datasetDescr=datasetDescr, datasetAllocationUnits=datasetAllocationUnits, datasetSize=datasetSize, datasetUsed=datasetUsed, datasetAvailable=datasetAvailable, zvol=zvol, zvolTable=zvolTable, zvolEntry=zvolEntry, zvolIndex=zvolIndex, zvolDescr=zvolDescr, zvolAllocationUnits=zvolAllocationUnits, zvolSize=zvolSize, zvolUsed=zvolUsed, zvolAvailable=zvolAvailable, zvolReferenced=zvolReferenced, arc=arc, zfsArcSize=zfsArcSize, zfsArcMeta=zfsArcMeta, zfsArcData=zfsArcData, zfsArcHits=zfsArcHits, zfsArcMisses=zfsArcMisses, zfsArcC=zfsArcC, zfsArcP=zfsArcP, zfsArcMissPercent=zfsArcMissPercent, zfsArcCacheHitRatio=zfsArcCacheHitRatio, zfsArcCacheMissRatio=zfsArcCacheMissRatio, l2arc=l2arc, zfsL2ArcHits=zfsL2ArcHits, zfsL2ArcMisses=zfsL2ArcMisses, zfsL2ArcRead=zfsL2ArcRead, zfsL2ArcWrite=zfsL2ArcWrite, zfsL2ArcSize=zfsL2ArcSize, zil=zil, zfsZilstatOps1sec=zfsZilstatOps1sec, zfsZilstatOps5sec=zfsZilstatOps5sec, zfsZilstatOps10sec=zfsZilstatOps10sec, notifications=notifications, notificationPrefix=notificationPrefix, notificationObjects=notificationObjects, alertId=alertId, alertLevel=alertLevel, alertMessage=alertMessage, hddTempTable=hddTempTable, hddTempEntry=hddTempEntry, hddTempIndex=hddTempIndex, hddTempDevice=hddTempDevice, hddTempValue=hddTempValue)
+mibBuilder.exportSymbols("FREENAS-MIB", freeNas=freeNas, zfs=zfs, zpool=zpool, zpoolTable=zpoolTable, zpoolEntry=zpoolEntry, zpoolIndex=zpoolIndex, zpoolDescr=zpoolDescr, zpoolAllocationUnits=zpoolAllocationUnits, zpoolSize=zpoolSize, zpoolUsed=zpoolUsed, zpoolAvailable=zpoolAvailable, zpoolHealth=zpoolHealth, zpoolReadOps=zpoolReadOps, zpoolWriteOps=zpoolWriteOps, zpoolReadBytes=zpoolReadBytes, zpoolWriteBytes=zpoolWriteBytes, zpoolReadOps1sec=zpoolReadOps1sec, zpoolWriteOps1sec=zpoolWriteOps1sec, zpoolReadBytes1sec=zpoolReadBytes1sec, zpoolWriteBytes1sec=zpoolWriteBytes1sec, dataset=dataset, datasetTable=datasetTable, datasetEntry=datasetEntry, datasetIndex=datasetIndex, datasetDescr=datasetDescr, datasetAllocationUnits=datasetAllocationUnits, datasetSize=datasetSize, datasetUsed=datasetUsed, datasetAvailable=datasetAvailable, zvol=zvol, zvolTable=zvolTable, zvolEntry=zvolEntry, zvolIndex=zvolIndex, zvolDescr=zvolDescr, zvolAllocationUnits=zvolAllocationUnits, zvolSize=zvolSize, zvolUsed=zvolUsed, zvolAvailable=zvolAvailable, zvolReferenced=zvolReferenced, arc=arc, zfsArcSize=zfsArcSize, zfsArcMeta=zfsArcMeta, zfsArcData=zfsArcData, zfsArcHits=zfsArcHits, zfsArcMisses=zfsArcMisses, zfsArcC=zfsArcC, zfsArcP=zfsArcP, zfsArcMissPercent=zfsArcMissPercent, zfsArcCacheHitRatio=zfsArcCacheHitRatio, zfsArcCacheMissRatio=zfsArcCacheMissRatio, l2arc=l2arc, zfsL2ArcHits=zfsL2ArcHits, zfsL2ArcMisses=zfsL2ArcMisses, zfsL2ArcRead=zfsL2ArcRead, zfsL2ArcWrite=zfsL2ArcWrite, zfsL2ArcSize=zfsL2ArcSize, zil=zil, zfsZilstatOps1sec=zfsZilstatOps1sec, zfsZilstatOps5sec=zfsZilstatOps5sec, zfsZilstatOps10sec=zfsZilstatOps10sec, notifications=notifications, notificationPrefix=notificationPrefix, notificationObjects=notificationObjects, alertId=alertId, alertLevel=alertLevel, alertMessage=alertMessage, hddTempTable=hddTempTable, hddTempEntry=hddTempEntry, hddTempIndex=hddTempIndex, hddTempDevice=hddTempDevice, hddTempValue=hddTempValue, snmpAgent=snmpAgent, snmpAgentRefreshTable=snmpAgentRefreshTable, snmpAgentRefreshEntry=snmpAgentRefreshEntry, snmpAgentRefreshIndex=snmpAgentRefreshIndex, snmpAgentRefreshDescr=snmpAgentRefreshDescr, snmpAgentRefreshCount=snmpAgentRefreshCount, snmpAgentRefreshTime=snmpAgentRefreshTime, snmpAgentRefreshRowsChanged=snmpAgentRefreshRowsChanged)
 
 # Notifications
 mibBuilder.exportSymbols("FREENAS-MIB", alert=alert, alertCancellation=alertCancellation)
@@ -184,6 +184,8 @@ class AlertSource:
     products = ("CORE", "ENTERPRISE")
     failover_related = False
     run_on_backup_node = True
+    # Seconds after which a check is considered failed
+    run_timeout = 60
 
     def __init__(self, middleware):
         self.middleware = middleware
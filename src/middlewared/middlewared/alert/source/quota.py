@@ -2,6 +2,7 @@ from datetime import timedelta
 import logging
 import os
 import socket
+import time
 
 try:
     from bsd import getmntinfo
@@ -35,7 +36,9 @@ class QuotaAlertSource(ThreadedAlertSource):
     def check_sync(self):
         alerts = []
 
+        started = time.monotonic()
         datasets = self.middleware.call_sync("zfs.dataset.query_for_quota_alert")
+        logger.debug("Found %d datasets with quota in %.2f seconds", len(datasets), time.monotonic() - started)
 
         for d in datasets:
             d["name"] = d["name"]["rawvalue"]
@@ -1,3 +1,4 @@
+from collections import defaultdict
 import asyncio
 import threading
 
@@ -27,6 +28,49 @@ class Events(object):
             }
 
 
+class EventSubscriptions(object):
+    """
+    Index of websocket clients subscribed to every event name (or to all of them, `*`) so that
+    sending an event does not require asking every connected client whether it wants it.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        # Subscriber sets are replaced instead of being modified so that events can be sent
+        # from any thread without holding the lock.
+        self.__subscribers = {}
+        self.__stats = defaultdict(lambda: {'sent': 0, 'dropped': 0})
+
+    def subscribe(self, name, app):
+        with self.__lock:
+            self.__subscribers[name] = self.__subscribers.get(name, frozenset()) | {app}
+
+    def unsubscribe(self, name, app):
+        with self.__lock:
+            subscribers = self.__subscribers.get(name, frozenset()) - {app}
+            if subscribers:
+                self.__subscribers[name] = subscribers
+            else:
+                self.__subscribers.pop(name, None)
+
+    def get(self, name):
+        subscribers = self.__subscribers.get(name)
+        wildcard = self.__subscribers.get('*')
+        if subscribers and wildcard:
+            return subscribers | wildcard
+        return subscribers or wildcard or frozenset()
+
+    def record(self, name, sent, dropped):
+        with self.__lock:
+            stats = self.__stats[name]
+            stats['sent'] += sent
+            stats['dropped'] += dropped
+
+    def stats(self):
+        with self.__lock:
+            return {name: dict(stats) for name, stats in self.__stats.items()}
+
+
 class EventSource(object):
 
     def __init__(self, middleware, app, ident, name, arg):
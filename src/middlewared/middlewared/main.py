@@ -1,6 +1,6 @@
 from .apidocs import app as apidocs_app
 from .client import ejson as json
-from .event import EventSource, Events
+from .event import EventSource, Events, EventSubscriptions
 from .job import Job, JobsQueue
 from .pipe import Pipes, Pipe
 from .restful import RESTfulAPI
@@ -91,7 +91,17 @@ class Application(object):
         self.__callbacks[name].append(method)
 
     def _send(self, data):
-        asyncio.run_coroutine_threadsafe(self.response.send_str(json.dumps(data)), loop=self.loop)
+        self._send_str(json.dumps(data))
+
+    def _send_str(self, data):
+        """
+        Send already serialized `data`. Returns `False` if the connection is closed.
+        """
+        if self.response.closed:
+            return False
+
+        asyncio.run_coroutine_threadsafe(self.response.send_str(data), loop=self.loop)
+        return True
 
     def _tb_error(self, exc_info):
         klass, exc, trace = exc_info
@@ -214,10 +224,12 @@ class Application(object):
                 'event_source': es,
                 'name': name,
             }
+            self.middleware.event_subscriptions.subscribe(name, self)
             # Start it after setting __event_sources or it can have a race condition
             start_daemon_thread(target=es.process)
         else:
             self.__subscribed[ident] = name
+            self.middleware.event_subscriptions.subscribe(name, self)
 
         self._send({
             'msg': 'ready',
@@ -226,18 +238,31 @@ class Application(object):
 
     async def unsubscribe(self, ident):
         if ident in self.__subscribed:
-            self.__subscribed.pop(ident)
+            name = self.__subscribed.pop(ident)
         elif ident in self.__event_sources:
             event_source = self.__event_sources[ident]['event_source']
             await self.middleware.run_in_thread(event_source.cancel)
-            self.__event_sources.pop(ident)
+            name = self.__event_sources.pop(ident)['name']
+        else:
+            return
+
+        if not self.__is_subscribed(name):
+            self.middleware.event_subscriptions.unsubscribe(name, self)
+
+    def __is_subscribed(self, name):
+        return (
+            any(i == name for i in self.__subscribed.values()) or
+            any(i['name'] == name for i in self.__event_sources.values())
+        )
 
     def send_event(self, name, event_type, **kwargs):
-        if (
-            not any(i == name or i == '*' for i in self.__subscribed.values()) and
-            not any(i['name'] == name for i in self.__event_sources.values())
-        ):
+        if not self.__is_subscribed(name) and not self.__is_subscribed('*'):
             return
+        sent = self._send_str(json.dumps(self.event_message(name, event_type, **kwargs)))
+        self.middleware.event_subscriptions.record(name, int(sent), int(not sent))
+
+    @staticmethod
+    def event_message(name, event_type, **kwargs):
         event = {
             'msg': event_type.lower(),
             'collection': name,
@@ -253,7 +278,7 @@ class Application(object):
                 event['cleared'] = kwargs.pop('cleared')
         if kwargs:
             event['extra'] = kwargs
-        self._send(event)
+        return event
 
     def on_open(self):
         self.middleware.register_wsclient(self)
@@ -270,6 +295,9 @@ class Application(object):
             event_source = val['event_source']
             asyncio.ensure_future(self.middleware.run_in_thread(event_source.cancel))
 
+        for name in set(self.__subscribed.values()) | {i['name'] for i in self.__event_sources.values()}:
+            self.middleware.event_subscriptions.unsubscribe(name, self)
+
         self.middleware.unregister_wsclient(self)
 
     async def on_message(self, message):
@@ -773,10 +801,11 @@ class ShellApplication(object):
 
 
 class PreparedCall:
-    def __init__(self, args=None, executor=None, job=None):
+    def __init__(self, args=None, executor=None, job=None, method=None):
         self.args = args
         self.executor = executor
         self.job = job
+        self.method = method
 
 
 class Middleware(LoadPluginsMixin, RunInThreadMixin, ServiceCallMixin):
@@ -813,10 +842,12 @@ class Middleware(LoadPluginsMixin, RunInThreadMixin, ServiceCallMixin):
             max_workers=10,
         )
         self.__init_procpool()
+        self.__procpool_stats = defaultdict(lambda: {'calls': 0, 'total_time': 0.0, 'max_time': 0.0})
         self.__wsclients = {}
         self.__events = Events()
         self.__event_sources = {}
         self.__event_subs = defaultdict(list)
+        self.event_subscriptions = EventSubscriptions()
         self.__hooks = defaultdict(list)
         self.__server_threads = []
         self.__init_services()
@@ -1179,7 +1210,11 @@ class Middleware(LoadPluginsMixin, RunInThreadMixin, ServiceCallMixin):
         else:
             executor = self.__ws_threadpool
 
-        return PreparedCall(args=args, executor=executor)
+        if app is None and hasattr(methodobj, '_readonly_args') and hasattr(methodobj, 'readonly_call'):
+            # Internal callers do not need their arguments to be protected from a method that does not modify them
+            methodobj = types.MethodType(methodobj.readonly_call, methodobj.__self__)
+
+        return PreparedCall(args=args, executor=executor, method=methodobj)
 
     async def _call(
         self, name, serviceobj, methodobj, params, **kwargs,
@@ -1189,6 +1224,8 @@ class Middleware(LoadPluginsMixin, RunInThreadMixin, ServiceCallMixin):
         if prepared_call.job:
             return prepared_call.job
 
+        methodobj = prepared_call.method
+
         if asyncio.iscoroutinefunction(methodobj):
             self.logger.trace('Calling %r in current IO loop', name)
             return await methodobj(*prepared_call.args)
@@ -1205,7 +1242,21 @@ class Middleware(LoadPluginsMixin, RunInThreadMixin, ServiceCallMixin):
         return await self.run_in_executor(prepared_call.executor, methodobj, *prepared_call.args)
 
     async def _call_worker(self, name, *args, job=None):
-        return await self.run_in_proc(main_worker, name, args, job)
+        started = time.monotonic()
+        try:
+            return await self.run_in_proc(main_worker, name, args, job)
+        finally:
+            elapsed = time.monotonic() - started
+            stats = self.__procpool_stats[name]
+            stats['calls'] += 1
+            stats['total_time'] += elapsed
+            stats['max_time'] = max(stats['max_time'], elapsed)
+
+    def get_procpool_stats(self):
+        return {
+            name: dict(stats, average_time=stats['total_time'] / stats['calls'])
+            for name, stats in self.__procpool_stats.items()
+        }
 
     def dump_args(self, args, method=None, method_name=None):
         if method is None:
@@ -1247,6 +1298,8 @@ class Middleware(LoadPluginsMixin, RunInThreadMixin, ServiceCallMixin):
         if prepared_call.job:
             return prepared_call.job
 
+        methodobj = prepared_call.method
+
         if asyncio.iscoroutinefunction(methodobj):
             self.logger.trace('Calling %r in main IO loop', name)
             return self.run_coroutine(methodobj(*prepared_call.args))
@@ -1330,11 +1383,22 @@ class Middleware(LoadPluginsMixin, RunInThreadMixin, ServiceCallMixin):
 
         self.logger.trace(f'Sending event {name!r}:{event_type!r}:{kwargs!r}')
 
-        for session_id, wsclient in list(self.__wsclients.items()):
-            try:
-                wsclient.send_event(name, event_type, **kwargs)
-            except Exception:
-                self.logger.warn('Failed to send event {} to {}'.format(name, session_id), exc_info=True)
+        subscribers = self.event_subscriptions.get(name)
+        if subscribers:
+            # Serialize once for every subscribed client
+            data = json.dumps(Application.event_message(name, event_type, **kwargs))
+            sent = dropped = 0
+            for wsclient in subscribers:
+                try:
+                    if wsclient._send_str(data):
+                        sent += 1
+                    else:
+                        dropped += 1
+                except Exception:
+                    dropped += 1
+                    self.logger.warn('Failed to send event {} to {}'.format(name, wsclient.session_id), exc_info=True)
+
+            self.event_subscriptions.record(name, sent, dropped)
 
         # Send event also for internally subscribed plugins
         for handler in self.__event_subs.get(name, []):
@@ -3,13 +3,14 @@ from middlewared.service import (
     CallError, CRUDService, ValidationErrors, item_method, no_auth_required, pass_app, private, filterable
 )
 import middlewared.sqlalchemy as sa
-from middlewared.utils import run, filter_list
+from middlewared.utils import run, filter_getattrs, filter_list
 from middlewared.utils.osc import IS_FREEBSD
 from middlewared.validators import Email
 from middlewared.plugins.smb import SMBBuiltin
 
 import asyncio
 import binascii
+from collections import defaultdict
 import crypt
 import errno
 import hashlib
@@ -96,28 +97,64 @@ class UserService(CRUDService):
     class Config:
         datastore = 'account.bsdusers'
         datastore_extend = 'user.user_extend'
+        datastore_extend_batch = 'user.user_extend_batch'
+        datastore_extend_context = 'user.user_extend_context'
+        datastore_extend_untouched = (
+            'id', 'uid', 'username', 'home', 'shell', 'full_name', 'builtin', 'smb', 'password_disabled', 'locked',
+            'sudo', 'microsoft_account',
+        )
         datastore_prefix = 'bsdusr_'
 
     @private
-    async def user_extend(self, user):
+    async def user_extend_context(self, extra):
+        return {'sshpubkey': extra.get('sshpubkey', True)}
 
-        # Normalize email, empty is really null
-        if user['email'] == '':
-            user['email'] = None
+    @private
+    async def user_extend(self, user, context=None):
+        return (await self.user_extend_batch([user], context or {'sshpubkey': True}))[0]
 
-        # Get group membership
-        user['groups'] = [gm['group']['id'] for gm in await self.middleware.call('datastore.query', 'account.bsdgroupmembership', [('user', '=', user['id'])], {'prefix': 'bsdgrpmember_'})]
+    @private
+    async def user_extend_batch(self, users, context):
+        # Get group membership of all the users at once
+        groups = defaultdict(list)
+        if users:
+            for gm in await self.middleware.call(
+                'datastore.query', 'account.bsdgroupmembership',
+                [('bsdgrpmember_user_id', 'in', [user['id'] for user in users])], {'relationships': False},
+            ):
+                groups[gm['bsdgrpmember_user_id']].append(gm['bsdgrpmember_group_id'])
 
-        # Get authorized keys
-        keysfile = f'{user["home"]}/.ssh/authorized_keys'
-        user['sshpubkey'] = None
-        if os.path.exists(keysfile):
-            try:
-                with open(keysfile, 'r') as f:
-                    user['sshpubkey'] = f.read()
-            except Exception:
-                pass
-        return user
+        for user in users:
+            # Normalize email, empty is really null
+            if user['email'] == '':
+                user['email'] = None
+
+            user['groups'] = groups[user['id']]
+
+            user['sshpubkey'] = None
+
+        if context['sshpubkey']:
+            # Reading home directories might wake up pool disks, only do this when asked to
+            keys = await self.middleware.run_in_thread(self.__read_sshpubkeys, [user['home'] for user in users])
+            for user, key in zip(users, keys):
+                user['sshpubkey'] = key
+
+        return users
+
+    def __read_sshpubkeys(self, homes):
+        keys = []
+        for home in homes:
+            # Get authorized keys
+            keysfile = f'{home}/.ssh/authorized_keys'
+            key = None
+            if os.path.exists(keysfile):
+                try:
+                    with open(keysfile, 'r') as f:
+                        key = f.read()
+                except Exception:
+                    pass
+            keys.append(key)
+        return keys
 
     @private
     async def user_compress(self, user):
@@ -135,27 +172,45 @@ class UserService(CRUDService):
 
         Users from directory services such as NIS, LDAP, or Active Directory will be included in query results
         if the option `{'extra': {'search_dscache': True}}` is specified.
+
+        `sshpubkey` is read from users home directories only when it is requested in `select`, filtered or ordered
+        by, when a single user is queried with `get` or when `{'extra': {'sshpubkey': True}}` is specified. It is
+        `null` otherwise.
         """
         if not filters:
             filters = []
 
         options = options or {}
         options['extend'] = self._config.datastore_extend
+        options['extend_batch'] = self._config.datastore_extend_batch
         options['extend_context'] = self._config.datastore_extend_context
         options['prefix'] = self._config.datastore_prefix
 
-        datastore_options = options.copy()
-        datastore_options.pop('count', None)
-        datastore_options.pop('get', None)
-
         extra = options.get('extra', {})
         dssearch = extra.pop('search_dscache', False)
 
         if dssearch:
             return await self.middleware.call('dscache.query', 'USERS', filters, options)
 
+        datastore_options = options.copy()
+        datastore_options.pop('count', None)
+        datastore_options.pop('get', None)
+        datastore_options['extra'] = dict(
+            extra,
+            sshpubkey=(
+                bool(extra.get('sshpubkey')) or
+                bool(options.get('get')) or
+                'sshpubkey' in (options.get('select') or []) or
+                'sshpubkey' in filter_getattrs(filters) or
+                'sshpubkey' in [o.lstrip('-') for o in options.get('order_by') or []]
+            ),
+        )
+
+        datastore_filters = [f for f in filters if self._is_datastore_filter(f)]
+        filters = [f for f in filters if not self._is_datastore_filter(f)]
+
         result = await self.middleware.call(
-            'datastore.query', self._config.datastore, [], datastore_options
+            'datastore.query', self._config.datastore, datastore_filters, datastore_options
         )
         for entry in result:
             entry.update({'local': True, 'id_type_both': False})
@@ -507,6 +562,7 @@ class UserService(CRUDService):
 
         user = await self.user_compress(user)
         await self.middleware.call('datastore.update', 'account.bsdusers', pk, user, {'prefix': 'bsdusr_'})
+        await self.middleware.call('auth.invalidate_credentials', 'password')
 
         await self.middleware.call('service.reload', 'user')
         if user['smb'] and must_change_pdb_entry:
@@ -548,6 +604,7 @@ class UserService(CRUDService):
                 await self.middleware.call('datastore.update', 'services.cifs', cifs['id'], {'guest': 'nobody'}, {'prefix': 'cifs_srv_'})
 
         await self.middleware.call('datastore.delete', 'account.bsdusers', pk)
+        await self.middleware.call('auth.invalidate_credentials', 'password')
         await self.middleware.call('service.reload', 'user')
 
         return pk
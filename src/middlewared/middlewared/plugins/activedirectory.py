@@ -1213,10 +1213,9 @@ class ActiveDirectoryService(ConfigService):
         may be revised in the future, but we want to keep things as simple as possible
         here since the list of entries numbers perhaps in the tens of thousands.
         """
-        if self.middleware.call_sync('cache.has_key', 'AD_cache') and not force:
+        if self.middleware.call_sync('dscache.has_cache', 'activedirectory') and not force:
             raise CallError('AD cache already exists. Refusing to generate cache.')
 
-        self.middleware.call_sync('cache.pop', 'AD_cache')
         ad = self.middleware.call_sync('activedirectory.config')
         smb = self.middleware.call_sync('smb.config')
         id_type_both_backends = [
@@ -1267,8 +1266,12 @@ class ActiveDirectoryService(ConfigService):
                 })
 
         for line in netlist.stdout.decode().splitlines():
+            # Key: IDMAP/UID2SID/<id>   Value: <SID>   Timeout: ...
+            parts = line.split()
+            sid = parts[3] if len(parts) > 3 and parts[2] == 'Value:' and parts[3].startswith('S-') else None
+
             if line.startswith('Key: IDMAP/UID2SID'):
-                cached_uid = int((line.split())[1][14:])
+                cached_uid = int(parts[1][14:])
                 """
                 Do not cache local users. This is to avoid problems where a local user
                 may enter into the id range allotted to AD users.
@@ -1304,7 +1307,8 @@ class ActiveDirectoryService(ConfigService):
                                 'groups': [],
                                 'sshpubkey': None,
                                 'local': False,
-                                'id_type_both': d['id_type_both']
+                                'id_type_both': d['id_type_both'],
+                                'sid': sid,
                             }})
                             user_next_index += 1
                             break
@@ -1312,7 +1316,7 @@ class ActiveDirectoryService(ConfigService):
                             break
 
             if line.startswith('Key: IDMAP/GID2SID'):
-                cached_gid = int((line.split())[1][14:])
+                cached_gid = int(parts[1][14:])
                 if local_groups.get(cached_gid, None):
                     continue
 
@@ -1338,19 +1342,16 @@ class ActiveDirectoryService(ConfigService):
                             'sudo': False,
                             'users': [],
                             'local': False,
-                            'id_type_both': d['id_type_both']
+                            'id_type_both': d['id_type_both'],
+                            'sid': sid,
                         }})
                         group_next_index += 1
                         break
 
         if not cache_data.get('users'):
             return
-        sorted_cache = {}
-        sorted_cache['users'] = dict(sorted(cache_data['users'].items()))
-        sorted_cache['groups'] = dict(sorted(cache_data['groups'].items()))
 
-        self.middleware.call_sync('cache.put', 'AD_cache', sorted_cache)
-        self.middleware.call_sync('dscache.backup')
+        self.middleware.call_sync('dscache.fill', 'activedirectory', cache_data)
 
     @private
     async def get_cache(self):
@@ -1361,11 +1362,11 @@ class ActiveDirectoryService(ConfigService):
         last filled. The cache expires and is refilled every 24 hours, or can be
         manually refreshed by calling fill_cache(True).
         """
-        if not await self.middleware.call('cache.has_key', 'AD_cache'):
+        if not await self.middleware.call('dscache.has_cache', 'activedirectory'):
             await self.middleware.call('activedirectory.fill_cache')
             self.logger.debug('cache fill is in progress.')
             return {'users': {}, 'groups': {}}
-        return await self.middleware.call('cache.get', 'AD_cache')
+        return await self.middleware.call('dscache.get_cache', 'activedirectory')
 
 
 class WBStatusThread(threading.Thread):
@@ -42,6 +42,7 @@ class AFPService(SystemServiceService):
         service = 'afp'
         datastore_extend = 'afp.extend'
         datastore_prefix = 'afp_srv_'
+        datastore_cache = True
 
     @private
     async def extend(self, afp):
@@ -152,6 +153,7 @@ class SharingAFPService(SharingService):
         datastore = 'sharing.afp_share'
         datastore_prefix = 'afp_'
         datastore_extend = 'sharing.afp.extend'
+        datastore_cache = True
 
     @accepts(Dict(
         'sharingafp_create',
@@ -1,3 +1,4 @@
+import asyncio
 from collections import defaultdict, namedtuple
 import copy
 from datetime import datetime, timezone
@@ -42,6 +43,9 @@ DEFAULT_POLICY = "IMMEDIATELY"
 ALERT_SOURCES = {}
 ALERT_SERVICES_FACTORIES = {}
 
+# How many alert sources are checked at the same time
+ALERT_SOURCES_CONCURRENCY = 4
+
 AlertSourceLock = namedtuple("AlertSourceLock", ["source_name", "expires_at"])
 
 
@@ -105,6 +109,81 @@ class TestAlertClass(AlertClass):
     exclude_from_list = True
 
 
+class AlertStore:
+    """
+    Alerts indexed by uuid, by `(node, source, klass, key)` and by source. Iterates in the order alerts were added.
+    """
+
+    def __init__(self, alerts=None):
+        self.alerts = {}
+        self.identities = {}
+        self.sources = defaultdict(dict)
+
+        for alert in alerts or []:
+            self.add(alert)
+
+    def __iter__(self):
+        # Alerts may be added or removed while the caller iterates
+        return iter(list(self.alerts.values()))
+
+    def __len__(self):
+        return len(self.alerts)
+
+    def get(self, uuid):
+        return self.alerts.get(uuid)
+
+    def get_existing(self, alert):
+        """
+        Returns the alert `alert` is a new occurrence of.
+        """
+        return self.identities.get(self._identity(alert))
+
+    def by_source(self, source):
+        return list(self.sources.get(source, {}).values())
+
+    def add(self, alert):
+        existing_alert = self.alerts.get(alert.uuid)
+        if existing_alert is not None:
+            self._remove(existing_alert)
+
+        self._add(alert)
+
+    def remove(self, alert):
+        alert = self.alerts.get(alert.uuid)
+        if alert is not None:
+            self._remove(alert)
+
+    def replace_source(self, source, alerts):
+        """
+        Replace all alerts of `source` with `alerts`.
+        """
+        for alert in self.by_source(source):
+            self._remove(alert)
+
+        for alert in alerts:
+            self.add(alert)
+
+    def _add(self, alert):
+        self.alerts[alert.uuid] = alert
+        self.identities[self._identity(alert)] = alert
+        self.sources[alert.source][alert.uuid] = alert
+
+    def _remove(self, alert):
+        del self.alerts[alert.uuid]
+
+        identity = self._identity(alert)
+        if self.identities.get(identity) is alert:
+            del self.identities[identity]
+
+        source_alerts = self.sources[alert.source]
+        source_alerts.pop(alert.uuid, None)
+        if not source_alerts:
+            del self.sources[alert.source]
+
+    def _identity(self, alert):
+        return alert.node, alert.source, alert.klass, alert.key
+
+
 class AlertPolicy:
     def __init__(self, key=lambda now: now):
         self.key = key
@@ -170,6 +249,10 @@ class AlertService(Service):
 
         self.blocked_failover_alerts_until = 0
 
+        self.alert_source_checks = {}
+        self.alert_source_stats = defaultdict(lambda: {"runs": 0, "timeouts": 0, "last_duration": None,
+                                                       "total_duration": 0})
+
     @private
     async def load(self):
         is_freenas = await self.middleware.call("system.is_freenas")
@@ -201,7 +284,7 @@ class AlertService(Service):
             if await self.middleware.call("failover.node") == "B":
                 self.node = "B"
 
-        self.alerts = []
+        self.alerts = AlertStore()
         if load:
             for alert in await self.middleware.call("datastore.query", "system.alert"):
                 del alert["id"]
@@ -219,8 +302,8 @@ class AlertService(Service):
 
                 alert = Alert(**alert)
 
-                if not any(a.uuid == alert.uuid for a in self.alerts):
-                    self.alerts.append(alert)
+                if self.alerts.get(alert.uuid) is None:
+                    self.alerts.add(alert)
 
         self.alert_source_last_run = defaultdict(lambda: datetime.min)
 
@@ -277,7 +360,31 @@ class AlertService(Service):
         ]
 
     @private
-    async def list_sources(self):
+    async def list_sources(self, stats=False):
+        """
+        With `stats` set, list all alert sources along with how long their checks take.
+        """
+        if stats:
+            return [
+                {
+                    "name": alert_source.name,
+                    "last_run": (
+                        None if self.alert_source_last_run[alert_source.name] == datetime.min
+                        else self.alert_source_last_run[alert_source.name]
+                    ),
+                    "last_duration": self.alert_source_stats[alert_source.name]["last_duration"],
+                    "average_duration": (
+                        self.alert_source_stats[alert_source.name]["total_duration"] /
+                        self.alert_source_stats[alert_source.name]["runs"]
+                        if self.alert_source_stats[alert_source.name]["runs"] else None
+                    ),
+                    "runs": self.alert_source_stats[alert_source.name]["runs"],
+                    "timeouts": self.alert_source_stats[alert_source.name]["timeouts"],
+                    "run_timeout": alert_source.run_timeout,
+                }
+                for alert_source in sorted(ALERT_SOURCES.values(), key=lambda alert_source: alert_source.name)
+            ]
+
         # TODO: this is a deprecated method for backward compatibility
 
         return [
@@ -326,19 +433,13 @@ class AlertService(Service):
 
         return nodes
 
-    def __alert_by_uuid(self, uuid):
-        try:
-            return [a for a in self.alerts if a.uuid == uuid][0]
-        except IndexError:
-            return None
-
     @accepts(Str("uuid"))
     async def dismiss(self, uuid):
         """
         Dismiss `id` alert.
         """
 
-        alert = self.__alert_by_uuid(uuid)
+        alert = self.alerts.get(uuid)
         if alert is None:
             return
 
@@ -369,7 +470,7 @@ class AlertService(Service):
         Restore `id` alert which had been dismissed.
         """
 
-        alert = self.__alert_by_uuid(uuid)
+        alert = self.alerts.get(uuid)
         if alert is None:
             return
 
@@ -559,6 +660,7 @@ class AlertService(Service):
             if source_lock.expires_at <= time.monotonic():
                 await self.unblock_source(k)
 
+        alert_sources = []
         for alert_source in ALERT_SOURCES.values():
             if product_type not in alert_source.products:
                 continue
@@ -571,79 +673,106 @@ class AlertService(Service):
 
             self.alert_source_last_run[alert_source.name] = datetime.utcnow()
 
-            alerts_a = [alert
-                        for alert in self.alerts
-                        if alert.node == master_node and alert.source == alert_source.name]
-            locked = False
-            if self.blocked_sources[alert_source.name]:
-                self.logger.debug("Not running alert source %r because it is blocked", alert_source.name)
-                locked = True
-            else:
-                self.logger.trace("Running alert source: %r", alert_source.name)
+            alert_sources.append(alert_source)
 
-                try:
-                    alerts_a = await self.__run_source(alert_source.name)
-                except UnavailableException:
-                    pass
-            for alert in alerts_a:
-                alert.node = master_node
+        semaphore = asyncio.Semaphore(ALERT_SOURCES_CONCURRENCY)
 
-            alerts_b = []
-            if run_on_backup_node and alert_source.run_on_backup_node:
-                try:
-                    alerts_b = [alert
-                                for alert in self.alerts
-                                if alert.node == backup_node and alert.source == alert_source.name]
-                    try:
-                        if not locked:
-                            alerts_b = await self.middleware.call("failover.call_remote", "alert.run_source",
-                                                                  [alert_source.name])
-
-                            alerts_b = [Alert(**dict({k: v for k, v in alert.items()
-                                                      if k in ["args", "datetime", "last_occurrence", "dismissed",
-                                                               "mail"]},
-                                                     klass=AlertClass.class_by_name[alert["klass"]],
-                                                     _source=alert["source"],
-                                                     _key=alert["key"]))
-                                        for alert in alerts_b]
-                    except CallError as e:
-                        if e.errno in [errno.ECONNABORTED, errno.ECONNREFUSED, errno.ECONNRESET, errno.EHOSTDOWN,
-                                       errno.ETIMEDOUT, CallError.EALERTCHECKERUNAVAILABLE]:
-                            pass
-                        else:
-                            raise
-                except ReserveFDException:
-                    self.logger.debug('Failed to reserve a privileged port')
-                except Exception:
-                    alerts_b = [
-                        Alert(AlertSourceRunFailedOnBackupNodeAlertClass,
-                              args={
-                                  "source_name": alert_source.name,
-                                  "traceback": traceback.format_exc(),
-                              },
-                              _source=alert_source.name)
-                    ]
-
-            for alert in alerts_b:
-                alert.node = backup_node
+        async def run_alert_source(alert_source):
+            async with semaphore:
+                return await self.__run_alert_source(alert_source, master_node, backup_node, run_on_backup_node)
 
+        # Alert sources are checked concurrently but their results are applied in the usual order
+        results = await asyncio.gather(*[run_alert_source(alert_source) for alert_source in alert_sources])
+        for alert_source, (alerts_a, alerts_b) in zip(alert_sources, results):
+            changed_alerts = []
             for alert in alerts_a + alerts_b:
+                existing_alert = self.alerts.get_existing(alert)
+                if (
+                    existing_alert is not None and existing_alert is not alert and
+                    (existing_alert.args, existing_alert.text) != (alert.args, alert.text)
+                ):
+                    changed_alerts.append(alert)
+
                 self.__handle_alert(alert)
 
-            self.alerts = (
-                [a for a in self.alerts if a.source != alert_source.name] +
-                alerts_a +
-                alerts_b
-            )
+            self.alerts.replace_source(alert_source.name, alerts_a + alerts_b)
+
+            # New and gone alerts are announced by `send_alerts`, we only need to tell about the ones that were updated
+            for alert in changed_alerts:
+                await self._send_alert_changed_event(alert)
+
+    async def __run_alert_source(self, alert_source, master_node, backup_node, run_on_backup_node):
+        alerts_a = [alert
+                    for alert in self.alerts.by_source(alert_source.name)
+                    if alert.node == master_node]
+        locked = False
+        if self.blocked_sources[alert_source.name]:
+            self.logger.debug("Not running alert source %r because it is blocked", alert_source.name)
+            locked = True
+        else:
+            self.logger.trace("Running alert source: %r", alert_source.name)
+
+            try:
+                alerts_a = await self.__run_source(alert_source.name)
+            except UnavailableException:
+                pass
+        for alert in alerts_a:
+            alert.node = master_node
+
+        alerts_b = []
+        if run_on_backup_node and alert_source.run_on_backup_node:
+            try:
+                alerts_b = [alert
+                            for alert in self.alerts.by_source(alert_source.name)
+                            if alert.node == backup_node]
+                try:
+                    if not locked:
+                        alerts_b = await asyncio.wait_for(
+                            self.middleware.call("failover.call_remote", "alert.run_source", [alert_source.name]),
+                            alert_source.run_timeout,
+                        )
+
+                        alerts_b = [Alert(**dict({k: v for k, v in alert.items()
+                                                  if k in ["args", "datetime", "last_occurrence", "dismissed",
+                                                           "mail"]},
+                                                 klass=AlertClass.class_by_name[alert["klass"]],
+                                                 _source=alert["source"],
+                                                 _key=alert["key"]))
+                                    for alert in alerts_b]
+                except CallError as e:
+                    if e.errno in [errno.ECONNABORTED, errno.ECONNREFUSED, errno.ECONNRESET, errno.EHOSTDOWN,
+                                   errno.ETIMEDOUT, CallError.EALERTCHECKERUNAVAILABLE]:
+                        pass
+                    else:
+                        raise
+            except ReserveFDException:
+                self.logger.debug('Failed to reserve a privileged port')
+            except asyncio.TimeoutError:
+                alerts_b = [
+                    Alert(AlertSourceRunFailedOnBackupNodeAlertClass,
+                          args={
+                              "source_name": alert_source.name,
+                              "traceback": f"Timed out after {alert_source.run_timeout} seconds",
+                          },
+                          _source=alert_source.name)
+                ]
+            except Exception:
+                alerts_b = [
+                    Alert(AlertSourceRunFailedOnBackupNodeAlertClass,
+                          args={
+                              "source_name": alert_source.name,
+                              "traceback": traceback.format_exc(),
+                          },
+                          _source=alert_source.name)
+                ]
+
+        for alert in alerts_b:
+            alert.node = backup_node
+
+        return alerts_a, alerts_b
 
     def __handle_alert(self, alert):
-        try:
-            existing_alert = [
-                a for a in self.alerts
-                if (a.node, a.source, a.klass, a.key) == (alert.node, alert.source, alert.klass, alert.key)
-            ][0]
-        except IndexError:
-            existing_alert = None
+        existing_alert = self.alerts.get_existing(alert)
 
         if existing_alert is None:
             alert.uuid = self.__uuid()
@@ -662,7 +791,9 @@ class AlertService(Service):
             alert.dismissed = existing_alert.dismissed
 
     def __expire_alerts(self):
-        self.alerts = list(filter(lambda alert: not self.__should_expire_alert(alert), self.alerts))
+        for alert in self.alerts:
+            if self.__should_expire_alert(alert):
+                self.alerts.remove(alert)
 
     def __should_expire_alert(self, alert):
         if issubclass(alert.klass, OneShotAlertClass):
@@ -703,10 +834,27 @@ class AlertService(Service):
     async def __run_source(self, source_name):
         alert_source = ALERT_SOURCES[source_name]
 
+        # A check that timed out is not cancelled (threads can't be) so we must not start another one until it is done
+        check = self.alert_source_checks.get(source_name)
+        if check is None or check.done():
+            check = self.alert_source_checks[source_name] = asyncio.ensure_future(alert_source.check())
+            check.add_done_callback(self.__alert_source_check_done)
+
+        stats = self.alert_source_stats[source_name]
+        started = time.monotonic()
         try:
-            alerts = (await alert_source.check()) or []
+            alerts = (await asyncio.wait_for(asyncio.shield(check), alert_source.run_timeout)) or []
         except UnavailableException:
             raise
+        except asyncio.TimeoutError:
+            stats["timeouts"] += 1
+            alerts = [
+                Alert(AlertSourceRunFailedAlertClass,
+                      args={
+                          "source_name": alert_source.name,
+                          "traceback": f"Timed out after {alert_source.run_timeout} seconds",
+                      })
+            ]
         except Exception as e:
             if isinstance(e, CallError) and e.errno in [errno.ECONNABORTED, errno.ECONNREFUSED, errno.ECONNRESET,
                                                         errno.EHOSTDOWN, errno.ETIMEDOUT]:
@@ -728,12 +876,21 @@ class AlertService(Service):
         else:
             if not isinstance(alerts, list):
                 alerts = [alerts]
+        finally:
+            stats["runs"] += 1
+            stats["last_duration"] = time.monotonic() - started
+            stats["total_duration"] += stats["last_duration"]
 
         for alert in alerts:
             alert.source = source_name
 
         return alerts
 
+    def __alert_source_check_done(self, check):
+        # Do not let asyncio complain about exceptions of checks nobody waits for anymore
+        if not check.cancelled():
+            check.exception()
+
     @periodic(3600, run_on_start=False)
     @private
     async def flush_alerts(self):
@@ -775,7 +932,7 @@ class AlertService(Service):
 
         self.__handle_alert(alert)
 
-        self.alerts = [a for a in self.alerts if a.uuid != alert.uuid] + [alert]
+        self.alerts.add(alert)
 
         await self.middleware.call("alert.send_alerts")
 
@@ -7,6 +7,7 @@ from passlib.hash import pbkdf2_sha256
 from middlewared.schema import accepts, Bool, Dict, Int, Str, Patch
 from middlewared.service import CRUDService, private, ValidationErrors
 from middlewared.service_exception import MatchNotFound
+from middlewared.utils.credential_cache import CREDENTIAL_CACHE
 import middlewared.sqlalchemy as sa
 
 
@@ -95,6 +96,9 @@ class ApiKeyService(CRUDService):
             new,
         )
 
+        if reset:
+            await self.middleware.call("auth.invalidate_credentials", "api_key", id)
+
         return self._serve(await self._get_instance(id), key)
 
     @accepts(
@@ -110,6 +114,8 @@ class ApiKeyService(CRUDService):
             id
         )
 
+        await self.middleware.call("auth.invalidate_credentials", "api_key", id)
+
         return response
 
     @private
@@ -120,6 +126,10 @@ class ApiKeyService(CRUDService):
         except ValueError:
             return None
 
+        hit, db_key, generation = CREDENTIAL_CACHE.get("api_key", key_id, key)
+        if hit:
+            return db_key
+
         try:
             db_key = await self.middleware.call("datastore.query", "account.api_key", [("id", "=", key_id)],
                                                 {"get": True})
@@ -129,6 +139,7 @@ class ApiKeyService(CRUDService):
         if not pbkdf2_sha256.verify(key, db_key["key"]):
             return None
 
+        CREDENTIAL_CACHE.put("api_key", key_id, key, db_key, generation)
         return db_key
 
     async def _validate(self, schema_name, data, id=None):
@@ -14,6 +14,7 @@ from middlewared.service import (
 )
 import middlewared.sqlalchemy as sa
 from middlewared.utils import osc, Popen
+from middlewared.utils.credential_cache import CREDENTIAL_CACHE
 from middlewared.validators import Range
 
 
@@ -264,6 +265,11 @@ class AuthService(Service):
         """
         if username != 'root':
             return False
+
+        hit, valid, generation = CREDENTIAL_CACHE.get('password', username, password)
+        if hit:
+            return valid
+
         try:
             user = await self.middleware.call('datastore.query', 'account.bsdusers',
                                               [('bsdusr_username', '=', username)], {'get': True})
@@ -271,7 +277,26 @@ class AuthService(Service):
             return False
         if user['bsdusr_unixhash'] in ('x', '*'):
             return False
-        return crypt.crypt(password, user['bsdusr_unixhash']) == user['bsdusr_unixhash']
+        if crypt.crypt(password, user['bsdusr_unixhash']) != user['bsdusr_unixhash']:
+            return False
+
+        CREDENTIAL_CACHE.put('password', username, password, True, generation)
+        return True
+
+    @private
+    def invalidate_credentials(self, kind, identity=None):
+        """
+        Forget verified credentials of `kind` (`password` or `api_key`), optionally only those of `identity`.
+        """
+        CREDENTIAL_CACHE.invalidate(kind, identity)
+
+    @private
+    def credential_cache_stats(self):
+        with CREDENTIAL_CACHE.lock:
+            return {
+                'size': len(CREDENTIAL_CACHE.entries),
+                'stats': {kind: dict(stats) for kind, stats in CREDENTIAL_CACHE.stats.items()},
+            }
 
     @accepts(Int('ttl', default=600, null=True), Dict('attrs', additional_attrs=True))
     def generate_token(self, ttl=None, attrs=None):
@@ -3,10 +3,31 @@ from middlewared.service import Service, private
 from middlewared.utils import filter_list
 
 from collections import namedtuple
+import bisect
+import contextlib
+import json
+import os
 import time
 import pickle
 import pwd
 import grp
+import sqlite3
+import threading
+
+DSCACHE_DB = '/var/db/system/.dscache.db'
+DIRECTORY_SERVICES = [('activedirectory', 'AD'), ('ldap', 'LDAP'), ('nis', 'NIS')]
+
+
+def convert_legacy_cache(cache_data):
+    """
+    NIS cache backups written by previous versions store users and groups as lists of `{name: entry}` dicts.
+    """
+    return {
+        objtype: (
+            {name: entry for item in entries for name, entry in item.items()} if isinstance(entries, list) else entries
+        )
+        for objtype, entries in cache_data.items()
+    }
 
 
 class CacheService(Service):
@@ -88,11 +109,133 @@ class CacheService(Service):
             return value
 
 
+class DSCacheTable:
+    """
+    Users or groups of a single directory service, indexed by name, id (uid/gid) and SID.
+
+    Names are also kept sorted so that `^` (starts with) filters on them do not have to look at every entry.
+    """
+
+    def __init__(self, name_key, id_key):
+        self.name_key = name_key
+        self.id_key = id_key
+        self.entries = {}
+        self.by_id = {}
+        self.by_sid = {}
+        self.names = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def update(self, entries):
+        """
+        Add or replace `entries`. Ids of entries that are already known are kept so that they remain stable
+        between fills.
+        """
+        next_id = max((entry['id'] for entry in self.entries.values()), default=0) + 1
+        ids = {entry['id'] for entry in self.entries.values()}
+        for entry in entries:
+            name = entry[self.name_key]
+            old = self.entries.get(name)
+            if old is not None:
+                entry['id'] = old['id']
+                self._unindex(old)
+            else:
+                if entry['id'] in ids:
+                    entry['id'] = next_id
+                bisect.insort(self.names, name)
+
+            next_id = max(next_id, entry['id'] + 1)
+            ids.add(entry['id'])
+            self.entries[name] = entry
+            self._index(entry)
+
+    def remove(self, names):
+        for name in names:
+            entry = self.entries.pop(name, None)
+            if entry is not None:
+                self._unindex(entry)
+                self.names.pop(bisect.bisect_left(self.names, name))
+
+    def diff(self, entries):
+        """
+        Returns entries from `entries` that are new or have changed (ignoring the id) and names that are gone.
+        """
+        changed = []
+        for name, entry in entries.items():
+            old = self.entries.get(name)
+            if old is None or dict(old, id=None) != dict(entry, id=None):
+                changed.append(entry)
+
+        return changed, [name for name in self.entries if name not in entries]
+
+    def candidates(self, filters):
+        """
+        Returns entries that might match `filters` using the indexes, or all the entries if no index applies.
+        """
+        for f in filters:
+            if len(f) != 3:
+                continue
+
+            try:
+                result = self._index_lookup(*f)
+            except TypeError:
+                # Unhashable filter value, `filter_list` will deal with it
+                continue
+
+            if result is not None:
+                return result
+
+        return [self.entries[name] for name in self.names]
+
+    def _index_lookup(self, name, op, value):
+        if name == self.name_key:
+            if op == '=':
+                return [self.entries[value]] if value in self.entries else []
+            if op == 'in':
+                return [self.entries[v] for v in dict.fromkeys(value) if v in self.entries]
+            if op == '^' and isinstance(value, str):
+                result = []
+                for i in range(bisect.bisect_left(self.names, value), len(self.names)):
+                    if not self.names[i].startswith(value):
+                        break
+                    result.append(self.entries[self.names[i]])
+                return result
+
+        for key, index in ((self.id_key, self.by_id), ('sid', self.by_sid)):
+            if name == key:
+                if op == '=':
+                    return [self.entries[index[value]]] if value in index else []
+                if op == 'in':
+                    return [self.entries[index[v]] for v in dict.fromkeys(value) if v in index]
+
+    def _index(self, entry):
+        self.by_id[entry[self.id_key]] = entry[self.name_key]
+        if entry.get('sid'):
+            self.by_sid[entry['sid']] = entry[self.name_key]
+
+    def _unindex(self, entry):
+        if self.by_id.get(entry[self.id_key]) == entry[self.name_key]:
+            self.by_id.pop(entry[self.id_key])
+        if entry.get('sid') and self.by_sid.get(entry['sid']) == entry[self.name_key]:
+            self.by_sid.pop(entry['sid'])
+
+
 class DSCache(Service):
 
     class Config:
         private = True
 
+    OBJTYPES = {
+        'users': ('username', 'uid'),
+        'groups': ('group', 'gid'),
+    }
+
+    def __init__(self, *args, **kwargs):
+        super(DSCache, self).__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+        self.tables = {}
+
     def get_uncached_user(self, username=None, uid=None):
         """
         Returns dictionary containing pwd_struct data for
@@ -135,24 +278,129 @@ class DSCache(Service):
         }
 
     def initialize(self):
-        for ds in [('activedirectory', 'AD'), ('ldap', 'LDAP'), ('nis', 'NIS')]:
-            if self.middleware.call_sync(f'{ds[0]}.get_state') != 'DISABLED':
-                try:
-                    with open(f'/var/db/system/.{ds[1]}_cache_backup', 'rb') as f:
-                        pickled_cache = pickle.load(f)
-                    self.middleware.call_sync('cache.put', f'{ds[1]}_cache', pickled_cache)
-                except FileNotFoundError:
-                    self.logger.debug('User cache file for [%s] is not present.', ds[0])
-
-    def backup(self):
-        for ds in [('activedirectory', 'AD'), ('ldap', 'LDAP'), ('nis', 'NIS')]:
-            if self.middleware.call_sync(f'{ds[0]}.get_state') != 'DISABLED':
+        with self.lock:
+            self.tables = {}
+
+        for dstype, legacy_name in DIRECTORY_SERVICES:
+            if self.middleware.call_sync(f'{dstype}.get_state') == 'DISABLED':
+                continue
+
+            try:
+                with self._db() as db:
+                    rows = db.execute(
+                        'SELECT objtype, data FROM dscache WHERE dstype = ?', (dstype,)
+                    ).fetchall()
+            except Exception:
+                self.logger.warning('Failed to load directory services cache for [%s]', dstype, exc_info=True)
+                continue
+
+            if rows:
+                cache_data = {objtype: {} for objtype in self.OBJTYPES}
+                for objtype, data in rows:
+                    entry = json.loads(data)
+                    cache_data[objtype][entry[self.OBJTYPES[objtype][0]]] = entry
+
+                with self.lock:
+                    for objtype, entries in cache_data.items():
+                        self._table(dstype, objtype).update(entries.values())
+
+                continue
+
+            # Migrate cache backup written by previous versions
+            legacy_path = f'/var/db/system/.{legacy_name}_cache_backup'
+            try:
+                with open(legacy_path, 'rb') as f:
+                    self.fill(dstype, convert_legacy_cache(pickle.load(f)))
+            except FileNotFoundError:
+                self.logger.debug('User cache file for [%s] is not present.', dstype)
+            except Exception:
+                self.logger.warning('Failed to migrate user cache file for [%s]', dstype, exc_info=True)
+            else:
+                os.unlink(legacy_path)
+
+    def has_cache(self, dstype):
+        with self.lock:
+            return any(key[0] == dstype for key in self.tables)
+
+    def get_cache(self, dstype):
+        """
+        Returns all cached users and groups of `dstype` as `{"users": {username: user}, "groups": {group: group}}`.
+        """
+        with self.lock:
+            return {
+                objtype: dict(self.tables[(dstype, objtype)].entries) if (dstype, objtype) in self.tables else {}
+                for objtype in self.OBJTYPES
+            }
+
+    def fill(self, dstype, cache_data):
+        """
+        Make cache of `dstype` contain exactly users and groups from `cache_data` (formatted like `get_cache` return
+        value). Only entries that were added, changed or removed are written to the persistent cache.
+        """
+        with self.lock:
+            upserts = []
+            deletes = []
+            for objtype in self.OBJTYPES:
+                table = self._table(dstype, objtype)
+                changed, removed = table.diff(cache_data.get(objtype) or {})
+                table.remove(removed)
+                table.update(changed)
+
+                upserts.extend((dstype, objtype, entry[table.name_key], json.dumps(entry)) for entry in changed)
+                deletes.extend((dstype, objtype, name) for name in removed)
+
+            if upserts or deletes:
                 try:
-                    ds_cache = self.middleware.call_sync('cache.get', f'{ds[1]}_cache')
-                    with open(f'/var/db/system/.{ds[1]}_cache_backup', 'wb') as f:
-                        pickle.dump(ds_cache, f)
-                except KeyError:
-                    self.logger.debug('No cache exists for directory service [%s].', ds[0])
+                    with self._db() as db:
+                        db.executemany('DELETE FROM dscache WHERE dstype = ? AND objtype = ? AND name = ?', deletes)
+                        db.executemany('INSERT OR REPLACE INTO dscache VALUES (?, ?, ?, ?)', upserts)
+                except Exception:
+                    self.logger.warning('Failed to persist directory services cache for [%s]', dstype, exc_info=True)
+
+            self.logger.debug(
+                'Directory services cache for [%s]: %d entries written, %d removed', dstype, len(upserts), len(deletes),
+            )
+
+    def drop(self, dstype):
+        with self.lock:
+            for objtype in self.OBJTYPES:
+                self.tables.pop((dstype, objtype), None)
+
+            try:
+                with self._db() as db:
+                    db.execute('DELETE FROM dscache WHERE dstype = ?', (dstype,))
+            except Exception:
+                self.logger.warning('Failed to drop persistent directory services cache for [%s]', dstype,
+                                    exc_info=True)
+
+    def _table(self, dstype, objtype):
+        key = (dstype, objtype)
+        if key not in self.tables:
+            self.tables[key] = DSCacheTable(*self.OBJTYPES[objtype])
+        return self.tables[key]
+
+    @contextlib.contextmanager
+    def _db(self):
+        db = sqlite3.connect(DSCACHE_DB)
+        try:
+            with db:
+                db.execute(
+                    'CREATE TABLE IF NOT EXISTS dscache '
+                    '(dstype TEXT, objtype TEXT, name TEXT, data TEXT, PRIMARY KEY (dstype, objtype, name))'
+                )
+                yield db
+        finally:
+            db.close()
+
+    def _query_table(self, dstype, objtype, filters):
+        with self.lock:
+            table = self.tables.get((dstype, objtype))
+            if table is None:
+                return []
+
+            candidates = table.candidates(filters)
+
+        return filter_list(candidates, filters)
 
     async def query(self, objtype='USERS', filters=None, options=None):
         """
@@ -174,33 +422,34 @@ class DSCache(Service):
         will be populated in UI dropdowns). In the case of other directory services, the
         users and groups will simply not appear in query results (UI features).
 
+        Filters on names (`=`, `in` and `^`), ids and SIDs (`=` and `in`) are served from indexes.
+        `query-options` (including `offset` and `limit`) apply to local and directory services
+        entries together.
         """
-        res = []
-        ds_state = await self.middleware.call('directoryservices.get_state')
+        filters = filters or []
+        options = options or {}
 
-        is_name_check = bool(filters and len(filters) == 1 and filters[0][0] in ['username', 'groupname'])
+        local_options = {}
+        if objtype == 'USERS':
+            local_options['extra'] = {
+                'sshpubkey': 'sshpubkey' in (options.get('select') or []) or bool(options.get('get')),
+            }
 
-        res.extend((await self.middleware.call(f'{objtype.lower()[:-1]}.query', filters, options)))
+        res = await self.middleware.call(f'{objtype.lower()[:-1]}.query', filters, local_options)
+
+        ds_state = await self.middleware.call('directoryservices.get_state')
+        for dstype, legacy_name in DIRECTORY_SERVICES:
+            if ds_state.get(dstype, 'DISABLED') == 'DISABLED':
+                continue
 
-        for dstype, state in ds_state.items():
-            if state != 'DISABLED':
-                """
-                Avoid iteration here if possible.  Use keys if single filter "=" and x in x=y is a
-                username or groupname.
-                """
-                if is_name_check and filters[0][1] == '=':
-                    cache = (await self.middleware.call(f'{dstype}.get_cache'))[objtype.lower()]
-                    name = filters[0][2]
-                    return [cache.get(name)] if cache.get(name) else []
+            if not await self.middleware.call('dscache.has_cache', dstype):
+                # This will start filling the cache in the background
+                await self.middleware.call(f'{dstype}.get_cache')
+                continue
 
-                else:
-                    res.extend(filter_list(
-                        list((await self.middleware.call(f'{dstype}.get_cache'))[objtype.lower()].values()),
-                        filters,
-                        options
-                    ))
+            res.extend(await self.middleware.run_in_thread(self._query_table, dstype, objtype.lower(), filters))
 
-        return res
+        return await self.middleware.run_in_thread(filter_list, res, [], options)
 
     async def refresh(self):
         """
@@ -213,7 +462,6 @@ class DSCache(Service):
                 await self.middleware.call(f'{ds}.fill_cache', True)
             elif ds_state != 'DISABLED':
                 self.logger.debug('Unable to refresh [%s] cache, state is: %s' % (ds, ds_state))
-        await self.middleware.call('dscache.backup')
 
 
 async def setup(middleware):
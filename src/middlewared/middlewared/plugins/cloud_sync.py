@@ -3,35 +3,40 @@ from middlewared.common.attachment import LockableFSAttachmentDelegate
 from middlewared.rclone.base import BaseRcloneRemote
 from middlewared.schema import accepts, Bool, Cron, Dict, Int, List, Patch, Str
 from middlewared.service import (
-    CallError, CRUDService, ValidationErrors, filterable, item_method, job, private, TaskPathService,
+    CallError, CRUDService, ValidationErrors, filterable, item_method, job, periodic, private, TaskPathService,
 )
 import middlewared.sqlalchemy as sa
-from middlewared.utils import load_modules, load_classes, Popen, run
+from middlewared.utils import load_modules, load_classes, osc, Popen
 from middlewared.utils.python import get_middlewared_dir
 from middlewared.validators import Range, Time
 from middlewared.validators import validate_attributes
 
+import aiohttp
 import aiorwlock
 import asyncio
 import base64
 import codecs
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 import configparser
+from contextlib import asynccontextmanager
 from Crypto import Random
 from Crypto.Cipher import AES
 from Crypto.Util import Counter
+import copy
 from datetime import datetime
 import enum
+import hashlib
+import humanfriendly
 import json
 import logging
 import os
 import re
+import secrets
 import shlex
 import subprocess
 import tempfile
 import textwrap
-
-RE_TRANSF = re.compile(r"Transferred:\s*(?P<progress_1>.+, )(?P<progress>[0-9]+)%, (?P<progress_2>.+)$", re.S)
+import time
 
 REMOTES = {}
 
@@ -143,6 +148,7 @@ async def rclone(middleware, job, cloud_sync, dry_run=False):
             "--config", config.config_path,
             "-v",
             "--stats", "1s",
+            "--use-json-log",
         ]
 
         if cloud_sync["attributes"].get("fast_list"):
@@ -293,112 +299,140 @@ async def run_script_check(job, proc, name):
         job.logs_fd.write(f"[{name}] ".encode("utf-8") + read)
 
 
-# Prevents clogging job logs with progress reports every second
-class RcloneVerboseLogCutter:
-    PREFIXES = (
-        re.compile(r"[0-9]{4}/[0-9]{2}/[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2} INFO {2}:"),
-        re.compile(r"Transferred:\s+"),
-        re.compile(r"Errors:\s+"),
-        re.compile(r"Checks:\s+"),
-        re.compile(r"Transferred:\s+"),
-        re.compile(r"Elapsed time:\s+"),
-        re.compile(r"Transferring:"),
-    )
+class RcloneJsonLogReader:
+    """
+    Turns `--use-json-log` output of rclone into job log text and job progress.
+
+    Stats are reported every second, but only every `interval` reports are written to the job log so that it is not
+    clogged with them.
+    """
+
+    RE_TIME = re.compile(r"([0-9]{4})-([0-9]{2})-([0-9]{2})T([0-9]{2}:[0-9]{2}:[0-9]{2})")
 
     def __init__(self, interval):
         self.interval = interval
 
-        self.buffer = []
         self.counter = 0
+        self.previous_stats = None
 
     def notify(self, line):
-        if self.buffer:
-            # We are currently reading progress message
-
-            self.buffer.append(line)
-
-            if line.rstrip("\n"):
-                # We are still reading message
+        """
+        Returns `(text, progress)` where `text` should be written to the job log (if not `None`) and `progress` is
+        `job.set_progress` arguments (if not `None`).
+        """
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            entry = None
+
+        if not isinstance(entry, dict):
+            # Not everything rclone outputs is structured (i.e. Go runtime panics)
+            return line, None
+
+        text = self._format(entry)
+
+        stats = entry.get("stats")
+        if not isinstance(stats, dict):
+            return text, None
+
+        if self.counter % self.interval != 0:
+            text = None
+        self.counter += 1
+
+        return text, self.progress(stats)
+
+    def progress(self, stats):
+        bytes_ = stats.get("bytes") or 0
+        total_bytes = stats.get("totalBytes") or 0
+        speed = stats.get("speed") or 0
+        eta = stats.get("eta")
+
+        files_per_second = 0
+        elapsed_time = stats.get("elapsedTime") or 0
+        if self.previous_stats is not None:
+            interval = elapsed_time - (self.previous_stats.get("elapsedTime") or 0)
+            if interval > 0:
+                files_per_second = max(
+                    (stats.get("transfers") or 0) - (self.previous_stats.get("transfers") or 0), 0
+                ) / interval
+        elif elapsed_time > 0:
+            files_per_second = (stats.get("transfers") or 0) / elapsed_time
+        self.previous_stats = stats
+
+        if total_bytes:
+            percent = min(int(bytes_ * 100 / total_bytes), 100)
+            description = (
+                f"{humanfriendly.format_size(bytes_, binary=True)} / "
+                f"{humanfriendly.format_size(total_bytes, binary=True)}, "
+            )
+        else:
+            # Not known yet
+            percent = None
+            description = f"{humanfriendly.format_size(bytes_, binary=True)}, "
+        description += f"{humanfriendly.format_size(speed, binary=True)}/s"
+        if eta is not None:
+            description += f", ETA {humanfriendly.format_timespan(eta)}"
+
+        return percent, description, {
+            "bytes": bytes_,
+            "total_bytes": total_bytes,
+            "bytes_per_second": speed,
+            "transfers": stats.get("transfers") or 0,
+            "total_transfers": stats.get("totalTransfers") or 0,
+            "files_per_second": files_per_second,
+            "checks": stats.get("checks") or 0,
+            "total_checks": stats.get("totalChecks") or 0,
+            "errors": stats.get("errors") or 0,
+            "elapsed_time": elapsed_time,
+            "eta": eta,
+            "transferring": [
+                {
+                    "name": transfer.get("name"),
+                    "bytes": transfer.get("bytes") or 0,
+                    "size": transfer.get("size") or 0,
+                    "percent": transfer.get("percentage") or 0,
+                    "bytes_per_second": transfer.get("speed") or 0,
+                    "eta": transfer.get("eta"),
+                }
+                for transfer in stats.get("transferring") or []
+            ],
+        }
 
-                i = len(self.buffer) - 1
-                if i < len(self.PREFIXES):
-                    # Next line should match this
-                    matches = self.PREFIXES[i].match(line)
-                else:
-                    # Next line should be an individual file progress
-                    matches = line.startswith(" * ")
+    def _format(self, entry):
+        # Same as rclone non-JSON log format
+        prefix = f"{self._format_time(str(entry.get('time', '')))} {str(entry.get('level', '')).upper():<6}: "
+        if entry.get("object"):
+            prefix += f"{entry['object']}: "
 
-                if matches:
-                    # Good, consuming this line to buffer and yet not writing it to logs
-                    return None
-                else:
-                    # This was unexpected form of progress message (or not a progress message at all)
-
-                    new_buffer = []
-                    if self.PREFIXES[0].match(line):
-                        # This line can be start of new progress message, ejecting it from buffer
-                        self.buffer = self.buffer[:-1]
-                        # And adding to new buffer
-                        new_buffer = [line]
-
-                    # Writing buffer to logs
-                    try:
-                        return self.flush()
-                    finally:
-                        self.buffer = new_buffer
-            else:
-                # This message ends with newline
-                try:
-                    if self.counter % self.interval == 0:
-                        # Every {counter} times we still write this buffer to logs
-                        return "".join(self.buffer)
-                    else:
-                        return None
-                finally:
-                    # Resetting state, ready to consume next line
-                    self.buffer = []
-                    self.counter += 1
-        else:
-            # We are not reading progress message
+        return prefix + str(entry.get("msg", "")).rstrip("\n") + "\n"
 
-            if self.PREFIXES[0].match(line):
-                # This is the first line of progress message
-                self.buffer.append(line)
-                return None
-            else:
-                return line
+    def _format_time(self, time):
+        # JSON log time is RFC 3339 in rclone's local time zone, its plain text log has `YYYY/MM/DD HH:MM:SS` instead
+        m = self.RE_TIME.match(time)
+        if m is None:
+            return time
 
-    def flush(self):
-        try:
-            return "".join(self.buffer)
-        finally:
-            self.buffer = []
+        return f"{m.group(1)}/{m.group(2)}/{m.group(3)} {m.group(4)}"
 
 
 async def rclone_check_progress(job, proc):
-    cutter = RcloneVerboseLogCutter(300)
+    reader = RcloneJsonLogReader(300)
     dropbox__restricted_content = False
-    try:
-        while True:
-            read = (await proc.stdout.readline()).decode("utf-8", "ignore")
-            if read == "":
-                break
+    while True:
+        read = (await proc.stdout.readline()).decode("utf-8", "ignore")
+        if read == "":
+            break
 
-            if "failed to open source object: path/restricted_content/" in read:
-                job.internal_data["dropbox__restricted_content"] = True
-                dropbox__restricted_content = True
+        if "failed to open source object: path/restricted_content/" in read:
+            job.internal_data["dropbox__restricted_content"] = True
+            dropbox__restricted_content = True
 
-            result = cutter.notify(read)
-            if result:
-                job.logs_fd.write(result.encode("utf-8", "ignore"))
+        text, progress = reader.notify(read)
+        if text:
+            job.logs_fd.write(text.encode("utf-8", "ignore"))
 
-            reg = RE_TRANSF.search(read)
-            if reg:
-                job.set_progress(int(reg.group("progress")), reg.group("progress_1") + reg.group("progress_2"))
-    finally:
-        result = cutter.flush()
-        if result:
-            job.logs_fd.write(result.encode("utf-8", "ignore"))
+        if progress:
+            job.set_progress(*progress)
 
     if dropbox__restricted_content:
         message = "\n" + (
@@ -519,6 +553,248 @@ def lsjson_error_excerpt(error):
     return excerpt
 
 
+RCLONE_SESSION_KEY_SECRET = os.urandom(32)
+
+
+def rclone_session_key(config):
+    """
+    Digest of everything rclone remote configuration generated for `config` depends on except for the path being
+    accessed.
+
+    Keyed by a random per-process secret so that credentials can not be brute-forced from it.
+    """
+    key = {
+        "provider": config["credentials"]["provider"],
+        "credentials": config["credentials"]["attributes"],
+    }
+    if "attributes" in config:
+        key["attributes"] = {k: v for k, v in config["attributes"].items() if k not in ["bucket", "folder"]}
+        key["encryption"] = [config.get(k) for k in ["encryption", "filename_encryption", "encryption_password",
+                                                     "encryption_salt"]]
+
+    return hashlib.blake2b(json.dumps(key, sort_keys=True).encode("utf-8"), key=RCLONE_SESSION_KEY_SECRET,
+                           digest_size=32).hexdigest()
+
+
+class RcloneSession:
+    """
+    `rclone rcd` process serving remote control API on localhost for one rclone remote configuration.
+
+    Browsing a remote through a long-lived process saves spawning rclone and authenticating with the provider on
+    every call.
+    """
+
+    RE_URL = re.compile(r"Serving remote control on (http://[^/\s]+)")
+
+    def __init__(self, config):
+        self.rclone_config = RcloneConfig(config)
+        self.proc = None
+        self.session = None
+        self.url = None
+        self.used_at = time.monotonic()
+
+    @property
+    def alive(self):
+        return self.proc is not None and self.proc.returncode is None
+
+    async def start(self):
+        config = await self.rclone_config.__aenter__()
+        try:
+            user = secrets.token_hex(16)
+            password = secrets.token_hex(16)
+            # Pass remote control credentials through environment so that they are not visible in process list
+            self.proc = await Popen(
+                ["rclone", "--config", config.config_path, "rcd", "--rc-addr", "127.0.0.1:0"],
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                env=dict(os.environ, RCLONE_RC_USER=user, RCLONE_RC_PASS=password),
+                # Do not leave the server running if middlewared gets killed
+                preexec_fn=osc.die_with_parent if osc.IS_LINUX else None,
+            )
+            self.url = await asyncio.wait_for(self._read_url(), 30)
+        except BaseException:
+            await self.stop()
+            raise
+
+        self.session = aiohttp.ClientSession(auth=aiohttp.BasicAuth(user, password))
+        asyncio.ensure_future(self._log_output())
+        return self
+
+    async def call(self, method, params):
+        self.used_at = time.monotonic()
+        try:
+            async with self.session.post(f"{self.url}/{method}", json=params) as response:
+                status = response.status
+                text = await response.text()
+        except aiohttp.ClientError as e:
+            raise CallError(f"Error communicating with rclone: {e!r}")
+
+        try:
+            result = json.loads(text)
+        except ValueError:
+            result = {"error": text}
+
+        if status != 200:
+            error = result.get("error") or text
+            raise CallError(error, extra={"excerpt": lsjson_error_excerpt(error)})
+
+        return result
+
+    async def stop(self):
+        if self.session is not None:
+            await self.session.close()
+
+        if self.alive:
+            try:
+                self.proc.terminate()
+            except ProcessLookupError:
+                pass
+            await self.proc.wait()
+
+        await self.rclone_config.__aexit__(None, None, None)
+
+    async def _read_url(self):
+        output = ""
+        while True:
+            line = await self.proc.stderr.readline()
+            if not line:
+                await self.proc.wait()
+                raise CallError(f"rclone remote control server exited with code {self.proc.returncode}: {output}")
+
+            line = line.decode("utf-8", "ignore")
+            output += line
+            if m := self.RE_URL.search(line):
+                return m.group(1)
+
+    async def _log_output(self):
+        # rclone blocks once stderr pipe buffer is full so it has to be read
+        while line := await self.proc.stderr.readline():
+            logger.debug("rclone rcd: %s", line.decode("utf-8", "ignore").rstrip())
+
+
+class RcloneSessions:
+    """
+    Running `RcloneSession`s keyed by credentials id and `rclone_session_key`.
+
+    A session is stopped once it has not been used for `idle_timeout` seconds or its credentials have changed. At
+    most `size` sessions are kept running, unless more of them are in use at once. A session is never stopped while it
+    is in use: one that has to go is stopped by its last user instead.
+    """
+
+    def __init__(self, size=8, idle_timeout=300):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        # Session start tasks so that concurrent callers wait for the same session to start
+        self.sessions = OrderedDict()
+        # Number of callers using each session start task
+        self.in_use = {}
+        self.retired = set()
+
+    @asynccontextmanager
+    async def use(self, credentials_id, config):
+        key = (credentials_id, rclone_session_key(config))
+
+        task = self.sessions.get(key)
+        if task is not None and task.done() and (task.cancelled() or task.exception() or not task.result().alive):
+            asyncio.ensure_future(self._retire(self.sessions.pop(key)))
+            task = None
+
+        if task is None:
+            task = self.sessions[key] = asyncio.ensure_future(RcloneSession(config).start())
+            idle = [k for k, t in self.sessions.items() if k != key and t.done() and t not in self.in_use]
+            for old_key in idle[:max(len(self.sessions) - self.size, 0)]:
+                asyncio.ensure_future(self._stop(self.sessions.pop(old_key)))
+
+        self.sessions.move_to_end(key)
+        self.in_use[task] = self.in_use.get(task, 0) + 1
+        try:
+            yield await asyncio.shield(task)
+        finally:
+            self.in_use[task] -= 1
+            if not self.in_use[task]:
+                self.in_use.pop(task)
+                if task in self.retired:
+                    self.retired.discard(task)
+                    asyncio.ensure_future(self._stop(task))
+
+    async def invalidate(self, credentials_id):
+        for key in [key for key in self.sessions if key[0] == credentials_id]:
+            await self._retire(self.sessions.pop(key))
+
+    async def stop(self):
+        sessions = list(self.sessions.values()) + list(self.retired)
+        self.sessions.clear()
+        self.retired.clear()
+        await asyncio.gather(*[self._stop(task) for task in sessions])
+
+    async def reap(self):
+        now = time.monotonic()
+        for key, task in list(self.sessions.items()):
+            if not task.done() or task in self.in_use:
+                continue
+
+            if (
+                task.cancelled() or task.exception() or not task.result().alive or
+                now - task.result().used_at > self.idle_timeout
+            ):
+                await self._stop(self.sessions.pop(key))
+
+    async def _retire(self, task):
+        if task in self.in_use:
+            self.retired.add(task)
+        else:
+            await self._stop(task)
+
+    async def _stop(self, task):
+        try:
+            session = await task
+        except Exception:
+            return
+
+        await session.stop()
+
+
+class RemoteListingCache:
+    """
+    Short-lived cache of remote directory listings.
+
+    Entries are keyed by credentials id, `rclone_session_key` (which covers task attributes and encryption settings)
+    and path. They expire after `ttl` seconds and are dropped explicitly when credentials have changed or a task
+    using them has run.
+    """
+
+    def __init__(self, size=256, ttl=30):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def get(self, credentials_id, session_key, path):
+        key = (credentials_id, session_key, path)
+        entry = self.entries.get(key)
+        if entry is not None and time.monotonic() < entry[0]:
+            self.entries.move_to_end(key)
+            return copy.deepcopy(entry[1])
+
+        if entry is not None:
+            self.entries.pop(key)
+
+        return None
+
+    def put(self, credentials_id, session_key, path, listing):
+        key = (credentials_id, session_key, path)
+        self.entries[key] = (time.monotonic() + self.ttl, copy.deepcopy(listing))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, credentials_id):
+        for key in [key for key in self.entries if key[0] == credentials_id]:
+            self.entries.pop(key)
+
+
+RCLONE_SESSIONS = RcloneSessions()
+REMOTE_LISTING_CACHE = RemoteListingCache()
+
+
 class CloudCredentialModel(sa.Model):
     __tablename__ = 'system_cloudcredentials'
 
@@ -547,13 +823,18 @@ class CredentialsService(CRUDService):
         data = dict(data, name="")
         await self._validate("cloud_sync_credentials_create", data)
 
-        async with RcloneConfig({"credentials": data}) as config:
-            proc = await run(["rclone", "--config", config.config_path, "lsjson", "remote:"],
-                             check=False, encoding="utf8")
-            if proc.returncode == 0:
-                return {"valid": True}
-            else:
-                return {"valid": False, "error": proc.stderr, "excerpt": lsjson_error_excerpt(proc.stderr)}
+        # Credentials being verified are not saved yet, their session is not shared with anyone
+        session = RcloneSession({"credentials": data})
+        try:
+            await session.start()
+            try:
+                await session.call("operations/list", {"fs": "remote:", "remote": ""})
+            finally:
+                await session.stop()
+        except CallError as e:
+            return {"valid": False, "error": e.errmsg, "excerpt": lsjson_error_excerpt(e.errmsg)}
+        else:
+            return {"valid": True}
 
     @accepts(Dict(
         "cloud_sync_credentials_create",
@@ -603,6 +884,9 @@ class CredentialsService(CRUDService):
             new,
         )
 
+        await RCLONE_SESSIONS.invalidate(id)
+        REMOTE_LISTING_CACHE.invalidate(id)
+
         data["id"] = id
 
         return data
@@ -622,6 +906,9 @@ class CredentialsService(CRUDService):
             id,
         )
 
+        await RCLONE_SESSIONS.invalidate(id)
+        REMOTE_LISTING_CACHE.invalidate(id)
+
     async def _validate(self, schema_name, data, id=None):
         verrors = ValidationErrors()
 
@@ -675,6 +962,9 @@ class CloudSyncService(TaskPathService):
     remote_fs_lock_manager = FsLockManager()
     share_task_type = 'CloudSync'
 
+    # Names that are decrypted one by one when decrypting them all at once fails
+    DECRYPT_FILENAMES_CONCURRENCY = 8
+
     class Config:
         datastore = "tasks.cloudsync"
         datastore_extend = "cloudsync.extend"
@@ -1006,35 +1296,53 @@ class CloudSyncService(TaskPathService):
 
     @private
     async def ls(self, config, path):
-        decrypt_filenames = config.get("encryption") and config.get("filename_encryption")
-        async with RcloneConfig(config) as config:
-            proc = await run(["rclone", "--config", config.config_path, "lsjson", "remote:" + path],
-                             check=False, encoding="utf8", errors="ignore")
-            if proc.returncode == 0:
-                result = json.loads(proc.stdout)
-
-                if decrypt_filenames:
-                    if result:
-                        decrypted_names = {}
-                        proc = await run((["rclone", "--config", config.config_path, "cryptdecode", "encrypted:"] +
-                                         [item["Name"] for item in result]),
-                                         check=False, encoding="utf8", errors="ignore")
-                        for line in proc.stdout.splitlines():
-                            try:
-                                encrypted, decrypted = line.rstrip("\r\n").split(" \t ", 1)
-                            except ValueError:
-                                continue
-
-                            if decrypted != "Failed to decrypt":
-                                decrypted_names[encrypted] = decrypted
-
-                        for item in result:
-                            if item["Name"] in decrypted_names:
-                                item["Decrypted"] = decrypted_names[item["Name"]]
-
-                return result
-            else:
-                raise CallError(proc.stderr, extra={"excerpt": lsjson_error_excerpt(proc.stderr)})
+        credentials_id = config["credentials"]["id"]
+        session_key = rclone_session_key(config)
+        result = REMOTE_LISTING_CACHE.get(credentials_id, session_key, path)
+        if result is not None:
+            return result
+
+        async with RCLONE_SESSIONS.use(credentials_id, config) as session:
+            result = (await session.call("operations/list", {"fs": "remote:" + path, "remote": ""}))["list"]
+
+            if config.get("encryption") and config.get("filename_encryption") and result:
+                decrypted_names = await self._decrypt_filenames(session, [item["Name"] for item in result])
+                for item, decrypted in zip(result, decrypted_names):
+                    if decrypted is not None:
+                        item["Decrypted"] = decrypted
+
+        REMOTE_LISTING_CACHE.put(credentials_id, session_key, path, result)
+        return result
+
+    async def _decrypt_filenames(self, session, names):
+        def decode(names):
+            return session.call("backend/command", {"command": "decode", "fs": "encrypted:", "arg": names})
+
+        try:
+            return (await decode(names))["result"]
+        except CallError:
+            # A single name that can not be decrypted fails the whole batch
+            pass
+
+        semaphore = asyncio.Semaphore(self.DECRYPT_FILENAMES_CONCURRENCY)
+
+        async def decode_one(name):
+            async with semaphore:
+                return (await decode([name]))["result"][0]
+
+        return [
+            None if isinstance(result, Exception) else result
+            for result in await asyncio.gather(*[decode_one(name) for name in names], return_exceptions=True)
+        ]
+
+    @periodic(60, run_on_start=False)
+    @private
+    async def reap_rclone_sessions(self):
+        await RCLONE_SESSIONS.reap()
+
+    @private
+    async def terminate(self):
+        await RCLONE_SESSIONS.stop()
 
     @item_method
     @accepts(
@@ -1113,6 +1421,9 @@ class CloudSyncService(TaskPathService):
                             "name": cloud_sync["description"],
                         })
                     raise
+                finally:
+                    # Remote contents might have changed
+                    REMOTE_LISTING_CACHE.invalidate(credentials["id"])
 
     @item_method
     @accepts(Int("id"))
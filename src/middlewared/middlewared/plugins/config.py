@@ -52,6 +52,8 @@ class ConfigService(Service):
         If none of these options are set, the bundle is not generated and the database file is provided.
         """
 
+        await self.middleware.call('datastore.checkpoint')
+
         if all(not options[k] for k in options):
             bundle = False
             filename = FREENAS_DATABASE
@@ -267,7 +269,7 @@ class ConfigService(Service):
             job.logs_fd.write(cp.stderr)
             raise CallError('Factory reset has failed.')
 
-        shutil.move(factorydb, FREENAS_DATABASE)
+        self.middleware.call_sync('datastore.replace', factorydb)
 
         if options['reboot']:
             self.middleware.run_coroutine(
@@ -302,4 +304,5 @@ class ConfigService(Service):
         if not os.path.exists(dirname):
             os.makedirs(dirname)
 
+        self.middleware.call_sync('datastore.checkpoint')
         shutil.copy(FREENAS_DATABASE, newfile)
@@ -1,2 +1,18 @@
+from middlewared.service import SystemServiceService
+
+
 async def setup(middleware):
     await middleware.call("datastore.setup")
+
+    for service in middleware.get_services().values():
+        # Compound services only get the config of their first part
+        for part in getattr(service, "parts", [service]):
+            if not part._config.datastore_cache:
+                continue
+
+            if isinstance(part, SystemServiceService):
+                name = f"services.{part._config.service_model or part._config.service}"
+            else:
+                name = part._config.datastore
+
+            await middleware.call("datastore.register_cache", name)
@@ -0,0 +1,126 @@
+from collections import defaultdict
+import threading
+
+from middlewared.schema import accepts, List, Str
+from middlewared.service import private, Service
+
+from .schema import SchemaMixin
+
+
+class DatastoreQueryCache:
+    """
+    Results of `datastore.query` for tables that opted in, keyed by table name and query.
+
+    A cached table depends on itself and on every table its query reads: foreign key joins and
+    many-to-many relationships. A write to any of these tables drops every cached result of that
+    table. Each cached table also has a generation number, bumped on invalidation, so that a
+    result computed concurrently with a write is never stored.
+
+    Writes to every table (cached or not) are counted as well so that consumers can cheaply tell whether
+    anything they have read from the database has changed since. `epoch` is bumped when we do not know
+    which tables were written to.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.dependencies = {}
+        self.dependants = defaultdict(set)
+        self.entries = defaultdict(dict)
+        self.generations = defaultdict(int)
+        self.stats = defaultdict(lambda: {'hits': 0, 'misses': 0, 'invalidations': 0})
+        self.epoch = 0
+        self.writes = defaultdict(int)
+
+    def register(self, table, dependencies):
+        with self.lock:
+            self.dependencies[table] = dependencies
+            for dependency in dependencies:
+                self.dependants[dependency].add(table)
+
+    def get(self, table, key):
+        """
+        Returns `(hit, result, generation)`. `generation` must be passed back to `put`.
+        """
+        with self.lock:
+            try:
+                result = self.entries[table][key]
+            except KeyError:
+                self.stats[table]['misses'] += 1
+                return False, None, self.generations[table]
+            else:
+                self.stats[table]['hits'] += 1
+                return True, result, self.generations[table]
+
+    def put(self, table, key, result, generation):
+        with self.lock:
+            if self.generations[table] == generation:
+                self.entries[table][key] = result
+
+    def invalidate(self, table):
+        with self.lock:
+            self.writes[table] += 1
+            for dependant in self.dependants.get(table, ()):
+                self.generations[dependant] += 1
+                self.stats[dependant]['invalidations'] += 1
+                self.entries[dependant].clear()
+
+    def clear(self):
+        with self.lock:
+            self.epoch += 1
+            for table in self.dependencies:
+                self.generations[table] += 1
+                self.entries[table].clear()
+
+
+QUERY_CACHE = DatastoreQueryCache()
+
+
+class DatastoreService(Service, SchemaMixin):
+
+    class Config:
+        private = True
+
+    @accepts(Str('name'))
+    def register_cache(self, name):
+        """
+        Cache `datastore.query` results for `name` until it (or any table it is joined with) is written to.
+        """
+        table = self._get_table(name)
+        QUERY_CACHE.register(table.name, self._get_dependencies(table, set()))
+
+    @accepts(List('names', items=[Str('name')]))
+    def write_generations(self, names):
+        """
+        Returns a value that changes whenever any of the tables `names` is written to.
+        """
+        tables = [self._get_table(name).name for name in names]
+        with QUERY_CACHE.lock:
+            return [QUERY_CACHE.epoch, [QUERY_CACHE.writes[table] for table in tables]]
+
+    def _get_dependencies(self, table, dependencies):
+        if table.name in dependencies:
+            return dependencies
+
+        dependencies.add(table.name)
+
+        for column in table.c:
+            for foreign_key in column.foreign_keys:
+                self._get_dependencies(foreign_key.column.table, dependencies)
+
+        for relationship in self._get_relationships(table).values():
+            if relationship.secondary is not None:
+                dependencies.add(relationship.secondary.name)
+            self._get_dependencies(relationship.target, dependencies)
+
+        return dependencies
+
+    @private
+    def cache_stats(self):
+        """
+        Hit, miss and invalidation counters (as well as the number of cached queries) for every cached table.
+        """
+        with QUERY_CACHE.lock:
+            return {
+                table.replace('_', '.', 1): dict(QUERY_CACHE.stats[table], entries=len(QUERY_CACHE.entries[table]))
+                for table in QUERY_CACHE.dependencies
+            }
@@ -1,12 +1,20 @@
 from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import os
+import queue
 import re
+import shutil
 
 from sqlalchemy import create_engine
 
-from middlewared.service import private, Service
+from middlewared.service import CallError, private, Service
 
 from middlewared.plugins.config import FREENAS_DATABASE
 
+from .cache import QUERY_CACHE
+
+READ_CONNECTIONS = 4
+
 
 def regexp(expr, item):
     if item is None:
@@ -21,11 +29,18 @@ class DatastoreService(Service):
     class Config:
         private = True
 
+    # All writes go through a single connection in a single thread so that they (and `datastore.post_execute_write`
+    # hooks) are applied in the order they were issued. Reads are served by a pool of read-only connections which,
+    # thanks to WAL journal, neither wait for writes nor for each other.
     thread_pool = ThreadPoolExecutor(1)
+    read_thread_pool = ThreadPoolExecutor(READ_CONNECTIONS)
 
     engine = None
     connection = None
 
+    read_engine = None
+    read_connections = None
+
     @private
     async def setup(self):
         await self.middleware.run_in_executor(self.thread_pool, self._setup)
@@ -37,18 +52,79 @@ class DatastoreService(Service):
         if self.connection is not None:
             self.connection.close()
 
+        self._close_read_connections()
+
+        QUERY_CACHE.clear()
+
         self.engine = create_engine(f'sqlite:///{FREENAS_DATABASE}')
 
         self.connection = self.engine.connect()
         self.connection.connection.create_function("REGEXP", 2, regexp)
         self.connection.connection.execute("PRAGMA foreign_keys=ON")
 
+        if FREENAS_DATABASE == ':memory:':
+            # Every connection to an in-memory database gets its own database, reads have to use the writer
+            self.read_connections = None
+            return
+
+        self.connection.connection.execute("PRAGMA journal_mode=WAL")
+
+        self._open_read_connections()
+
+    def _open_read_connections(self):
+        self.read_engine = create_engine(
+            f'sqlite:///file:{FREENAS_DATABASE}?mode=ro&uri=true',
+            connect_args={'check_same_thread': False},
+        )
+        if self.read_connections is None:
+            self.read_connections = queue.Queue()
+        for i in range(READ_CONNECTIONS):
+            connection = self.read_engine.connect()
+            connection.connection.create_function("REGEXP", 2, regexp)
+            self.read_connections.put(connection)
+
+    def _close_read_connections(self):
+        if self.read_engine is None:
+            return
+
+        # Wait for reads in progress to return their connections, new reads wait until the pool is reopened
+        for i in range(READ_CONNECTIONS):
+            self.read_connections.get().close()
+
+        self.read_engine.dispose()
+        self.read_engine = None
+
+    @contextlib.contextmanager
+    def _read_connection(self):
+        read_connections = self.read_connections
+        if read_connections is None:
+            yield self.connection
+            return
+
+        connection = read_connections.get()
+        try:
+            yield connection
+        finally:
+            read_connections.put(connection)
+
     @private
     async def execute(self, *args):
-        return await self.middleware.run_in_executor(self.thread_pool, self.connection.execute, *args)
+        return await self.middleware.run_in_executor(self.thread_pool, self._execute, *args)
+
+    def _execute(self, *args):
+        try:
+            return self.connection.execute(*args)
+        finally:
+            # We do not know which tables raw SQL has changed
+            QUERY_CACHE.clear()
 
     @private
     async def execute_write(self, stmt):
+        return await self.middleware.run_in_executor(
+            self.thread_pool, self._execute_write, stmt.table.name, *self._compile(stmt),
+        )
+
+    def _compile(self, stmt):
         compiled = stmt.compile(self.engine)
 
         sql = compiled.string
@@ -62,20 +138,101 @@ class DatastoreService(Service):
             else:
                 binds.append(value)
 
-        return await self.middleware.run_in_executor(self.thread_pool, self._execute_write, sql, binds)
+        return sql, binds
 
-    def _execute_write(self, sql, binds):
+    def _execute_write(self, table, sql, binds):
         result = self.connection.execute(sql, binds)
+        QUERY_CACHE.invalidate(table)
         self.middleware.call_hook_inline('datastore.post_execute_write', sql, binds)
         return result
 
+    @private
+    async def execute_write_many(self, stmts):
+        """
+        Execute `stmts` (a list of `[stmt, expected_rowcount]`) in a single transaction.
+
+        If any statement fails or affects a number of rows other than its `expected_rowcount` (unless that is
+        `None`), the whole transaction is rolled back.
+        """
+        writes = [(stmt.table.name, *self._compile(stmt), expected_rowcount) for stmt, expected_rowcount in stmts]
+        return await self.middleware.run_in_executor(self.thread_pool, self._execute_write_many, writes)
+
+    def _execute_write_many(self, writes):
+        results = []
+        try:
+            with self.connection.begin():
+                for table, sql, binds, expected_rowcount in writes:
+                    result = self.connection.execute(sql, binds)
+                    if expected_rowcount is not None and result.rowcount != expected_rowcount:
+                        raise RuntimeError(f'{result.rowcount} rows were affected, expecting {expected_rowcount}')
+
+                    results.append(result)
+        finally:
+            for table in {write[0] for write in writes}:
+                QUERY_CACHE.invalidate(table)
+
+        for table, sql, binds, expected_rowcount in writes:
+            self.middleware.call_hook_inline('datastore.post_execute_write', sql, binds)
+
+        return results
+
     @private
     async def fetchall(self, *args):
-        return await self.middleware.run_in_executor(self.thread_pool, self._fetchall, *args)
+        if self.read_connections is None:
+            executor = self.thread_pool
+        else:
+            executor = self.read_thread_pool
+
+        return await self.middleware.run_in_executor(executor, self._fetchall, *args)
 
     def _fetchall(self, query, params=None):
-        cursor = self.connection.execute(query, params or [])
+        with self._read_connection() as connection:
+            cursor = connection.execute(query, params or [])
+            try:
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+
+    @private
+    async def checkpoint(self):
+        """
+        Move all changes from the write-ahead log to the database file so that it can be copied as is.
+        """
+        await self.middleware.run_in_executor(self.thread_pool, self._checkpoint)
+
+    def _checkpoint(self):
+        """
+        Must be called from `thread_pool` (i.e. by a method already running there, like HA database sync).
+        """
+        if self.read_engine is None:
+            return
+
+        # Readers must not hold a snapshot of the database while the log is truncated
+        self._close_read_connections()
         try:
-            return cursor.fetchall()
+            if self.connection.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()[0]:
+                raise CallError("Database is busy, unable to checkpoint the write-ahead log")
         finally:
-            cursor.close()
+            self._open_read_connections()
+
+    @private
+    async def replace(self, path):
+        """
+        Replace the database file with `path` and reopen it.
+        """
+        await self.middleware.run_in_executor(self.thread_pool, self._replace, path)
+
+    def _replace(self, path):
+        self._close_read_connections()
+        self.connection.close()
+        self.connection = None
+        self.engine.dispose()
+        self.engine = None
+
+        shutil.move(path, FREENAS_DATABASE)
+        # Write-ahead log of the previous database would otherwise be replayed into the new one
+        for suffix in ["-wal", "-shm"]:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(FREENAS_DATABASE + suffix)
+
+        self._setup()
@@ -1,4 +1,5 @@
 from collections import defaultdict
+import copy
 import re
 
 from sqlalchemy import and_, func, select
@@ -8,12 +9,17 @@ from sqlalchemy.sql.expression import nullsfirst, nullslast
 from sqlalchemy.sql.operators import desc_op, nullsfirst_op, nullslast_op
 
 from middlewared.schema import accepts, Bool, Dict, Int, List, Ref, Str
-from middlewared.service import Service
+from middlewared.service import readonly_args, Service
 from middlewared.service_exception import MatchNotFound
 
+from .cache import QUERY_CACHE
 from .filter import FilterMixin
 from .schema import SchemaMixin
 
+# `extend`, `extend_batch`, `extend_context`, `select` and `get` are applied to (cached) rows
+# so they are not part of the key
+CACHE_KEY_OPTIONS = ('relationships', 'prefix', 'order_by', 'offset', 'limit', 'count')
+
 
 def regexp(expr, item):
     reg = re.compile(expr, re.I)
@@ -32,6 +38,7 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
             'query-options',
             Bool('relationships', default=True),
             Str('extend', default=None, null=True),
+            Str('extend_batch', default=None, null=True),
             Str('extend_context', default=None, null=True),
             Str('prefix', default=None, null=True),
             Dict('extra', additional_attrs=True),
@@ -44,6 +51,7 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
             register=True,
         ),
     )
+    @readonly_args
     async def query(self, name, filters, options):
         """
         Query for items in a given collection `name`.
@@ -81,6 +89,34 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
         # which might happen with "prefix"
         options = options.copy()
 
+        if table.name in QUERY_CACHE.dependencies:
+            cache_key = repr((filters, [options[k] for k in CACHE_KEY_OPTIONS]))
+            hit, result, generation = QUERY_CACHE.get(table.name, cache_key)
+            if hit:
+                result = copy.deepcopy(result)
+            else:
+                result = await self._query(table, filters, options)
+                QUERY_CACHE.put(table.name, cache_key, copy.deepcopy(result), generation)
+        else:
+            result = await self._query(table, filters, options)
+
+        if options['count']:
+            return result
+
+        result = await self._queryset_extend(
+            result, options['extend'], options['extend_batch'], options['extend_context'], options['select'],
+            options['extra'],
+        )
+
+        if options['get']:
+            try:
+                return result[0]
+            except IndexError:
+                raise MatchNotFound()
+
+        return result
+
+    async def _query(self, table, filters, options):
         aliases = {}
         if options['count']:
             qs = select([func.count(self._get_pk(table))])
@@ -160,19 +196,10 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
             # This will only fetch many-to-many relationships for primary table, not for joins, but that's enough
             relationships = await self._fetch_many_to_many(table, result)
 
-        result = await self._queryset_serialize(
-            result,
-            table, aliases, relationships, options['extend'], options['extend_context'], options['prefix'],
-            options['select'], options['extra'],
-        )
-
-        if options['get']:
-            try:
-                return result[0]
-            except IndexError:
-                raise MatchNotFound()
-
-        return result
+        return [
+            self._serialize(row, table, aliases, relationships[i], options['prefix'])
+            for i, row in enumerate(result)
+        ]
 
     @accepts(Str('name'), Ref('query-options'))
     async def config(self, name, options):
@@ -200,40 +227,28 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
 
         return result
 
-    async def _queryset_serialize(
-        self, qs, table, aliases, relationships, extend, extend_context, field_prefix, select, extra_options,
-    ):
+    async def _queryset_extend(self, rows, extend, extend_batch, extend_context, select, extra_options):
         if extend_context:
             extend_context_value = await self.middleware.call(extend_context, extra_options)
+            args = [extend_context_value]
         else:
-            extend_context_value = None
+            args = []
 
-        result = []
-        for i, row in enumerate(qs):
-            result.append(await self._serialize(
-                row, table, aliases, relationships[i],
-                extend, extend_context, extend_context_value, field_prefix, select
-            ))
+        if extend_batch:
+            rows = await self.middleware.call(extend_batch, rows, *args)
+        elif extend:
+            rows = [await self.middleware.call(extend, data, *args) for data in rows]
 
-        return result
+        if not select:
+            return rows
+        else:
+            return [{k: v for k, v in data.items() if k in select} for data in rows]
 
-    async def _serialize(self, obj, table, aliases, relationships, extend, extend_context, extend_context_value,
-                         field_prefix, select):
+    def _serialize(self, obj, table, aliases, relationships, field_prefix):
         data = self._serialize_row(obj, table, aliases)
         data.update(relationships)
 
-        data = {self._strip_prefix(k, field_prefix): v for k, v in data.items()}
-
-        if extend:
-            if extend_context:
-                data = await self.middleware.call(extend, data, extend_context_value)
-            else:
-                data = await self.middleware.call(extend, data)
-
-        if not select:
-            return data
-        else:
-            return {k: v for k, v in data.items() if k in select}
+        return {self._strip_prefix(k, field_prefix): v for k, v in data.items()}
 
     def _strip_prefix(self, k, field_prefix):
         return k[len(field_prefix):] if field_prefix and k.startswith(field_prefix) else k
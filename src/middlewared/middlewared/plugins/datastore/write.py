@@ -1,7 +1,7 @@
 from sqlalchemy import and_, types
 from sqlalchemy.sql import sqltypes
 
-from middlewared.schema import accepts, Any, Dict, Str
+from middlewared.schema import accepts, Any, Dict, List, Str
 from middlewared.service import Service
 
 from .filter import FilterMixin
@@ -19,19 +19,13 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
         Insert a new entry to `name`.
         """
         table = self._get_table(name)
-        insert, relationships = self._extract_relationships(table, options['prefix'], data)
+        insert, relationships = self._insert_values(table, options['prefix'], data)
 
-        for column in table.c:
-            if column.default is not None:
-                insert.setdefault(column.name, column.default.arg)
-            if not column.nullable:
-                if isinstance(column.type, (types.String, types.Text)):
-                    insert.setdefault(column.name, '')
-
-        await self.middleware.call('datastore.execute_write', table.insert().values(**insert))
+        result = await self.middleware.call('datastore.execute_write', table.insert().values(**insert))
         pk_column = self._get_pk(table)
-        if type(pk_column.type) == sqltypes.Integer:
-            pk = (await self.middleware.call('datastore.fetchall', 'SELECT last_insert_rowid()'))[0][0]
+        if type(pk_column.type) is sqltypes.Integer:
+            # `last_insert_rowid()` is per connection, only the writer connection knows it
+            pk = result.lastrowid
         else:
             pk = insert[pk_column.name]
 
@@ -59,12 +53,7 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
         else:
             id = id_or_filters
 
-        for column in table.c:
-            if column.foreign_keys:
-                if column.name[:-3] in data:
-                    data[column.name] = data.pop(column.name[:-3])
-
-        update, relationships = self._extract_relationships(table, options['prefix'], data)
+        update, relationships = self._update_values(table, options['prefix'], data)
 
         if update:
             result = await self.middleware.call(
@@ -80,6 +69,93 @@ class DatastoreService(Service, FilterMixin, SchemaMixin):
 
         return id
 
+    @accepts(
+        Str('name'),
+        List('inserts', items=[Dict('data', additional_attrs=True)]),
+        List('updates', items=[List('update')]),
+        List('deletes', items=[List('delete')]),
+        Dict('options', Str('prefix', default='')),
+    )
+    async def bulk_write(self, name, inserts, updates, deletes, options):
+        """
+        Insert `inserts` and apply `updates` (a list of `[id, data]` pairs) to `name` in a single transaction.
+
+        `deletes` is a list of `[name, id]` pairs that are deleted, in order, before anything is written. They can
+        reference other tables so that rows depending on `name` go away in the same transaction.
+
+        Either every change is applied or none is. Many-to-many relationships can not be written this way.
+        """
+        table = self._get_table(name)
+        pk_column = self._get_pk(table)
+
+        stmts = []
+        for delete_name, id in deletes:
+            delete_table = self._get_table(delete_name)
+            stmts.append([delete_table.delete().where(self._get_pk(delete_table) == id), 1])
+
+        rows = []
+        for data in inserts:
+            insert, relationships = self._insert_values(table, options['prefix'], data)
+            if relationships:
+                raise ValueError('Relationships are not supported in bulk writes')
+
+            stmts.append([table.insert().values(**insert), 1])
+            rows.append(insert)
+
+        ids = []
+        for id, data in updates:
+            update, relationships = self._update_values(table, options['prefix'], data.copy())
+            if relationships:
+                raise ValueError('Relationships are not supported in bulk writes')
+
+            if update:
+                stmts.append([table.update().values(**update).where(pk_column == id), 1])
+                ids.append(id)
+
+        if not stmts:
+            return []
+
+        results = await self.middleware.call('datastore.execute_write_many', stmts)
+
+        for delete_name, id in deletes:
+            await self.middleware.call('datastore.send_delete_events', delete_name, id)
+
+        pks = []
+        for insert, result in zip(rows, results[len(deletes):]):
+            if type(pk_column.type) is sqltypes.Integer:
+                pk = result.lastrowid
+                insert[pk_column.name] = pk
+            else:
+                pk = insert[pk_column.name]
+
+            pks.append(pk)
+            await self.middleware.call('datastore.send_insert_events', name, insert)
+
+        for id in ids:
+            await self.middleware.call('datastore.send_update_events', name, id)
+
+        return pks
+
+    def _insert_values(self, table, prefix, data):
+        insert, relationships = self._extract_relationships(table, prefix, data)
+
+        for column in table.c:
+            if column.default is not None:
+                insert.setdefault(column.name, column.default.arg)
+            if not column.nullable:
+                if isinstance(column.type, (types.String, types.Text)):
+                    insert.setdefault(column.name, '')
+
+        return insert, relationships
+
+    def _update_values(self, table, prefix, data):
+        for column in table.c:
+            if column.foreign_keys:
+                if column.name[:-3] in data:
+                    data[column.name] = data.pop(column.name[:-3])
+
+        return self._extract_relationships(table, prefix, data)
+
     def _extract_relationships(self, table, prefix, data):
         relationships = self._get_relationships(table)
 
@@ -12,7 +12,7 @@ from .identify_base import DiskIdentifyBase
 class DiskService(Service, DiskIdentifyBase):
 
     async def device_to_identifier(self, name, disks=None):
-        disk_data = disks.get('name') or await self.middleware.call('device.get_disk', name)
+        disk_data = (disks or {}).get(name) or await self.middleware.call('device.get_disk', name)
         if disk_data and disk_data['serial_lunid']:
             return f'{{serial_lunid}}{disk_data["serial_lunid"]}'
         elif disk_data and disk_data['serial']:
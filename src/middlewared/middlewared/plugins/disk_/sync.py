@@ -1,4 +1,5 @@
 import asyncio
+import time
 
 from datetime import datetime, timedelta
 
@@ -82,6 +83,9 @@ class DiskService(Service, ServiceChangeMixin):
             else:
                 self.logger.warning('Starting disk.sync_all when devd is not connected yet')
 
+        timings = []
+        phase_start = time.monotonic()
+
         sys_disks = await self.middleware.call('device.get_disks')
 
         # output logging information to middlewared.log in case we sync disks
@@ -93,74 +97,68 @@ class DiskService(Service, ServiceChangeMixin):
         }
         self.logger.info('Found disks: %r', log_info)
 
+        phase_start = self._sync_all_phase(timings, 'get_disks', phase_start)
+
+        # Resolve identifiers of all the system disks at once. If several devices share the same identifier we are
+        # dealing with multipath here and only the first one is mapped to the database entry.
+        identifiers = {}
+        devices = {}
+        for name in sys_disks:
+            identifiers[name] = await self.middleware.call('disk.device_to_identifier', name, sys_disks)
+            if identifiers[name]:
+                devices.setdefault(identifiers[name], name)
+
+        phase_start = self._sync_all_phase(timings, 'identify', phase_start)
+
+        db_disks = {
+            disk['disk_identifier']: disk
+            for disk in await self.middleware.call(
+                'datastore.query', 'storage.disk', [], {'order_by': ['disk_expiretime']}
+            )
+        }
+
+        inserts = {}
+        updates = {}
+        expired = []
         seen_disks = {}
         serials = []
-        changed = False
-        for disk in (
-            await self.middleware.call('datastore.query', 'storage.disk', [], {'order_by': ['disk_expiretime']})
-        ):
+        for disk in db_disks.values():
             original_disk = disk.copy()
 
-            name = await self.middleware.call('disk.identifier_to_device', disk['disk_identifier'], sys_disks)
-            if (
-                    not name or
-                    name in seen_disks or
-                    await self.middleware.call('disk.device_to_identifier', name) != disk['disk_identifier']
-            ):
+            name = devices.get(disk['disk_identifier'])
+            if not name:
                 # If we cant translate the identifier to a device, give up
-                # If name has already been seen once then we are probably
-                # dealing with with multipath here
                 if not disk['disk_expiretime']:
                     disk['disk_expiretime'] = datetime.utcnow() + timedelta(days=self.DISK_EXPIRECACHE_DAYS)
-                    await self.middleware.call('datastore.update', 'storage.disk', disk['disk_identifier'], disk)
-                    changed = True
+                    updates[disk['disk_identifier']] = disk
                 elif disk['disk_expiretime'] < datetime.utcnow():
                     # Disk expire time has surpassed, go ahead and remove it
-                    for extent in await self.middleware.call(
-                        'iscsi.extent.query', [['type', '=', 'DISK'], ['path', '=', disk['disk_identifier']]]
-                    ):
-                        await self.middleware.call('iscsi.extent.delete', extent['id'])
-                    if disk['disk_kmip_uid']:
-                        asyncio.ensure_future(self.middleware.call(
-                            'kmip.reset_sed_disk_password', disk['disk_identifier'], disk['disk_kmip_uid']
-                        ))
-                    await self.middleware.call('datastore.delete', 'storage.disk', disk['disk_identifier'])
-                    changed = True
+                    expired.append(disk)
                 continue
             else:
                 disk['disk_expiretime'] = None
                 disk['disk_name'] = name
 
-            if name in sys_disks:
-                await self._map_device_disk_to_db(disk, sys_disks[name])
+            await self._map_device_disk_to_db(disk, sys_disks[name])
 
-            serial = (disk['disk_serial'] or '') + (sys_disks.get(name, {}).get('lunid') or '')
+            serial = (disk['disk_serial'] or '') + (sys_disks[name].get('lunid') or '')
             if serial:
                 serials.append(serial)
 
-            # If for some reason disk is not identified as a system disk
-            # mark it to expire.
-            if name not in sys_disks and not disk['disk_expiretime']:
-                disk['disk_expiretime'] = datetime.utcnow() + timedelta(days=self.DISK_EXPIRECACHE_DAYS)
             # Do not issue unnecessary updates, they are slow on HA systems and cause severe boot delays
             # when lots of drives are present
             if self._disk_changed(disk, original_disk):
-                await self.middleware.call('datastore.update', 'storage.disk', disk['disk_identifier'], disk)
-                changed = True
-
-            await self.middleware.call('enclosure.sync_disk', disk['disk_identifier'])
+                updates[disk['disk_identifier']] = disk
 
             seen_disks[name] = disk
 
         for name in sys_disks:
             if name not in seen_disks:
-                disk_identifier = await self.middleware.call('disk.device_to_identifier', name, sys_disks)
-                qs = await self.middleware.call(
-                    'datastore.query', 'storage.disk', [('disk_identifier', '=', disk_identifier)]
-                )
-                if qs:
+                disk_identifier = identifiers[name]
+                disk = db_disks.get(disk_identifier) or inserts.get(disk_identifier)
+                if disk:
                     new = False
-                    disk = qs[0]
+                    disk = disk.copy()
                 else:
                     new = True
                     disk = {'disk_identifier': disk_identifier}
@@ -175,22 +173,83 @@ class DiskService(Service, ServiceChangeMixin):
                     else:
                         serials.append(serial)
 
-                if not new:
+                if new:
+                    inserts[disk_identifier] = disk
+                elif disk_identifier not in inserts and self._disk_changed(disk, original_disk):
                     # Do not issue unnecessary updates, they are slow on HA systems and cause severe boot delays
                     # when lots of drives are present
-                    if self._disk_changed(disk, original_disk):
-                        await self.middleware.call('datastore.update', 'storage.disk', disk['disk_identifier'], disk)
-                        changed = True
-                else:
-                    await self.middleware.call('datastore.insert', 'storage.disk', disk)
-                    changed = True
+                    updates[disk_identifier] = disk
+
+                seen_disks[name] = disk
+
+        phase_start = self._sync_all_phase(timings, 'diff', phase_start)
 
-                await self.middleware.call('enclosure.sync_disk', disk['disk_identifier'])
+        # Expired disks and the iSCSI extents exporting them are removed in the same transaction
+        deletes = []
+        extents_deleted = False
+        for disk in list(expired):
+            extents = await self.middleware.call(
+                'iscsi.extent.query', [['type', '=', 'DISK'], ['path', '=', disk['disk_identifier']]]
+            )
+            if extents:
+                target_to_extents = await self.middleware.call(
+                    'iscsi.targetextent.query', [['extent', 'in', [extent['id'] for extent in extents]]]
+                )
+                active_sessions = await self.middleware.call(
+                    'iscsi.target.active_sessions_for_targets', [t['target'] for t in target_to_extents]
+                )
+                if active_sessions:
+                    self.logger.warning(
+                        'Not removing expired disk %r, associated target(s) %s in use', disk['disk_identifier'],
+                        ','.join(active_sessions),
+                    )
+                    expired.remove(disk)
+                    continue
+
+                deletes.extend(['services.iscsitargettoextent', t['id']] for t in target_to_extents)
+                deletes.extend(['services.iscsitargetextent', extent['id']] for extent in extents)
+                extents_deleted = True
+
+            deletes.append(['storage.disk', disk['disk_identifier']])
+
+        changed = bool(inserts or updates or expired)
+        if changed:
+            await self.middleware.call(
+                'datastore.bulk_write', 'storage.disk', list(inserts.values()), [
+                    [identifier, disk] for identifier, disk in updates.items()
+                ], deletes,
+            )
+
+        if extents_deleted:
+            await self._service_change('iscsitarget', 'reload')
+
+        for disk in expired:
+            if disk['disk_kmip_uid']:
+                asyncio.ensure_future(self.middleware.call(
+                    'kmip.reset_sed_disk_password', disk['disk_identifier'], disk['disk_kmip_uid']
+                ))
+
+        phase_start = self._sync_all_phase(timings, 'write', phase_start)
+
+        for disk in seen_disks.values():
+            await self.middleware.call('enclosure.sync_disk', disk['disk_identifier'])
+
+        self._sync_all_phase(timings, 'enclosure', phase_start)
+
+        self.logger.info(
+            'Synced %d disks (%d inserted, %d updated, %d removed): %s', len(sys_disks), len(inserts), len(updates),
+            len(expired), ', '.join(f'{phase} {duration:.3f}s' for phase, duration in timings),
+        )
 
         if changed:
             await self.middleware.call('disk.restart_services_after_sync')
         return 'OK'
 
+    def _sync_all_phase(self, timings, phase, phase_start):
+        now = time.monotonic()
+        timings.append((phase, now - phase_start))
+        return now
+
     def _disk_changed(self, disk, original_disk):
         # storage_disk.disk_size is a string
         return dict(disk, disk_size=None if disk.get('disk_size') is None else str(disk['disk_size'])) != original_disk
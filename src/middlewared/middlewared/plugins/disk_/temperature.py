@@ -1,4 +1,7 @@
+import asyncio
+import glob
 import re
+import time
 
 try:
     import cam
@@ -6,9 +9,14 @@ except ImportError:
     cam = None
 
 from middlewared.common.smart.smartctl import SMARTCTL_POWERMODES
-from middlewared.service import accepts, List, private, Service, Str
+from middlewared.service import accepts, Bool, Dict, Int, List, periodic, private, Service, Str
 from middlewared.utils.asyncio_ import asyncio_map
 
+# Temperatures younger than this are served from cache
+TEMPERATURE_CACHE_TTL = 300
+# Temperatures of the disks we monitor are refreshed in a single pass this often
+TEMPERATURE_COLLECT_INTERVAL = 240
+
 
 def get_temperature(stdout):
     # ataprint.cpp
@@ -46,7 +54,25 @@ def get_temperature(stdout):
         return int(reg.group(1))
 
 
+def get_hwmon_temperature(name):
+    for path in (
+        glob.glob(f'/sys/block/{name}/device/hwmon/hwmon*/temp1_input') +  # drivetemp
+        glob.glob(f'/sys/block/{name}/device/hwmon*/temp1_input')  # nvme
+    ):
+        try:
+            with open(path) as f:
+                return int(f.read().strip()) // 1000
+        except (OSError, ValueError):
+            pass
+
+
 class DiskService(Service):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.temperature_cache = {}
+        self.temperature_lock = asyncio.Lock()
+
     @private
     async def disks_for_temperature_monitoring(self):
         return [
@@ -75,7 +101,79 @@ class DiskService(Service):
     async def temperature(self, name, powermode):
         """
         Returns temperature for device `name` using specified S.M.A.R.T. `powermode`.
+
+        Temperature that was sampled less than 5 minutes ago is returned from cache.
+        """
+        return (await self.temperature_samples([name], powermode, TEMPERATURE_CACHE_TTL))[name]['temperature']
+
+    @accepts(
+        List('names', items=[Str('name')]),
+        Str('powermode', enum=SMARTCTL_POWERMODES, default=SMARTCTL_POWERMODES[0]),
+        Dict(
+            'options',
+            Int('max_age', default=TEMPERATURE_CACHE_TTL),
+            Bool('with_age', default=False),
+        ),
+    )
+    async def temperatures(self, names, powermode, options):
+        """
+        Returns temperatures for a list of devices (runs in parallel).
+        See `disk.temperature` documentation for more details.
+
+        Temperatures sampled less than `options.max_age` seconds ago are returned from cache.
+
+        If `options.with_age` is set, every temperature is returned as `{"temperature": 30, "age": 12.5}` where
+        `age` is the number of seconds that have passed since the temperature was sampled.
+        """
+        if len(names) == 0:
+            names = await self.disks_for_temperature_monitoring()
+
+        samples = await self.temperature_samples(names, powermode, options['max_age'])
+
+        if options['with_age']:
+            return samples
+
+        return {name: sample['temperature'] for name, sample in samples.items()}
+
+    @periodic(TEMPERATURE_COLLECT_INTERVAL, run_on_start=False)
+    @private
+    async def collect_temperatures(self):
+        """
+        Sample temperatures of all monitored disks at once so that reporting and SNMP are served from cache.
         """
+        names = await self.disks_for_temperature_monitoring()
+        if names:
+            powermode = (await self.middleware.call('smart.config'))['powermode']
+            await self.temperature_samples(names, powermode, TEMPERATURE_COLLECT_INTERVAL // 2)
+
+    @private
+    async def temperature_samples(self, names, powermode, max_age):
+        # Sampling is done one pass at a time so that concurrent callers wait for the pass in progress instead of
+        # sampling the same disks again
+        async with self.temperature_lock:
+            now = time.monotonic()
+            stale = [
+                name for name in names
+                if (name, powermode) not in self.temperature_cache or
+                now - self.temperature_cache[(name, powermode)]['sampled_at'] > max_age
+            ]
+            if stale:
+                temperatures = await asyncio_map(lambda name: self.sample_temperature(name, powermode), stale, 8)
+                sampled_at = time.monotonic()
+                for name, temperature in zip(stale, temperatures):
+                    self.temperature_cache[(name, powermode)] = {'temperature': temperature, 'sampled_at': sampled_at}
+
+            now = time.monotonic()
+            return {
+                name: {
+                    'temperature': self.temperature_cache[(name, powermode)]['temperature'],
+                    'age': now - self.temperature_cache[(name, powermode)]['sampled_at'],
+                }
+                for name in names
+            }
+
+    @private
+    async def sample_temperature(self, name, powermode):
         if name.startswith('da'):
             smartctl_args = await self.middleware.call('disk.smartctl_args', name) or []
             if not any(s.startswith('/dev/arcmsr') for s in smartctl_args):
@@ -86,28 +184,15 @@ class DiskService(Service):
                 except Exception:
                     pass
 
+        # `drivetemp` or NVMe hwmon sensors might spin up a sleeping disk so only use them when that is allowed
+        if powermode == 'NEVER':
+            temperature = await self.middleware.run_in_thread(get_hwmon_temperature, name)
+            if temperature is not None:
+                return temperature
+
         output = await self.middleware.call('disk.smartctl', name, ['-a', '-n', powermode.lower()],
                                             {'silent': True})
         if output is None:
             return None
 
         return get_temperature(output)
-
-    @accepts(
-        List('names', items=[Str('name')]),
-        Str('powermode', enum=SMARTCTL_POWERMODES, default=SMARTCTL_POWERMODES[0]),
-    )
-    async def temperatures(self, names, powermode):
-        """
-        Returns temperatures for a list of devices (runs in parallel).
-        See `disk.temperature` documentation for more details.
-        """
-        if len(names) == 0:
-            names = await self.disks_for_temperature_monitoring()
-
-        result = dict(zip(
-            names,
-            await asyncio_map(lambda name: self.middleware.call('disk.temperature', name, powermode), names, 8),
-        ))
-
-        return result
@@ -6,10 +6,12 @@ from middlewared.utils.io import write_if_changed
 
 import asyncio
 from collections import defaultdict
+from datetime import datetime
 import grp
 import imp
 import os
 import pwd
+import time
 
 
 UPS_GROUP = 'nut' if osc.IS_LINUX else 'uucp'
@@ -23,6 +25,7 @@ class MakoRenderer(object):
 
     def __init__(self, service):
         self.service = service
+        self.lookups = {}
 
     async def render(self, path):
         try:
@@ -32,8 +35,13 @@ class MakoRenderer(object):
                 name = os.path.basename(path) + ".mako"
                 dir = os.path.dirname(path)
 
-                # This will be where we search for templates
-                lookup = TemplateLookup(directories=[dir], module_directory="/tmp/mako/%s" % dir)
+                # This will be where we search for templates. Lookups keep compiled templates so share them between
+                # renders.
+                lookup = self.lookups.get(dir)
+                if lookup is None:
+                    lookup = self.lookups.setdefault(
+                        dir, TemplateLookup(directories=[dir], module_directory="/tmp/mako/%s" % dir),
+                    )
 
                 # Get the template by its relative path
                 tmpl = lookup.get_template(name)
@@ -61,11 +69,19 @@ class PyRenderer(object):
 
     def __init__(self, service):
         self.service = service
+        self.modules = {}
 
     async def render(self, path):
-        name = os.path.basename(path)
-        find = imp.find_module(name, [os.path.dirname(path)])
-        mod = imp.load_module(name, *find)
+        mod = self.modules.get(path)
+        if mod is None:
+            name = os.path.basename(path)
+            find = imp.find_module(name, [os.path.dirname(path)])
+            try:
+                mod = self.modules[path] = imp.load_module(name, *find)
+            finally:
+                if find[0]:
+                    find[0].close()
+
         if asyncio.iscoroutinefunction(mod.render):
             return await mod.render(self.service, self.service.middleware)
         else:
@@ -288,6 +304,27 @@ class EtcService(Service):
     }
     LOCKS = defaultdict(asyncio.Lock)
 
+    # Groups that are rendered from nothing but these datastore tables. Such a group is not generated again (for
+    # the same checkpoint) until one of them is written to or its generated files are changed on disk. Only these
+    # groups are fingerprinted: all the others also read system state (interfaces, pools, directory services, files
+    # written by other groups, ...) and are always generated.
+    INPUTS = {
+        'kmip': ['system.kmip', 'system.certificate', 'system.certificateauthority'],
+        'truecommand': ['system.truecommand'],
+    }
+
+    # Groups generated before all the others when going through a checkpoint
+    PREREQUISITE_GROUPS = ['user', 'system_dataset']
+    # Groups that must only be generated after these other groups when going through a checkpoint, i.e. the ones
+    # referencing certificate files written by `ssl`
+    DEPENDENCIES = {
+        name: ['ssl']
+        for name in [
+            'ftp', 'kmip', 'ldap', 'nginx', 'nss', 'openvpn_client', 'openvpn_server', 's3', 'syslogd', 'webdav',
+        ]
+    }
+    CHECKPOINT_CONCURRENCY = 8
+
     checkpoints = ['initial', 'interface_sync', 'post_init', 'pool_import']
 
     class Config:
@@ -302,6 +339,10 @@ class EtcService(Service):
             'mako': MakoRenderer(self),
             'py': PyRenderer(self),
         }
+        self.fingerprints = {}
+        self.stats = defaultdict(lambda: {
+            'generated': 0, 'skipped': 0, 'last_duration': None, 'last_generated_at': None,
+        })
 
     async def generate(self, name, checkpoint=None):
         group = self.GROUPS.get(name)
@@ -309,94 +350,161 @@ class EtcService(Service):
             raise ValueError('{0} group not found'.format(name))
 
         async with self.LOCKS[name]:
+            stats = self.stats[name]
+
+            # Inputs must be fingerprinted before rendering so that a change made while we render is not missed
+            fingerprint = None
+            if name in self.INPUTS:
+                fingerprint = await self.middleware.call('datastore.write_generations', self.INPUTS[name])
+                previous = self.fingerprints.get((name, checkpoint))
+                if previous is not None and previous[0] == fingerprint and previous[1] == self._outfiles_state(group):
+                    stats['skipped'] += 1
+                    return
+
+            start = time.monotonic()
+            success = True
             for entry in group:
-                renderer = self._renderers.get(entry['type'])
-                if renderer is None:
-                    raise ValueError(f'Unknown type: {entry["type"]}')
-
-                if 'platform' in entry and entry['platform'].upper() != osc.SYSTEM:
-                    continue
-
-                if checkpoint:
-                    checkpoint_system = f'checkpoint_{osc.SYSTEM.lower()}'
-                    if checkpoint_system in entry:
-                        entry_checkpoint = entry[checkpoint_system]
-                    else:
-                        entry_checkpoint = entry.get('checkpoint', 'initial')
-                    if entry_checkpoint != checkpoint:
-                        continue
-
-                path = os.path.join(self.files_dir, entry.get('local_path') or entry['path'])
-                entry_path = entry['path']
-                if osc.IS_LINUX:
-                    if entry_path.startswith('local/'):
-                        entry_path = entry_path[len('local/'):]
-                outfile = f'/etc/{entry_path}'
-                try:
-                    rendered = await renderer.render(path)
-                except FileShouldNotExist:
-                    self.logger.debug(f'{entry["type"]}:{entry["path"]} file removed.')
-
-                    try:
-                        os.unlink(outfile)
-                    except FileNotFoundError:
-                        pass
-
-                    continue
-                except Exception:
-                    self.logger.error(f'Failed to render {entry["type"]}:{entry["path"]}', exc_info=True)
-                    continue
-
-                if rendered is None:
-                    continue
-
-                outfile_dirname = os.path.dirname(outfile)
-                if not os.path.exists(outfile_dirname):
-                    os.makedirs(outfile_dirname)
-
-                changes = await self.middleware.run_in_thread(
-                    write_if_changed, outfile, rendered,
-                )
+                success &= await self._generate_entry(entry, checkpoint)
+
+            stats['generated'] += 1
+            stats['last_duration'] = time.monotonic() - start
+            stats['last_generated_at'] = datetime.utcnow()
+
+            if fingerprint is not None:
+                if success:
+                    self.fingerprints[(name, checkpoint)] = (fingerprint, self._outfiles_state(group))
+                else:
+                    self.fingerprints.pop((name, checkpoint), None)
+
+    async def _generate_entry(self, entry, checkpoint):
+        renderer = self._renderers.get(entry['type'])
+        if renderer is None:
+            raise ValueError(f'Unknown type: {entry["type"]}')
+
+        if 'platform' in entry and entry['platform'].upper() != osc.SYSTEM:
+            return True
+
+        if checkpoint:
+            checkpoint_system = f'checkpoint_{osc.SYSTEM.lower()}'
+            if checkpoint_system in entry:
+                entry_checkpoint = entry[checkpoint_system]
+            else:
+                entry_checkpoint = entry.get('checkpoint', 'initial')
+            if entry_checkpoint != checkpoint:
+                return True
+
+        path = os.path.join(self.files_dir, entry.get('local_path') or entry['path'])
+        outfile = self._outfile(entry)
+        try:
+            rendered = await renderer.render(path)
+        except FileShouldNotExist:
+            self.logger.debug(f'{entry["type"]}:{entry["path"]} file removed.')
+
+            try:
+                os.unlink(outfile)
+            except FileNotFoundError:
+                pass
+
+            return True
+        except Exception:
+            self.logger.error(f'Failed to render {entry["type"]}:{entry["path"]}', exc_info=True)
+            return False
+
+        if rendered is None:
+            return True
 
-                # If ownership or permissions are specified, see if
-                # they need to be changed.
-                st = os.stat(outfile)
-                if 'owner' in entry and entry['owner']:
-                    try:
-                        pw = await self.middleware.run_in_thread(pwd.getpwnam, entry['owner'])
-                        if st.st_uid != pw.pw_uid:
-                            os.chown(outfile, pw.pw_uid, -1)
-                            changes = True
-                    except Exception:
-                        pass
-                if 'group' in entry and entry['group']:
-                    try:
-                        gr = await self.middleware.run_in_thread(grp.getgrnam, entry['group'])
-                        if st.st_gid != gr.gr_gid:
-                            os.chown(outfile, -1, gr.gr_gid)
-                            changes = True
-                    except Exception:
-                        pass
-                if 'mode' in entry and entry['mode']:
-                    try:
-                        if (st.st_mode & 0x3FF) != entry['mode']:
-                            os.chmod(outfile, entry['mode'])
-                            changes = True
-                    except Exception:
-                        pass
-
-                if not changes:
-                    self.logger.debug(f'No new changes for {outfile}')
+        outfile_dirname = os.path.dirname(outfile)
+        if not os.path.exists(outfile_dirname):
+            os.makedirs(outfile_dirname)
+
+        changes = await self.middleware.run_in_thread(
+            write_if_changed, outfile, rendered,
+        )
+
+        # If ownership or permissions are specified, see if
+        # they need to be changed.
+        st = os.stat(outfile)
+        if 'owner' in entry and entry['owner']:
+            try:
+                pw = await self.middleware.run_in_thread(pwd.getpwnam, entry['owner'])
+                if st.st_uid != pw.pw_uid:
+                    os.chown(outfile, pw.pw_uid, -1)
+                    changes = True
+            except Exception:
+                pass
+        if 'group' in entry and entry['group']:
+            try:
+                gr = await self.middleware.run_in_thread(grp.getgrnam, entry['group'])
+                if st.st_gid != gr.gr_gid:
+                    os.chown(outfile, -1, gr.gr_gid)
+                    changes = True
+            except Exception:
+                pass
+        if 'mode' in entry and entry['mode']:
+            try:
+                if (st.st_mode & 0x3FF) != entry['mode']:
+                    os.chmod(outfile, entry['mode'])
+                    changes = True
+            except Exception:
+                pass
+
+        if not changes:
+            self.logger.debug(f'No new changes for {outfile}')
+
+        return True
+
+    def _outfile(self, entry):
+        entry_path = entry['path']
+        if osc.IS_LINUX:
+            if entry_path.startswith('local/'):
+                entry_path = entry_path[len('local/'):]
+        return f'/etc/{entry_path}'
+
+    def _outfiles_state(self, group):
+        # Files edited or removed by someone else have to be generated again even if the inputs did not change
+        state = []
+        for entry in group:
+            try:
+                st = os.stat(self._outfile(entry))
+            except FileNotFoundError:
+                state.append(None)
+            else:
+                state.append((st.st_mtime_ns, st.st_size, st.st_mode, st.st_uid, st.st_gid))
+        return state
 
     async def generate_checkpoint(self, checkpoint):
         if checkpoint not in await self.get_checkpoints():
             raise CallError(f'"{checkpoint}" not recognised')
 
-        for name in self.GROUPS.keys():
+        semaphore = asyncio.Semaphore(self.CHECKPOINT_CONCURRENCY)
+        generated = {name: asyncio.Event() for name in self.GROUPS}
+
+        async def generate(name, dependencies):
+            # Dependencies are awaited before taking the semaphore so that waiting groups do not starve them
+            for dependency in dependencies:
+                await generated[dependency].wait()
+
             try:
-                await self.generate(name, checkpoint)
+                async with semaphore:
+                    await self.generate(name, checkpoint)
             except Exception:
                 self.logger.error(f'Failed to generate {name} group', exc_info=True)
+            finally:
+                generated[name].set()
+
+        # Groups everyone else might rely on are generated first, the rest only wait for their own dependencies
+        await asyncio.gather(*[generate(name, []) for name in self.PREREQUISITE_GROUPS])
+        await asyncio.gather(*[
+            generate(name, self.DEPENDENCIES.get(name, []))
+            for name in self.GROUPS if name not in self.PREREQUISITE_GROUPS
+        ])
+
+    def group_stats(self):
+        """
+        Returns how many times each group was generated (or skipped because its inputs have not changed) and how
+        long its last generation took.
+        """
+        return {name: dict(stats) for name, stats in self.stats.items()}
 
     async def get_checkpoints(self):
         return self.checkpoints
@@ -88,6 +88,8 @@ class ISCSIGlobalService(Service, GlobalActionsBase):
             await self.middleware.call('iscsi.targetextent.query')
         ):
             self.middleware.logger.debug('Terminating associated target %r', associated_target['id'])
+            # LUN is removed behind the back of the model SCST is running
+            await self.middleware.call('iscsi.scst.invalidate')
             cp = await run([
                 'scstadmin', '-noprompt', '-rem_lun', str(associated_target['lunid']), '-driver',
                 'iscsi', '-target', f'{g_config["basename"]}:{targets[associated_target["target"]]["name"]}',
@@ -0,0 +1,309 @@
+import os
+import subprocess
+import threading
+
+from collections import defaultdict
+
+from middlewared.service import Service
+
+SCST_BASE = '/sys/kernel/scst_tgt'
+SCST_CONFIG = '/etc/scst.conf'
+SCST_TARGETS = os.path.join(SCST_BASE, 'targets/iscsi')
+SECURITY_GROUP = 'security_group'
+
+
+def scst_model(global_config, targets, extents, portals, initiators, auths, associations):
+    """
+    Describes what SCST should be running: the handler, parameters and attributes of every device and the
+    attributes, CHAP users, allowed initiators and LUNs of every target.
+
+    `extents` only contains enabled and unlocked extents, `associations` referencing other extents are skipped.
+    """
+    authenticators = defaultdict(list)
+    for auth in auths:
+        authenticators[auth['tag']].append(auth)
+
+    devices = {}
+    for extent in extents.values():
+        if extent['type'] == 'DISK':
+            # dev_disk is pass-through which we would be using for disks
+            # FIXME: It is however showing kernel dumps
+            # So for now we use blockio for disks as well
+            handler = 'vdisk_blockio'
+            filename = os.path.join('/dev', extent['disk'])
+        else:
+            handler = 'vdisk_fileio'
+            filename = extent['path']
+
+        t10_dev_id = extent['serial']
+        if not extent['xen']:
+            t10_dev_id = extent['serial'].ljust(31 - len(extent['serial']), ' ')
+
+        # Parameters can only be set when the device is created, changing any of these requires re-creating it
+        params = {
+            'filename': filename,
+            'blocksize': str(extent['blocksize']),
+            'read_only': '1' if extent['ro'] else '0',
+        }
+        # FIXME: SSD is not being reflected in the initiator, please look into it
+        if extent['rpm'] != 'SSD':
+            params['rotational'] = extent['rpm']
+
+        devices[extent['name']] = {
+            'handler': handler,
+            'params': params,
+            'attributes': {
+                'usn': extent['serial'],
+                'naa_id': extent['naa'],
+                'prod_id': 'iSCSI Disk',
+                't10_vend_id': extent['vendor'],
+                't10_dev_id': t10_dev_id,
+            },
+        }
+
+    luns = defaultdict(dict)
+    for association in associations:
+        if association['extent'] in extents:
+            luns[association['target']][association['lunid']] = extents[association['extent']]['name']
+
+    # Targets are only enabled once there is anything to serve
+    target_attributes = {'enabled': '1', 'per_portal_acl': '1'} if luns else {}
+    model_targets = {}
+    for target in targets:
+        # SCST does not allow us to set authentication at a group level, so it is going to be set at
+        # target level which we are moving forward with right now. Also for mutual-chap, we can only set
+        # one user which the initiator can authenticate on it's end. So if any group in the target
+        # desires mutual chap, we take the first one and use it's peer credentials
+        mutual_chap = None
+        chap_users = set()
+        initiator_portal_access = set()
+        for group in target['groups']:
+            if group['authmethod'] != 'NONE' and authenticators[group['auth']]:
+                auth_list = authenticators[group['auth']]
+                if group['authmethod'] == 'CHAP_MUTUAL' and not mutual_chap:
+                    mutual_chap = f'{auth_list[0]["peeruser"]} {auth_list[0]["peersecret"]}'
+
+                chap_users.update(f'{auth["user"]} {auth["secret"]}' for auth in auth_list)
+
+            for addr in portals[group['portal']]['listen']:
+                if addr['ip'] in ('0.0.0.0', '::'):
+                    # SCST uses wildcard patterns
+                    # https://github.com/truenas/scst/blob/e945943861687d16ae0415207306f75a55bcfd2b/iscsi-scst/usr/target.c#L139-L138
+                    address = '*'
+                else:
+                    address = (f'[{addr["ip"]}]' if ':' in addr['ip'] else addr['ip'])
+                    # FIXME: SCST does not seem to respect port values for portals, please look for alternatives
+
+                group_initiators = initiators[group['initiator']]['initiators'] if group['initiator'] else []
+                for initiator in (group_initiators or ['*']):
+                    initiator_portal_access.add(f'{initiator}#{address}')
+
+        model_targets[f'{global_config["basename"]}:{target["name"]}'] = {
+            'attributes': dict(target_attributes),
+            'incoming_users': sorted(chap_users),
+            'outgoing_user': mutual_chap,
+            'initiators': sorted(initiator_portal_access),
+            'luns': luns.get(target['id'], {}),
+        }
+
+    return {
+        # Anything that, when changed, we do not know how to apply without reloading the whole configuration
+        'global': {'basename': global_config['basename']},
+        'devices': devices,
+        'targets': model_targets,
+    }
+
+
+def scst_diff(old, new):
+    """
+    Returns a list of `(path, value, only_if_exists)` sysfs writes that turn running `old` model into `new`.
+
+    A write is skipped if `only_if_exists` path does not exist (i.e. the object it removes is already gone).
+    """
+    writes = []
+
+    old_devices = old['devices']
+    new_devices = new['devices']
+    removed_devices = old_devices.keys() - new_devices.keys()
+    recreated_devices = {
+        name for name, device in new_devices.items()
+        if name in old_devices and (
+            (old_devices[name]['handler'], old_devices[name]['params']) != (device['handler'], device['params'])
+        )
+    }
+    stale_devices = removed_devices | recreated_devices
+
+    def stale_lun(old_luns, new_luns, lun):
+        return old_luns[lun] in stale_devices or new_luns.get(lun) != old_luns[lun]
+
+    # Targets (together with their LUNs) and then LUNs go first so that devices can be removed
+    for name in sorted(old['targets'].keys() - new['targets'].keys()):
+        writes.append((os.path.join(SCST_TARGETS, 'mgmt'), f'del_target {name}', os.path.join(SCST_TARGETS, name)))
+
+    for name, target in new['targets'].items():
+        if name in old['targets']:
+            old_luns = old['targets'][name]['luns']
+            for lun in old_luns:
+                if stale_lun(old_luns, target['luns'], lun):
+                    writes.append((_luns_mgmt(name), f'del {lun}', None))
+
+    for name in sorted(stale_devices):
+        writes.append((
+            os.path.join(SCST_BASE, 'handlers', old_devices[name]['handler'], 'mgmt'), f'del_device {name}', None,
+        ))
+
+    for name, device in new_devices.items():
+        if name in old_devices and name not in recreated_devices:
+            old_attributes = old_devices[name]['attributes']
+        else:
+            params = '; '.join(f'{k}={v}' for k, v in device['params'].items())
+            writes.append((
+                os.path.join(SCST_BASE, 'handlers', device['handler'], 'mgmt'), f'add_device {name} {params}', None,
+            ))
+            old_attributes = {}
+
+        for k, v in device['attributes'].items():
+            if old_attributes.get(k) != v:
+                writes.append((os.path.join(SCST_BASE, 'devices', name, k), v, None))
+
+    for name, target in new['targets'].items():
+        old_target = old['targets'].get(name)
+        if old_target is None:
+            writes.append((os.path.join(SCST_TARGETS, 'mgmt'), f'add_target {name}', None))
+            writes.append((os.path.join(SCST_TARGETS, name, 'ini_groups/mgmt'), f'create {SECURITY_GROUP}', None))
+            old_target = {'attributes': {}, 'incoming_users': [], 'outgoing_user': None, 'initiators': [], 'luns': {}}
+
+        for user, action in _list_diff(old_target['incoming_users'], target['incoming_users']):
+            writes.append((
+                os.path.join(SCST_TARGETS, 'mgmt'), f'{action}_target_attribute {name} IncomingUser {user}', None,
+            ))
+
+        if old_target['outgoing_user'] != target['outgoing_user']:
+            for user, action in ((old_target['outgoing_user'], 'del'), (target['outgoing_user'], 'add')):
+                if user:
+                    writes.append((
+                        os.path.join(SCST_TARGETS, 'mgmt'), f'{action}_target_attribute {name} OutgoingUser {user}',
+                        None,
+                    ))
+
+        for initiator, action in _list_diff(old_target['initiators'], target['initiators']):
+            writes.append((
+                os.path.join(SCST_TARGETS, name, 'ini_groups', SECURITY_GROUP, 'initiators/mgmt'),
+                f'{action} {initiator}', None,
+            ))
+
+        old_luns = old_target['luns']
+        for lun, device in target['luns'].items():
+            if lun not in old_luns or stale_lun(old_luns, target['luns'], lun):
+                writes.append((_luns_mgmt(name), f'add {device} {lun}', None))
+
+        # Enable the target once it is completely set up
+        attributes = list(target['attributes']) + [k for k in old_target['attributes'] if k not in target['attributes']]
+        for k in sorted(attributes, key=lambda k: k == 'enabled'):
+            v = target['attributes'].get(k, '0')
+            if old_target['attributes'].get(k, '0') != v:
+                writes.append((os.path.join(SCST_TARGETS, name, k), v, None))
+
+    return writes
+
+
+def _luns_mgmt(target):
+    return os.path.join(SCST_TARGETS, target, 'ini_groups', SECURITY_GROUP, 'luns/mgmt')
+
+
+def _list_diff(old, new):
+    return [(i, 'del') for i in old if i not in new] + [(i, 'add') for i in new if i not in old]
+
+
+class ISCSISCSTService(Service):
+
+    class Config:
+        namespace = 'iscsi.scst'
+        private = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+        # Model `/etc/scst.conf` was last generated from
+        self.generated = None
+        # Model SCST is running, `None` if unknown
+        self.applied = None
+
+    def generate_model(self):
+        """
+        Builds the SCST model of the current configuration and remembers it as the one `/etc/scst.conf` is
+        generated from.
+        """
+        extents = {}
+        for extent in self.middleware.call_sync('iscsi.extent.query', [['enabled', '=', True]]):
+            if extent['locked']:
+                self.logger.debug(
+                    'Skipping generation of %r extent as the underlying resource is locked', extent['name']
+                )
+                self.middleware.call_sync('iscsi.extent.generate_locked_alert', extent['id'])
+                continue
+
+            extents[extent['id']] = extent
+
+        model = scst_model(
+            self.middleware.call_sync('iscsi.global.config'),
+            self.middleware.call_sync('iscsi.target.query'),
+            extents,
+            {d['id']: d for d in self.middleware.call_sync('iscsi.portal.query')},
+            {d['id']: d for d in self.middleware.call_sync('iscsi.initiator.query')},
+            self.middleware.call_sync('iscsi.auth.query'),
+            self.middleware.call_sync('iscsi.targetextent.query'),
+        )
+        with self.lock:
+            self.generated = model
+        return model
+
+    def mark_applied(self):
+        """
+        SCST has loaded `/etc/scst.conf`.
+        """
+        with self.lock:
+            self.applied = self.generated
+
+    def invalidate(self):
+        """
+        SCST configuration was changed behind our back (or SCST was stopped).
+        """
+        with self.lock:
+            self.applied = None
+
+    def apply(self):
+        """
+        Apply the difference between the model SCST is running and the one `/etc/scst.conf` was last generated
+        from through sysfs so that initiators of unchanged targets are not disturbed.
+
+        If that is not possible (i.e. we do not know what SCST is running or global configuration has changed),
+        `scstadmin` loads the whole `/etc/scst.conf`.
+        """
+        with self.lock:
+            old, new = self.applied, self.generated
+            if old is not None and new is not None and old['global'] == new['global']:
+                try:
+                    for path, value, only_if_exists in scst_diff(old, new):
+                        if only_if_exists is not None and not os.path.exists(only_if_exists):
+                            continue
+
+                        with open(path, 'w') as f:
+                            f.write(f'{value}\n')
+                except OSError as e:
+                    self.logger.warning('Failed to apply SCST configuration changes, reloading it: %r', e)
+                else:
+                    self.applied = new
+                    return True
+
+            self.applied = None
+            cp = subprocess.run(
+                ['scstadmin', '-noprompt', '-force', '-config', SCST_CONFIG], stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE, encoding='utf8', errors='ignore',
+            )
+            if cp.returncode:
+                self.logger.error('Failed to load SCST configuration: %s', cp.stderr)
+                return False
+
+            self.applied = new
+            return True
@@ -943,7 +943,7 @@ class LDAPService(ConfigService):
             await self.middleware.call('service.restart', 'cifs')
             await self.middleware.call('smb.synchronize_passdb')
             await self.middleware.call('smb.synchronize_group_mappings')
-        await self.middleware.call('cache.pop', 'LDAP_cache')
+        await self.middleware.call('dscache.drop', 'ldap')
         await self.nslcd_cmd('onestop')
         await self.set_state(DSStatus['DISABLED'])
 
@@ -953,13 +953,11 @@ class LDAPService(ConfigService):
         user_next_index = group_next_index = 100000000
         cache_data = {'users': {}, 'groups': {}}
 
-        if self.middleware.call_sync('cache.has_key', 'LDAP_cache') and not force:
+        if self.middleware.call_sync('dscache.has_cache', 'ldap') and not force:
             raise CallError('LDAP cache already exists. Refusing to generate cache.')
 
-        self.middleware.call_sync('cache.pop', 'LDAP_cache')
-
         if (self.middleware.call_sync('ldap.config'))['disable_freenas_cache']:
-            self.middleware.call_sync('cache.put', 'LDAP_cache', cache_data)
+            self.middleware.call_sync('dscache.fill', 'ldap', cache_data)
             self.logger.debug('LDAP cache is disabled. Bypassing cache fill.')
             return
 
@@ -1013,13 +1011,12 @@ class LDAPService(ConfigService):
             }})
             group_next_index += 1
 
-        self.middleware.call_sync('cache.put', 'LDAP_cache', cache_data)
-        self.middleware.call_sync('dscache.backup')
+        self.middleware.call_sync('dscache.fill', 'ldap', cache_data)
 
     @private
     async def get_cache(self):
-        if not await self.middleware.call('cache.has_key', 'LDAP_cache'):
+        if not await self.middleware.call('dscache.has_cache', 'ldap'):
             await self.middleware.call('ldap.fill_cache')
             self.logger.debug('cache fill is in progress.')
             return {'users': {}, 'groups': {}}
-        return await self.middleware.call('cache.get', 'LDAP_cache')
+        return await self.middleware.call('dscache.get_cache', 'ldap')
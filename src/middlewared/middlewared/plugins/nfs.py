@@ -41,6 +41,7 @@ class NFSService(SystemServiceService):
         service_verb = "restart"
         datastore_prefix = "nfs_srv_"
         datastore_extend = 'nfs.nfs_extend'
+        datastore_cache = True
 
     @private
     async def nfs_extend(self, nfs):
@@ -256,6 +257,11 @@ class SharingNFSService(SharingService):
         datastore = "sharing.nfs_share"
         datastore_prefix = "nfs_"
         datastore_extend = "sharing.nfs.extend"
+        datastore_extend_untouched = (
+            "id", "comment", "alldirs", "ro", "quiet", "maproot_user", "maproot_group", "mapall_user", "mapall_group",
+            "enabled",
+        )
+        datastore_cache = True
 
     async def human_identifier(self, share_task):
         return ', '.join(share_task[self.path_field])
@@ -199,23 +199,22 @@ class NISService(ConfigService):
     @job(lock=lambda args: 'fill_nis_cache')
     def fill_cache(self, job, force=False):
         user_next_index = group_next_index = 200000000
-        if self.middleware.call_sync('cache.has_key', 'NIS_cache') and not force:
+        if self.middleware.call_sync('dscache.has_cache', 'nis') and not force:
             raise CallError('NIS cache already exists. Refusing to generate cache.')
 
-        self.middleware.call_sync('cache.pop', 'NIS_cache')
         pwd_list = pwd.getpwall()
         grp_list = grp.getgrall()
 
         local_uid_list = list(u['uid'] for u in self.middleware.call_sync('user.query'))
         local_gid_list = list(g['gid'] for g in self.middleware.call_sync('group.query'))
-        cache_data = {'users': [], 'groups': []}
+        cache_data = {'users': {}, 'groups': {}}
 
         for u in pwd_list:
             is_local_user = True if u.pw_uid in local_uid_list else False
             if is_local_user:
                 continue
 
-            cache_data['users'].append({u.pw_name: {
+            cache_data['users'].update({u.pw_name: {
                 'id': user_next_index,
                 'uid': u.pw_uid,
                 'username': u.pw_name,
@@ -243,7 +242,7 @@ class NISService(ConfigService):
             if is_local_user:
                 continue
 
-            cache_data['groups'].append({g.gr_name: {
+            cache_data['groups'].update({g.gr_name: {
                 'id': group_next_index,
                 'gid': g.gr_gid,
                 'group': g.gr_name,
@@ -254,13 +253,12 @@ class NISService(ConfigService):
             }})
             group_next_index += 1
 
-        self.middleware.call_sync('cache.put', 'NIS_cache', cache_data)
-        self.middleware.call_sync('dscache.backup')
+        self.middleware.call_sync('dscache.fill', 'nis', cache_data)
 
     @private
     async def get_cache(self):
-        if not await self.middleware.call('cache.has_key', 'NIS_cache'):
+        if not await self.middleware.call('dscache.has_cache', 'nis'):
             await self.middleware.call('nis.fill_cache')
             self.logger.debug('cache fill is in progress.')
-            return {'users': [], 'groups': []}
-        return await self.middleware.call('cache.get', 'nis_cache')
+            return {'users': {}, 'groups': {}}
+        return await self.middleware.call('dscache.get_cache', 'nis')
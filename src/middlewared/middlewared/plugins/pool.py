@@ -2589,7 +2589,7 @@ class PoolDatasetService(CRUDService):
     @private
     def path_in_locked_datasets(self, path, locked_datasets=None):
         if locked_datasets is None:
-            locked_datasets = self.middleware.call_sync('zfs.dataset.locked_datasets')
+            return self.middleware.call_sync('zfs.dataset.lock_state.path_locked', path)
         return any(is_child(path, d['mountpoint']) for d in locked_datasets if d['mountpoint'])
 
     @filterable
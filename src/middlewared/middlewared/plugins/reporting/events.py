@@ -1,24 +1,132 @@
+import glob
 import itertools
-import json
 import psutil
-import subprocess
+import threading
 import time
 
 from middlewared.event import EventSource
-from middlewared.utils import osc
+from middlewared.utils import osc, start_daemon_thread
 
 if osc.IS_FREEBSD:
     import sysctl
     import netif
 
+SAMPLER = None
+
 
 class RealtimeEventSource(EventSource):
 
     """
     Retrieve real time statistics for CPU, network,
-    virtual memory and zfs arc.
+    virtual memory and zfs arc. An integer `interval` argument ( in seconds, at least 2 ) can be specified
+    to determine how often the event should be generated.
+    """
+
+    def run(self):
+        try:
+            interval = max(int(self.arg), RealtimeSampler.INTERVAL) if self.arg else RealtimeSampler.INTERVAL
+        except ValueError:
+            return
+
+        SAMPLER.subscribe(self.ident, interval)
+        try:
+            sample_id = 0
+            last_sent = None
+            while not self._cancel.is_set():
+                sample_id, data = SAMPLER.wait(sample_id)
+                if data is None:
+                    continue
+
+                now = time.monotonic()
+                # Samples are taken at the shortest interval any subscriber asked for, allow for some jitter
+                if last_sent is not None and now - last_sent < interval - RealtimeSampler.INTERVAL / 2:
+                    continue
+
+                last_sent = now
+                self.send_event('ADDED', fields=data)
+        finally:
+            SAMPLER.unsubscribe(self.ident)
+
+
+class RealtimeSampler(object):
+
+    """
+    Samples real time statistics once per tick for all `reporting.realtime` subscribers.
+
+    The sampling thread only runs while there are subscribers and ticks at the shortest
+    interval any of them asked for.
     """
 
+    INTERVAL = 2
+    HWMON_REFRESH = 300
+
+    def __init__(self, middleware):
+        self.middleware = middleware
+        self.cond = threading.Condition()
+        self.subscribers = {}
+        self.sample_id = 0
+        self.data = None
+        self.thread = None
+        self.interval = None
+        self.wakeup = False
+        self.cp_time_last = None
+        self.cp_times_last = None
+        self.last_interface_stats = {}
+        self.hwmon_inputs = None
+        self.hwmon_refreshed = 0
+
+    def subscribe(self, ident, interval):
+        with self.cond:
+            self.subscribers[ident] = interval
+            if self.thread is None:
+                self.thread = start_daemon_thread(target=self.run)
+            elif self.interval is not None and interval < self.interval:
+                # Do not make the new subscriber wait for the current (longer) tick to end
+                self.wakeup = True
+                self.cond.notify_all()
+
+    def unsubscribe(self, ident):
+        with self.cond:
+            self.subscribers.pop(ident, None)
+            self.cond.notify_all()
+
+    def wait(self, sample_id):
+        """
+        Wait for a sample newer than `sample_id`. Returns the newest sample id and its data
+        ( `None` on timeout ).
+        """
+        with self.cond:
+            if self.sample_id == sample_id:
+                self.cond.wait(timeout=max(self.subscribers.values(), default=self.INTERVAL) + self.INTERVAL)
+            if self.sample_id == sample_id:
+                return sample_id, None
+            return self.sample_id, self.data
+
+    def run(self):
+        while True:
+            with self.cond:
+                if not self.subscribers:
+                    self.thread = None
+                    self.interval = None
+                    self.cp_time_last = self.cp_times_last = None
+                    self.last_interface_stats = {}
+                    return
+                self.interval = min(self.subscribers.values())
+                self.wakeup = False
+
+            try:
+                data = self.sample()
+            except Exception:
+                self.middleware.logger.error('Failed to sample real time statistics', exc_info=True)
+            else:
+                with self.cond:
+                    self.sample_id += 1
+                    self.data = data
+                    self.cond.notify_all()
+
+            with self.cond:
+                self.cond.wait_for(lambda: not self.subscribers or self.wakeup, timeout=self.interval)
+
     @staticmethod
     def get_cpu_usages(cp_diff):
         cp_total = sum(cp_diff)
@@ -43,126 +151,135 @@ class RealtimeEventSource(EventSource):
         data['usage'] = ((cp_total - cp_diff[idle]) / cp_total) * 100
         return data
 
-    def run(self):
+    def cpu_temperatures(self):
+        """
+        Read per core temperatures from hwmon ( coretemp ), caching the discovered sensor files.
+        """
+        if self.hwmon_inputs is None or time.monotonic() - self.hwmon_refreshed > self.HWMON_REFRESH:
+            self.hwmon_inputs = {}
+            self.hwmon_refreshed = time.monotonic()
+            for label_path in glob.glob('/sys/class/hwmon/hwmon*/temp*_label'):
+                try:
+                    with open(label_path) as f:
+                        label = f.read().strip()
+                except OSError:
+                    continue
+                if not label.startswith('Core '):
+                    continue
+                core = label[5:].strip()
+                if not core.isdigit():
+                    continue
+                self.hwmon_inputs[int(core)] = label_path[:-len('_label')] + '_input'
+
+        temperatures = {}
+        for core, input_path in self.hwmon_inputs.items():
+            try:
+                with open(input_path) as f:
+                    value = int(f.read().strip()) / 1000
+            except (OSError, ValueError):
+                # Sensor went away, rediscover on next read
+                self.hwmon_inputs = None
+                continue
+            temperatures[core] = 2732 + int(value * 10)
+        return temperatures
+
+    def sample(self):
+        data = {}
+
+        # Virtual memory use
+        data['virtual_memory'] = psutil.virtual_memory()._asdict()
 
-        cp_time_last = None
-        cp_times_last = None
-        last_interface_stats = {}
-
-        while not self._cancel.is_set():
-            data = {}
-
-            # Virtual memory use
-            data['virtual_memory'] = psutil.virtual_memory()._asdict()
-
-            # ZFS ARC Size (raw value is in Bytes)
-            data['zfs'] = {}
-            if osc.IS_FREEBSD:
-                data['zfs']['arc_size'] = sysctl.filter('kstat.zfs.misc.arcstats.size')[0].value
-            elif osc.IS_LINUX:
-                with open('/proc/spl/kstat/zfs/arcstats') as f:
-                    rv = f.read()
-                    for line in rv.split('\n'):
-                        if line.startswith('size'):
-                            data['zfs']['arc_size'] = int(line.strip().split()[-1])
-
-            data['cpu'] = {}
-            # Get CPU usage %
-            if osc.IS_FREEBSD:
-                num_times = 5
-                # cp_times has values for all cores
-                cp_times = sysctl.filter('kern.cp_times')[0].value
-                # cp_time is the sum of all cores
-                cp_time = sysctl.filter('kern.cp_time')[0].value
-            elif osc.IS_LINUX:
-                num_times = 10
-                with open('/proc/stat') as f:
-                    stat = f.read()
-                cp_times = []
-                cp_time = []
-                for line in stat.split('\n'):
-                    if line.startswith('cpu'):
-                        line_ints = [int(i) for i in line[5:].strip().split()]
-                        # cpu has a sum of all cpus
-                        if line[3] == ' ':
-                            cp_time = line_ints
-                        # cpuX is for each core
-                        else:
-                            cp_times += line_ints
+        # ZFS ARC Size (raw value is in Bytes)
+        data['zfs'] = {}
+        if osc.IS_FREEBSD:
+            data['zfs']['arc_size'] = sysctl.filter('kstat.zfs.misc.arcstats.size')[0].value
+        elif osc.IS_LINUX:
+            with open('/proc/spl/kstat/zfs/arcstats') as f:
+                rv = f.read()
+                for line in rv.split('\n'):
+                    if line.startswith('size'):
+                        data['zfs']['arc_size'] = int(line.strip().split()[-1])
+
+        data['cpu'] = {}
+        # Get CPU usage %
+        if osc.IS_FREEBSD:
+            num_times = 5
+            # cp_times has values for all cores
+            cp_times = sysctl.filter('kern.cp_times')[0].value
+            # cp_time is the sum of all cores
+            cp_time = sysctl.filter('kern.cp_time')[0].value
+        elif osc.IS_LINUX:
+            num_times = 10
+            with open('/proc/stat') as f:
+                stat = f.read()
+            cp_times = []
+            cp_time = []
+            for line in stat.split('\n'):
+                if line.startswith('cpu'):
+                    line_ints = [int(i) for i in line[5:].strip().split()]
+                    # cpu has a sum of all cpus
+                    if line[3] == ' ':
+                        cp_time = line_ints
+                    # cpuX is for each core
                     else:
-                        break
-            else:
-                cp_time = cp_times = None
-
-            if cp_time and cp_times and cp_times_last:
-                # Get the difference of times between the last check and the current one
-                # cp_time has a list with user, nice, system, interrupt and idle
-                cp_diff = list(map(lambda x: x[0] - x[1], zip(cp_times, cp_times_last)))
-                cp_nums = int(len(cp_times) / num_times)
-                for i in range(cp_nums):
-                    data['cpu'][i] = self.get_cpu_usages(cp_diff[i * num_times:i * num_times + num_times])
-
-                cp_diff = list(map(lambda x: x[0] - x[1], zip(cp_time, cp_time_last)))
-                data['cpu']['average'] = self.get_cpu_usages(cp_diff)
-
-            cp_time_last = cp_time
-            cp_times_last = cp_times
-
-            # CPU temperature
-            data['cpu']['temperature'] = {}
-            if osc.IS_FREEBSD:
-                for i in itertools.count():
-                    v = sysctl.filter(f'dev.cpu.{i}.temperature')
-                    if not v:
-                        break
-                    data['cpu']['temperature'][i] = v[0].value
-            elif osc.IS_LINUX:
-                cp = subprocess.run(['sensors', '-j'], capture_output=True, text=True)
-                try:
-                    sensors = json.loads(cp.stdout)
-                except json.decoder.JSONDecodeError:
-                    pass
-                except Exception:
-                    self.middleware.logger.error('Failed to read sensors output', exc_info=True)
+                        cp_times += line_ints
                 else:
-                    for chip, value in sensors.items():
-                        for name, temps in value.items():
-                            if not name.startswith('Core '):
-                                continue
-                            core = name[5:].strip()
-                            if not core.isdigit():
-                                continue
-                            core = int(core)
-                            for temp, value in temps.items():
-                                if 'input' in temp:
-                                    data['cpu']['temperature'][core] = 2732 + int(value * 10)
-                                    break
-
-            if osc.IS_FREEBSD:
-                # Interface related statistics
-                data['interfaces'] = {}
-                retrieve_stat_keys = ['received_bytes', 'sent_bytes']
-                for iface in netif.list_interfaces().values():
-                    for addr in filter(lambda addr: addr.af.name.lower() == 'link', iface.addresses):
-                        addr_data = addr.__getstate__(stats=True)
-                        stats_time = time.time()
-                        data['interfaces'][iface.name] = {}
-                        for k in retrieve_stat_keys:
-                            traffic_stats = addr_data['stats'][k]
-                            if last_interface_stats.get(iface.name):
-                                traffic_stats = traffic_stats - last_interface_stats[iface.name][k]
-                                traffic_stats = int(
-                                    traffic_stats / (time.time() - last_interface_stats[iface.name]['stats_time'])
-                                )
-                            details_dict = {
-                                k: addr_data['stats'][k],
-                                f'{k}_rate': traffic_stats,
-                            }
-                            data['interfaces'][iface.name].update(details_dict)
-                        last_interface_stats[iface.name] = {**data['interfaces'][iface.name], 'stats_time': stats_time}
-            self.send_event('ADDED', fields=data)
-            time.sleep(2)
+                    break
+        else:
+            cp_time = cp_times = None
+
+        if cp_time and cp_times and self.cp_times_last:
+            # Get the difference of times between the last check and the current one
+            # cp_time has a list with user, nice, system, interrupt and idle
+            cp_diff = list(map(lambda x: x[0] - x[1], zip(cp_times, self.cp_times_last)))
+            cp_nums = int(len(cp_times) / num_times)
+            for i in range(cp_nums):
+                data['cpu'][i] = self.get_cpu_usages(cp_diff[i * num_times:i * num_times + num_times])
+
+            cp_diff = list(map(lambda x: x[0] - x[1], zip(cp_time, self.cp_time_last)))
+            data['cpu']['average'] = self.get_cpu_usages(cp_diff)
+
+        self.cp_time_last = cp_time
+        self.cp_times_last = cp_times
+
+        # CPU temperature
+        data['cpu']['temperature'] = {}
+        if osc.IS_FREEBSD:
+            for i in itertools.count():
+                v = sysctl.filter(f'dev.cpu.{i}.temperature')
+                if not v:
+                    break
+                data['cpu']['temperature'][i] = v[0].value
+        elif osc.IS_LINUX:
+            data['cpu']['temperature'] = self.cpu_temperatures()
+
+        if osc.IS_FREEBSD:
+            # Interface related statistics
+            data['interfaces'] = {}
+            retrieve_stat_keys = ['received_bytes', 'sent_bytes']
+            for iface in netif.list_interfaces().values():
+                for addr in filter(lambda addr: addr.af.name.lower() == 'link', iface.addresses):
+                    addr_data = addr.__getstate__(stats=True)
+                    stats_time = time.time()
+                    data['interfaces'][iface.name] = {}
+                    for k in retrieve_stat_keys:
+                        traffic_stats = addr_data['stats'][k]
+                        if self.last_interface_stats.get(iface.name):
+                            traffic_stats = traffic_stats - self.last_interface_stats[iface.name][k]
+                            traffic_stats = int(
+                                traffic_stats / (time.time() - self.last_interface_stats[iface.name]['stats_time'])
+                            )
+                        details_dict = {
+                            k: addr_data['stats'][k],
+                            f'{k}_rate': traffic_stats,
+                        }
+                        data['interfaces'][iface.name].update(details_dict)
+                    self.last_interface_stats[iface.name] = {**data['interfaces'][iface.name], 'stats_time': stats_time}
+
+        return data
 
 
 def setup(middleware):
+    global SAMPLER
+    SAMPLER = RealtimeSampler(middleware)
     middleware.register_event_source('reporting.realtime', RealtimeEventSource)
@@ -1,9 +1,17 @@
+import collections
 import os
 import json
+import math
 import re
-import statistics
 import subprocess
 import textwrap
+import threading
+import time
+
+try:
+    import rrdtool
+except ImportError:
+    rrdtool = None
 
 
 RRD_BASE_PATH = '/var/db/collectd/rrd/localhost'
@@ -12,6 +20,9 @@ RE_NAME = re.compile(r'(%name_(\d+)%)')
 RE_NAME_NUMBER = re.compile(r'(.+?)(\d+)$')
 RE_RRDPLUGIN = re.compile(r'^(?P<name>.+)Plugin$')
 RRD_PLUGINS = {}
+RRDCACHED_DAEMON = 'unix:/var/run/rrdcached.sock'
+# librrd is not thread safe ( it relies on getopt )
+RRDTOOL_LOCK = threading.Lock()
 
 
 class RRDMeta(type):
@@ -46,7 +57,7 @@ class RRDBase(object, metaclass=RRDMeta):
 
     AGG_MAP = {
         'min': min,
-        'mean': statistics.mean,
+        'mean': lambda i: math.fsum(i) / len(i),
         'max': max,
     }
 
@@ -168,21 +179,34 @@ class RRDBase(object, metaclass=RRDMeta):
 
         return args
 
-    def export(self, identifier, starttime, endtime, aggregate=True):
+    def xport(self, identifier, starttime, endtime):
         args = [
-            'rrdtool',
-            'xport',
-            '--daemon', 'unix:/var/run/rrdcached.sock',
-            '--json',
+            '--daemon', RRDCACHED_DAEMON,
             '--end', endtime,
             '--start', starttime,
         ]
         args.extend(self.get_defs(identifier))
-        cp = subprocess.run(args, capture_output=True)
+
+        if rrdtool is not None:
+            # Read the data in-process instead of forking `rrdtool xport` for every graph
+            try:
+                with RRDTOOL_LOCK:
+                    data = rrdtool.xport(*args)
+            except rrdtool.OperationalError as e:
+                raise RuntimeError(f'Failed to export RRD data: {e}')
+            return {
+                'meta': {k: data['meta'][k] for k in ('start', 'end', 'step', 'legend')},
+                'data': [list(row) for row in data['data']],
+            }
+
+        cp = subprocess.run(['rrdtool', 'xport', '--json'] + args, capture_output=True)
         if cp.returncode != 0:
             raise RuntimeError(f'Failed to export RRD data: {cp.stderr.decode()}')
 
-        data = json.loads(cp.stdout)
+        return json.loads(cp.stdout)
+
+    def export(self, identifier, starttime, endtime, aggregate=True):
+        data = self.xport(identifier, starttime, endtime)
         data = dict(
             name=self.name,
             identifier=identifier,
@@ -193,7 +217,7 @@ class RRDBase(object, metaclass=RRDMeta):
 
         if self.aggregations and aggregate:
             # Transpose the data matrix and remove null values
-            transposed = [list(filter(None.__ne__, i)) for i in zip(*data['data'])]
+            transposed = [[v for v in i if v is not None] for i in zip(*data['data'])]
             for agg in self.aggregations:
                 if agg in self.AGG_MAP:
                     data['aggregations'][agg] = [
@@ -204,3 +228,94 @@ class RRDBase(object, metaclass=RRDMeta):
                     raise RuntimeError(f'Aggregation {agg!r} is invalid.')
 
         return data
+
+
+class RRDExportCache(object):
+    """
+    Cache of `RRDBase.export` results.
+
+    Entries are kept for one step of the exported data ( the data can not change before that ) and
+    concurrent requests for the same export wait for a single `rrdtool xport` to finish.
+
+    Absolute start and end times are aligned to the step of the export the same way rrdtool aligns them, so
+    requests made a few seconds apart share an entry.
+    """
+
+    # collectd interval, the smallest step any RRD can have
+    MIN_STEP = 10
+
+    def __init__(self, size=512, max_ttl=300):
+        self.size = size
+        self.max_ttl = max_ttl
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        # Step of previous exports by their time span ( rrdtool chooses the archive based on it )
+        self.steps = collections.OrderedDict()
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self.entries.pop(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def _align(self, starttime, endtime):
+        if not (starttime.isdigit() and endtime.isdigit()):
+            # Relative times ( e.g. `end-1h`, `now` ) are resolved by rrdtool
+            return starttime, endtime, None
+
+        start, end = int(starttime), int(endtime)
+        span = end - start
+        with self.lock:
+            step = self.steps.get(span) or self.MIN_STEP
+        # Start is rounded down and end up to a multiple of step, which does not change the exported data
+        return str(start - start % step), str(-(-end // step) * step), span
+
+    def export(self, rrd, identifier, starttime, endtime, aggregate=True):
+        starttime, endtime, span = self._align(starttime, endtime)
+        key = (rrd.name, identifier, starttime, endtime, aggregate)
+        with self.lock:
+            data = self._get(key)
+            if data is not None:
+                self.hits += 1
+                return data
+            key_lock = self.pending.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self.lock:
+                data = self._get(key)
+                if data is not None:
+                    self.hits += 1
+                    return data
+                self.misses += 1
+
+            try:
+                data = rrd.export(identifier, starttime, endtime, aggregate=aggregate)
+            except Exception:
+                with self.lock:
+                    self.pending.pop(key, None)
+                raise
+
+            # Store the entry before dropping the pending lock so that no caller can miss both
+            with self.lock:
+                self.entries[key] = (time.monotonic() + min(data['step'] or 0, self.max_ttl), data)
+                while len(self.entries) > self.size:
+                    self.entries.popitem(last=False)
+                if span is not None and data['step']:
+                    self.steps[span] = data['step']
+                    self.steps.move_to_end(span)
+                    while len(self.steps) > self.size:
+                        self.steps.popitem(last=False)
+                self.pending.pop(key, None)
+
+        return data
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
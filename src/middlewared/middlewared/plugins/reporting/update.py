@@ -8,7 +8,7 @@ from middlewared.service import CallError, ConfigService, filterable, private, V
 from middlewared.utils import filter_list, osc, run
 from middlewared.validators import Range
 
-from .rrd_utils import RRD_PLUGINS
+from .rrd_utils import RRD_PLUGINS, RRDExportCache
 
 
 class ReportingModel(sa.Model):
@@ -32,6 +32,7 @@ class ReportingService(ConfigService):
         self.__rrds = {}
         for name, klass in RRD_PLUGINS.items():
             self.__rrds[name] = klass(self.middleware)
+        self.__export_cache = RRDExportCache()
 
     @accepts(
         Dict(
@@ -131,6 +132,7 @@ class ReportingService(ConfigService):
             await self.middleware.call('reporting.setup')
             await self.middleware.call('service.start', 'rrdcached')
 
+        self.__export_cache.clear()
         await self.middleware.call('service.restart', 'collectd')
 
         return await self.config()
@@ -222,7 +224,7 @@ class ReportingService(ConfigService):
             except KeyError:
                 raise CallError(f'Graph {i["name"]!r} not found.', errno.ENOENT)
             rv.append(
-                rrd.export(i['identifier'], starttime, endtime, aggregate=query['aggregate'])
+                self.__export_cache.export(rrd, i['identifier'], starttime, endtime, aggregate=query['aggregate'])
             )
         return rv
 
@@ -236,5 +238,13 @@ class ReportingService(ConfigService):
             if idents is None:
                 idents = [None]
             for ident in idents:
-                rv.append(rrd.export(ident, starttime, endtime, aggregate=query['aggregate']))
+                rv.append(self.__export_cache.export(rrd, ident, starttime, endtime, aggregate=query['aggregate']))
         return rv
+
+    @private
+    def export_cache_stats(self):
+        return {
+            'entries': len(self.__export_cache.entries),
+            'hits': self.__export_cache.hits,
+            'misses': self.__export_cache.misses,
+        }
@@ -1,4 +1,4 @@
-from middlewared.utils import osc, run
+from middlewared.utils import osc
 
 from .base import SimpleService
 
@@ -14,10 +14,17 @@ class ISCSITargetService(SimpleService):
 
     systemd_unit = "scst"
 
+    async def after_start(self):
+        if osc.IS_LINUX:
+            await self.middleware.call("iscsi.scst.mark_applied")
+
+    async def after_stop(self):
+        if osc.IS_LINUX:
+            await self.middleware.call("iscsi.scst.invalidate")
+
     async def reload(self):
         if osc.IS_LINUX:
-            return (await run(
-                ["scstadmin", "-noprompt", "-force", "-config", "/etc/scst.conf"], check=False
-            )).returncode == 0
+            return await self.middleware.call("iscsi.scst.apply")
         else:
+            # ctld itself only applies the differences between the old and the new configuration on reload
             return await self._reload_freebsd()
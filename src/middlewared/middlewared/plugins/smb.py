@@ -210,6 +210,7 @@ class SMBService(SystemServiceService):
         datastore = 'services.cifs'
         datastore_extend = 'smb.smb_extend'
         datastore_prefix = 'cifs_srv_'
+        datastore_cache = True
 
     @private
     async def smb_extend(self, smb):
@@ -660,6 +661,11 @@ class SharingSMBService(SharingService):
         datastore = 'sharing.cifs_share'
         datastore_prefix = 'cifs_'
         datastore_extend = 'sharing.smb.extend'
+        datastore_extend_untouched = (
+            'id', 'purpose', 'path', 'path_suffix', 'home', 'name', 'comment', 'ro', 'browsable', 'recyclebin',
+            'guestok', 'timemachine', 'vuid', 'enabled',
+        )
+        datastore_cache = True
 
     @private
     async def strip_comments(self, data):
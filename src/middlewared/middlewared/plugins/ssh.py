@@ -48,6 +48,7 @@ class SSHService(SystemServiceService):
         service = "ssh"
         service_model = "ssh"
         datastore_prefix = "ssh_"
+        datastore_cache = True
 
     @accepts()
     def bindiface_choices(self):
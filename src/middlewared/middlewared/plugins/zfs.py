@@ -14,6 +14,8 @@ from middlewared.service import (
 from middlewared.utils import filter_list, filter_getattrs, osc
 from middlewared.validators import ReplicationSnapshotNamingSchema
 
+SNAPSHOT_ATTRIBUTES = {'id', 'name', 'pool', 'type', 'dataset', 'snapshot_name', 'holds', 'properties'}
+
 
 class ZFSSetPropertyError(CallError):
     def __init__(self, property, error):
@@ -67,6 +69,31 @@ def find_vdev(pool, vname):
         children += list(child.children)
 
 
+def get_snapshots_scope(filters):
+    """
+    Find the narrowest dataset whose snapshots can satisfy `filters`.
+
+    Returns a `(dataset, recursive)` tuple or `None` if all snapshots have to be iterated over.
+    """
+    for f in filters:
+        if len(f) != 3:
+            continue
+
+        name, op, value = f
+        if not isinstance(value, str):
+            continue
+
+        if name == 'dataset' and op == '=':
+            return value, False
+        if name == 'pool' and op == '=':
+            return value, True
+        if name in ('id', 'name') and op == '^':
+            if '@' in value:
+                return value.split('@', 1)[0], False
+            if '/' in value:
+                return value.rsplit('/', 1)[0], True
+
+
 class ZFSPoolService(CRUDService):
 
     class Config:
@@ -443,8 +470,23 @@ class ZFSDatasetService(CRUDService):
             'extra': {'properties': ['encryption', 'keystatus', 'mountpoint']}, 'select': ['id', 'mountpoint']
         })
 
-    def flatten_datasets(self, datasets):
-        return sum([[deepcopy(ds)] + self.flatten_datasets(ds['children']) for ds in datasets], [])
+    def flatten_datasets(self, datasets, children=True):
+        """
+        Flatten a hierarchical dataset list in depth-first order.
+
+        With `children` set, every dataset carries its own copy of all of its descendants ( legacy behavior ),
+        otherwise each dataset is emitted exactly once and `children` only lists the ids of its direct children.
+        """
+        rv = []
+        stack = list(datasets)[::-1]
+        while stack:
+            ds = stack.pop()
+            if children:
+                rv.append(deepcopy(ds))
+            else:
+                rv.append({**ds, 'children': [child['id'] for child in ds['children']]})
+            stack.extend(reversed(ds['children']))
+        return rv
 
     @filterable
     def query(self, filters=None, options=None):
@@ -469,6 +511,11 @@ class ZFSDatasetService(CRUDService):
         children there are for them in `children` key. This retrieval type is slightly faster.
         These options are controlled by `query-options.extra.flat` attribute which defaults to true.
 
+        `query-options.extra.children` controls if datasets in the flat structure contain all of their children.
+        If set to false, each dataset is returned only once and its `children` key only contains the ids of its
+        direct children, which is a lot faster when there are many nested datasets. It is implied when
+        `query-options.select` is used and neither it, filters nor `query-options.order_by` reference `children`.
+
         `query-options.extra.user_properties` controls if user defined properties of datasets should be retrieved
         or not.
 
@@ -481,6 +528,14 @@ class ZFSDatasetService(CRUDService):
         top_level_props = None if extra.get('top_level_properties') is None else extra['top_level_properties'].copy()
         props = extra.get('properties', None)
         flat = extra.get('flat', True)
+        children = extra.get('children', True)
+        if children and options.get('select') and not any(
+            attr.split('.', 1)[0] == 'children'
+            for attr in options['select'] + list(filter_getattrs(filters)) + [
+                o[1:] if o.startswith('-') else o for o in options.get('order_by') or []
+            ]
+        ):
+            children = False
         user_properties = extra.get('user_properties', True)
         retrieve_properties = extra.get('retrieve_properties', True)
         if not retrieve_properties:
@@ -506,13 +561,25 @@ class ZFSDatasetService(CRUDService):
                     props=props, top_level_props=top_level_props, user_props=user_properties
                 )
                 if flat:
-                    datasets = self.flatten_datasets(datasets)
+                    datasets = self.flatten_datasets(datasets, children)
                 else:
                     datasets = list(datasets)
 
         return filter_list(datasets, filters, options)
 
     def query_for_quota_alert(self):
+        """
+        Properties needed by the quota alert of the datasets that have a quota or a refquota set.
+        """
+        datasets = self.query([], {
+            'extra': {
+                'properties': [
+                    'name', 'quota', 'available', 'refquota', 'usedbydataset', 'mounted', 'mountpoint',
+                ],
+                'top_level_properties': [],
+                'children': False,
+            },
+        })
         return [
             {
                 k: v for k, v in dataset['properties'].items()
@@ -522,9 +589,16 @@ class ZFSDatasetService(CRUDService):
                     "org.freenas:refquota_warning", "org.freenas:refquota_critical"
                 ]
             }
-            for dataset in self.query()
+            for dataset in datasets
+            if self._has_quota(dataset['properties'], 'quota') or self._has_quota(dataset['properties'], 'refquota')
         ]
 
+    def _has_quota(self, properties, quota_property):
+        try:
+            return int(properties[quota_property]['rawvalue']) != 0
+        except (KeyError, ValueError):
+            return False
+
     def common_load_dataset_checks(self, ds):
         self.common_encryption_checks(ds)
         if ds.key_loaded:
@@ -642,6 +716,7 @@ class ZFSDatasetService(CRUDService):
             self.logger.error(f'Failed to load key for {id}', exc_info=True)
             raise CallError(f'Failed to load key for {id}: {e}')
         else:
+            self.middleware.call_sync('zfs.dataset.lock_state.set_key_loaded', id, True)
             if mount_ds:
                 self.mount(id, {'recursive': recursive})
 
@@ -708,6 +783,8 @@ class ZFSDatasetService(CRUDService):
         except libzfs.ZFSException as e:
             self.logger.error(f'Failed to unload key for {id}', exc_info=True)
             raise CallError(f'Failed to unload key for {id}: {e}')
+        else:
+            self.middleware.call_sync('zfs.dataset.lock_state.set_key_loaded', id, False, options['recursive'])
 
     @accepts(
         Str('id'),
@@ -732,6 +809,8 @@ class ZFSDatasetService(CRUDService):
         except libzfs.ZFSException as e:
             self.logger.error(f'Failed to change key for {id}', exc_info=True)
             raise CallError(f'Failed to change key for {id}: {e}')
+        else:
+            self.middleware.call_sync('zfs.dataset.lock_state.invalidate')
 
     @accepts(
         Str('id'),
@@ -747,6 +826,8 @@ class ZFSDatasetService(CRUDService):
                 ds.change_key(load_key=options['load_key'], inherit=True)
         except libzfs.ZFSException as e:
             raise CallError(f'Failed to change encryption root for {id}: {e}')
+        else:
+            self.middleware.call_sync('zfs.dataset.lock_state.invalidate')
 
     @accepts(Dict(
         'dataset_create',
@@ -947,20 +1028,33 @@ class ZFSSnapshot(CRUDService):
     def query(self, filters=None, options=None):
         """
         Query all ZFS Snapshots with `query-filters` and `query-options`.
+
+        `query-options.extra.properties` is a list of properties which should be retrieved for each snapshot. If
+        null ( by default ), it would retrieve all properties.
+
+        Filters on `dataset`, `pool` or a `id`/`name` prefix limit which datasets' snapshots are iterated over.
+        When `query-options.select` is given, only the attributes required by it, filters and `order_by` are
+        retrieved. Snapshots are streamed through the filters so `get` and `limit` stop iterating as soon as
+        enough matches are found.
         """
-        # Special case for faster listing of snapshot names (#53149)
+        options = options or {}
+        filters = filters or []
+        scope = get_snapshots_scope(filters)
+
+        # Special case for faster listing/counting of snapshot names (#53149)
         if (
-            options and options.get('select') == ['name'] and (
-                not filters or
-                filter_getattrs(filters).issubset({'name', 'pool'})
-            )
+            (options.get('select') == ['name'] or options.get('count') is True) and
+            filter_getattrs(filters).issubset({'name', 'pool'})
         ):
             # Using zfs list -o name is dozens of times faster than py-libzfs
             cmd = ['zfs', 'list', '-H', '-o', 'name', '-t', 'snapshot']
             order_by = options.get('order_by')
             # -s name makes it even faster
-            if not order_by or order_by == ['name']:
+            if not options.get('count') and (not order_by or order_by == ['name']):
                 cmd += ['-s', 'name']
+            if scope:
+                dataset, recursive = scope
+                cmd += (['-r'] if recursive else ['-d', '1']) + [dataset]
             cp = subprocess.run(
                 cmd,
                 stdout=subprocess.PIPE,
@@ -968,36 +1062,89 @@ class ZFSSnapshot(CRUDService):
                 universal_newlines=True,
             )
             if cp.returncode != 0:
+                if scope and 'dataset does not exist' in cp.stderr:
+                    return filter_list([], filters, options)
                 raise CallError(f'Failed to retrieve snapshots: {cp.stderr}')
             stdout = cp.stdout.strip()
             if not stdout:
-                return []
+                return filter_list([], filters, options)
             snaps = [
                 {'name': i, 'pool': i.split('/', 1)[0]}
                 for i in stdout.split('\n')
             ]
-            if filters:
+            if filters or options.get('count'):
                 return filter_list(snaps, filters, options)
             return snaps
+
+        fields = None
+        if options.get('select'):
+            fields = set(options['select']) | {
+                attr.split('.', 1)[0] for attr in filter_getattrs(filters)
+            } | {o[1:] if o.startswith('-') else o for o in options.get('order_by') or []}
+        props = options.get('extra', {}).get('properties')
+
         with libzfs.ZFS() as zfs:
             # Handle `id` filter to avoid getting all snapshots first
-            snapshots = []
-            if filters and len(filters) == 1 and list(filters[0][:2]) == ['id', '=']:
+            if len(filters) == 1 and list(filters[0][:2]) == ['id', '=']:
+                snapshots = []
                 try:
-                    snapshots.append(zfs.get_snapshot(filters[0][2]).__getstate__())
+                    snapshots.append(self.__serialize_snapshot(zfs.get_snapshot(filters[0][2]), fields, props))
                 except libzfs.ZFSException as e:
                     if e.code != libzfs.Error.NOENT:
                         raise
             else:
-                for i in zfs.snapshots:
-                    try:
-                        snapshots.append(i.__getstate__())
-                    except libzfs.ZFSException as e:
-                        # snapshot may have been deleted while this is running
-                        if e.code != libzfs.Error.NOENT:
-                            raise
-        # FIXME: awful performance with hundreds/thousands of snapshots
-        return filter_list(snapshots, filters, options)
+                snapshots = self.__iter_snapshots(zfs, scope, fields, props)
+
+            # Snapshots can only be iterated while the libzfs handle is open, `filter_list` always consumes them
+            result = filter_list(snapshots, filters, options)
+
+        return result
+
+    def __iter_snapshots(self, zfs, scope, fields, props):
+        if scope:
+            dataset, recursive = scope
+            try:
+                ds = zfs.get_dataset(dataset)
+            except libzfs.ZFSException as e:
+                if e.code != libzfs.Error.NOENT:
+                    raise
+                return
+            snapshots = ds.snapshots_recursive if recursive else ds.snapshots
+        else:
+            snapshots = zfs.snapshots
+
+        for i in snapshots:
+            try:
+                yield self.__serialize_snapshot(i, fields, props)
+            except libzfs.ZFSException as e:
+                # snapshot may have been deleted while this is running
+                if e.code != libzfs.Error.NOENT:
+                    raise
+
+    def __serialize_snapshot(self, snapshot, fields, props):
+        if fields is not None and fields.issubset(SNAPSHOT_ATTRIBUTES):
+            name = snapshot.name
+            dataset, snapshot_name = name.split('@', 1)
+            data = {
+                'id': name,
+                'name': name,
+                'pool': dataset.split('/', 1)[0],
+                'type': 'SNAPSHOT',
+                'dataset': dataset,
+                'snapshot_name': snapshot_name,
+            }
+            if 'holds' in fields:
+                data['holds'] = snapshot.holds
+            if 'properties' in fields:
+                data['properties'] = {
+                    k: v.__getstate__() for k, v in snapshot.properties.items() if props is None or k in props
+                }
+            return data
+
+        data = snapshot.__getstate__()
+        if props is not None:
+            data['properties'] = {k: v for k, v in data['properties'].items() if k in props}
+        return data
 
     @accepts(Dict(
         'snapshot_create',
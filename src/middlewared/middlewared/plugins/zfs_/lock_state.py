@@ -0,0 +1,153 @@
+import asyncio
+import os
+
+from middlewared.schema import accepts, Bool, Str
+from middlewared.service import Service
+
+
+class LockStateIndex:
+    """
+    Encrypted datasets indexed by the components of their mountpoints.
+
+    Checking whether a path resides within a locked dataset only walks as many trie nodes as the path has
+    components.
+    """
+
+    def __init__(self, datasets):
+        self.datasets = {}
+        self.root = {}
+        for ds in datasets:
+            self.datasets[ds['id']] = {
+                'id': ds['id'],
+                'mountpoint': ds['mountpoint'],
+                'encryption_root': ds['encryption_root'],
+                'locked': not ds['key_loaded'],
+            }
+            if ds['mountpoint']:
+                self._node(ds['mountpoint']).setdefault(None, []).append(ds['id'])
+
+    def set_key_loaded(self, id, loaded, recursive):
+        for ds in self.datasets.values():
+            if ds['encryption_root'] == id or (recursive and (ds['id'] == id or ds['id'].startswith(f'{id}/'))):
+                ds['locked'] = not loaded
+
+    def locked_datasets(self, about_to_lock=None):
+        return [
+            {'id': ds['id'], 'mountpoint': ds['mountpoint']}
+            for ds in self.datasets.values()
+            if ds['locked'] or self._about_to_lock(ds['id'], about_to_lock)
+        ]
+
+    def path_locked(self, path, about_to_lock=None):
+        node = self.root
+        for component in self._components(path):
+            node = node.get(component)
+            if node is None:
+                return False
+
+            if any(self.datasets[id]['locked'] or self._about_to_lock(id, about_to_lock) for id in node.get(None, [])):
+                return True
+
+        return False
+
+    def _about_to_lock(self, id, about_to_lock):
+        return bool(about_to_lock) and (id == about_to_lock or id.startswith(f'{about_to_lock}/'))
+
+    def _node(self, path):
+        node = self.root
+        for component in self._components(path):
+            node = node.setdefault(component, {})
+        return node
+
+    def _components(self, path):
+        # Leading empty component makes `/` a node of its own
+        return os.path.normpath(path).rstrip('/').split('/')
+
+
+class ZFSDatasetLockStateService(Service):
+
+    class Config:
+        namespace = 'zfs.dataset.lock_state'
+        private = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.index = None
+        self.generation = 0
+        self.lock = asyncio.Lock()
+
+    async def locked_datasets(self):
+        """
+        Same as `zfs.dataset.locked_datasets` without traversing ZFS datasets.
+        """
+        index = await self._index()
+        return index.locked_datasets(await self._about_to_lock())
+
+    @accepts(Str('path'))
+    async def path_locked(self, path):
+        """
+        Returns whether `path` resides within a locked dataset.
+        """
+        index = await self._index()
+        return index.path_locked(path, await self._about_to_lock())
+
+    @accepts(Str('id'), Bool('loaded'), Bool('recursive', default=False))
+    async def set_key_loaded(self, id, loaded, recursive):
+        """
+        Record that the key of `id` encryption root (and of all encrypted children with `recursive`) has been
+        loaded or unloaded.
+        """
+        if self.index is not None:
+            self.index.set_key_loaded(id, loaded, recursive)
+        else:
+            # An index being built right now might have queried key status before this change
+            self.generation += 1
+
+    async def invalidate(self):
+        """
+        Datasets have changed in a way we do not track (created, destroyed, renamed, pool imported...), rebuild
+        the index on next use.
+        """
+        self.generation += 1
+        self.index = None
+
+    async def _index(self):
+        if self.index is not None:
+            return self.index
+
+        async with self.lock:
+            if self.index is not None:
+                return self.index
+
+            generation = self.generation
+            index = LockStateIndex(await self.middleware.call('zfs.dataset.query', [['encrypted', '=', True]], {
+                'extra': {'properties': ['encryption', 'keystatus', 'mountpoint', 'encryptionroot']},
+                'select': ['id', 'mountpoint', 'key_loaded', 'encryption_root'],
+            }))
+            if generation == self.generation:
+                self.index = index
+
+            return index
+
+    async def _about_to_lock(self):
+        try:
+            return await self.middleware.call('cache.get', 'about_to_lock_dataset')
+        except KeyError:
+            return None
+
+
+async def zfs_events(middleware, data):
+    if data['class'] in (
+        'sysevent.fs.zfs.config_sync',
+        'sysevent.fs.zfs.pool_create',
+        'sysevent.fs.zfs.pool_destroy',
+        'sysevent.fs.zfs.pool_export',
+        'sysevent.fs.zfs.pool_import',
+    ) or (
+        data['class'] == 'sysevent.fs.zfs.history_event' and '@' not in (data.get('history_dsname') or '@')
+    ):
+        await middleware.call('zfs.dataset.lock_state.invalidate')
+
+
+def setup(middleware):
+    middleware.register_hook('zfs.pool.events', zfs_events, sync=False)
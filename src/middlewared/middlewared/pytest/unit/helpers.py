@@ -1,6 +1,7 @@
 import functools
 import sys
 
+from middlewared.schema import resolve_methods, Schemas
 from middlewared.utils import LoadPluginsMixin, osc
 
 
@@ -22,3 +23,12 @@ def _compound_service_wrapper(service, fake_middleware):
     for part in service.parts:
         part.middleware = fake_middleware
     return service
+
+
+def resolve_query_schemas(*methods):
+    """
+    Resolve `query-filters` and `query-options` references of `@filterable` `methods` like middlewared does once
+    all plugins are loaded.
+    """
+    from middlewared.plugins.datastore.read import DatastoreService
+    resolve_methods(Schemas(), [DatastoreService.query] + list(methods))
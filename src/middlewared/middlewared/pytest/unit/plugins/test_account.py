@@ -0,0 +1,67 @@
+from asynctest import Mock
+import pytest
+
+from middlewared.plugins.account import UserService
+from middlewared.pytest.unit.helpers import resolve_query_schemas
+from middlewared.pytest.unit.middleware import Middleware
+
+resolve_query_schemas(UserService.query)
+
+
+@pytest.mark.asyncio
+async def test__user_service__user_extend_batch__memberships_in_one_query():
+    m = Middleware()
+    m["datastore.query"] = Mock(return_value=[
+        {"id": 1, "bsdgrpmember_user_id": 10, "bsdgrpmember_group_id": 100},
+        {"id": 2, "bsdgrpmember_user_id": 20, "bsdgrpmember_group_id": 100},
+        {"id": 3, "bsdgrpmember_user_id": 10, "bsdgrpmember_group_id": 200},
+    ])
+
+    users = await UserService(m).user_extend_batch([
+        {"id": 10, "email": "", "home": "/nonexistent"},
+        {"id": 20, "email": "user@example.com", "home": "/nonexistent"},
+        {"id": 30, "email": None, "home": "/nonexistent"},
+    ], {"sshpubkey": False})
+
+    assert m["datastore.query"].call_count == 1
+    assert [(user["email"], user["groups"], user["sshpubkey"]) for user in users] == [
+        (None, [100, 200], None),
+        ("user@example.com", [100], None),
+        (None, [], None),
+    ]
+
+
+@pytest.mark.asyncio
+async def test__user_service__user_extend_batch__sshpubkey(tmp_path):
+    (tmp_path / ".ssh").mkdir()
+    (tmp_path / ".ssh" / "authorized_keys").write_text("ssh-rsa AAAA")
+
+    m = Middleware()
+    m["datastore.query"] = Mock(return_value=[])
+
+    users = await UserService(m).user_extend_batch([
+        {"id": 10, "email": None, "home": str(tmp_path)},
+        {"id": 20, "email": None, "home": "/nonexistent"},
+    ], {"sshpubkey": True})
+
+    assert [user["sshpubkey"] for user in users] == ["ssh-rsa AAAA", None]
+
+
+@pytest.mark.parametrize("filters,options,sshpubkey", [
+    ([], {}, False),
+    ([["username", "=", "root"]], {"select": ["username"]}, False),
+    ([], {"select": ["username", "sshpubkey"]}, True),
+    ([], {"get": True}, True),
+    ([], {"extra": {"sshpubkey": True}}, True),
+    ([["sshpubkey", "!=", None]], {}, True),
+    ([["OR", [["username", "=", "root"], ["sshpubkey", "^", "ssh-ed25519"]]]], {}, True),
+    ([], {"order_by": ["-sshpubkey"]}, True),
+])
+@pytest.mark.asyncio
+async def test__user_service__query__loads_sshpubkey_when_needed(filters, options, sshpubkey):
+    m = Middleware()
+    m["datastore.query"] = Mock(return_value=[{"username": "root", "sshpubkey": None}])
+
+    await UserService(m).query(filters, options)
+
+    assert m["datastore.query"].call_args[0][2]["extra"]["sshpubkey"] is sshpubkey
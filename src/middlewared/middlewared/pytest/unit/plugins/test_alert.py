@@ -0,0 +1,158 @@
+import asyncio
+from collections import defaultdict
+from datetime import datetime
+
+from mock import Mock, patch
+import pytest
+
+from middlewared.alert.base import Alert, AlertCategory, AlertClass, AlertLevel, AlertSource
+from middlewared.plugins.alert import (
+    ALERT_SOURCES_CONCURRENCY, AlertService, AlertSourceRunFailedAlertClass, AlertStore,
+)
+from middlewared.pytest.unit.middleware import Middleware
+
+
+class SlowAlertClass(AlertClass):
+    category = AlertCategory.SYSTEM
+    level = AlertLevel.WARNING
+    title = "Slow"
+
+
+class SlowAlertSource(AlertSource):
+    def __init__(self, middleware, name, delay, run_timeout=60, args=None):
+        super().__init__(middleware)
+        self._name = name
+        self.delay = delay
+        self.run_timeout = run_timeout
+        self.args = args
+        self.checks = 0
+
+    @property
+    def name(self):
+        return self._name
+
+    running = 0
+    max_running = 0
+
+    async def check(self):
+        self.checks += 1
+        SlowAlertSource.running += 1
+        SlowAlertSource.max_running = max(SlowAlertSource.max_running, SlowAlertSource.running)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            SlowAlertSource.running -= 1
+        return Alert(SlowAlertClass, args=self.args, key=self.name)
+
+
+def alert_service(sources):
+    m = Middleware()
+    m["alert.product_type"] = Mock(return_value="CORE")
+    m["alertclasses.config"] = Mock(return_value={"classes": {}})
+    m["alert.node_map"] = Mock(return_value={"A": "Controller A"})
+    m.send_event = Mock()
+
+    service = AlertService(m)
+    service.node = "A"
+    service.alerts = AlertStore()
+    service.alert_source_last_run = defaultdict(lambda: datetime.min)
+
+    return service, patch("middlewared.plugins.alert.ALERT_SOURCES", {source.name: source for source in sources})
+
+
+@pytest.mark.asyncio
+async def test__run_alerts__concurrent():
+    sources = [SlowAlertSource(None, f"Slow{i}", 0.05) for i in range(ALERT_SOURCES_CONCURRENCY * 2)]
+    service, alert_sources = alert_service(sources)
+
+    SlowAlertSource.max_running = 0
+    with alert_sources:
+        await service._AlertService__run_alerts()
+
+    assert SlowAlertSource.max_running == ALERT_SOURCES_CONCURRENCY
+    assert [alert.source for alert in service.alerts] == [source.name for source in sources]
+
+
+@pytest.mark.asyncio
+async def test__run_alerts__timeout():
+    slow = SlowAlertSource(None, "Slow", 1, run_timeout=0.1)
+    fast = SlowAlertSource(None, "Fast", 0)
+    service, alert_sources = alert_service([slow, fast])
+
+    with alert_sources:
+        await service._AlertService__run_alerts()
+        service.alert_source_last_run.clear()
+        # Check that has timed out is not started again until it is done
+        await service._AlertService__run_alerts()
+
+        stats = {source["name"]: source for source in await service.list_sources(stats=True)}
+
+        await service.alert_source_checks["Slow"]
+
+    assert [(alert.source, alert.klass) for alert in service.alerts] == [
+        ("Slow", AlertSourceRunFailedAlertClass),
+        ("Fast", SlowAlertClass),
+    ]
+    assert slow.checks == 1
+    assert stats["Slow"]["runs"] == 2
+    assert stats["Slow"]["timeouts"] == 2
+    # Duration of the timed out run, not of the whole check
+    assert stats["Slow"]["last_duration"] < slow.delay
+    assert stats["Fast"]["timeouts"] == 0
+    assert stats["Fast"]["average_duration"] < 0.1
+
+
+def make_alert(uuid, source, key, node="A"):
+    return Alert(SlowAlertClass, key=key, node=node, _uuid=uuid, _source=source)
+
+
+def test__alert_store__indexes():
+    store = AlertStore([make_alert("1", "A", "a"), make_alert("2", "A", "b"), make_alert("3", "B", "a")])
+
+    assert store.get("2").key == '"b"'
+    assert store.get_existing(make_alert(None, "B", "a")).uuid == "3"
+    assert store.get_existing(make_alert(None, "B", "a", node="B")) is None
+    assert [alert.uuid for alert in store.by_source("A")] == ["1", "2"]
+
+
+def test__alert_store__replace_source():
+    store = AlertStore([make_alert("1", "A", "a"), make_alert("2", "B", "a"), make_alert("3", "A", "b")])
+
+    store.replace_source("A", [make_alert("3", "A", "b"), make_alert("4", "A", "c")])
+
+    assert [alert.uuid for alert in store] == ["2", "3", "4"]
+    assert store.get("1") is None
+    assert store.get_existing(make_alert(None, "A", "a")) is None
+    assert [alert.uuid for alert in store.by_source("A")] == ["3", "4"]
+
+
+def test__alert_store__remove():
+    store = AlertStore([make_alert("1", "A", "a"), make_alert("2", "A", "b")])
+
+    for alert in store:
+        store.remove(alert)
+
+    assert len(store) == 0
+    assert store.by_source("A") == []
+    assert store.get_existing(make_alert(None, "A", "a")) is None
+
+
+@pytest.mark.asyncio
+async def test__run_alerts__keeps_existing_alerts():
+    source = SlowAlertSource(None, "Slow", 0, args={"used": 90})
+    service, alert_sources = alert_service([source])
+
+    with alert_sources:
+        await service._AlertService__run_alerts()
+        alert = list(service.alerts)[0]
+        await service.dismiss(alert.uuid)
+
+        service.alert_source_last_run.clear()
+        source.args = {"used": 95}
+        await service._AlertService__run_alerts()
+
+    [updated] = list(service.alerts)
+    assert (updated.uuid, updated.datetime, updated.dismissed) == (alert.uuid, alert.datetime, True)
+    assert updated.args == {"used": 95}
+    assert service.middleware.send_event.call_args_list[-1][1]["id"] == alert.uuid
+    assert service.middleware.send_event.call_args_list[-1][1]["fields"]["args"] == {"used": 95}
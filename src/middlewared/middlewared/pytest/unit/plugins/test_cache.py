@@ -0,0 +1,69 @@
+import pytest
+
+from middlewared.plugins.cache import convert_legacy_cache, DSCacheTable
+
+
+def user(username, uid, sid=None, id=1):
+    return {"id": id, "username": username, "uid": uid, "sid": sid, "full_name": username.upper()}
+
+
+@pytest.fixture
+def table():
+    table = DSCacheTable("username", "uid")
+    table.update([
+        user("bob", 1001, "S-1-5-21-1", 1),
+        user("alice", 1000, "S-1-5-21-0", 2),
+        user("alfred", 1002, None, 3),
+    ])
+    return table
+
+
+@pytest.mark.parametrize("filters,expected", [
+    ([["username", "=", "bob"]], ["bob"]),
+    ([["username", "=", "nobody"]], []),
+    ([["username", "in", ["bob", "alice", "bob"]]], ["bob", "alice"]),
+    ([["username", "^", "al"]], ["alfred", "alice"]),
+    ([["uid", "=", 1000]], ["alice"]),
+    ([["uid", "in", [1001, 1002]]], ["bob", "alfred"]),
+    ([["sid", "=", "S-1-5-21-1"]], ["bob"]),
+    ([["full_name", "=", "BOB"]], ["alfred", "alice", "bob"]),
+    ([["username", "=", ["unhashable"]]], ["alfred", "alice", "bob"]),
+])
+def test__ds_cache_table__candidates(table, filters, expected):
+    assert [entry["username"] for entry in table.candidates(filters)] == expected
+
+
+def test__ds_cache_table__diff(table):
+    changed, removed = table.diff({
+        "bob": user("bob", 1001, "S-1-5-21-1", 10),
+        "alice": user("alice", 1005, "S-1-5-21-0", 2),
+        "carol": user("carol", 1003, None, 1),
+    })
+
+    assert [entry["username"] for entry in changed] == ["alice", "carol"]
+    assert removed == ["alfred"]
+
+
+def test__ds_cache_table__update_keeps_ids(table):
+    table.remove(["alfred"])
+    table.update([user("alice", 1005, "S-1-5-21-0", 7), user("carol", 1003, None, 1)])
+
+    assert table.entries["alice"]["id"] == 2
+    # Id 1 is taken by bob
+    assert table.entries["carol"]["id"] == 3
+    assert table.candidates([["uid", "=", 1000]]) == []
+    assert [entry["username"] for entry in table.candidates([["uid", "=", 1005]])] == ["alice"]
+    assert table.names == ["alice", "bob", "carol"]
+
+
+def test__convert_legacy_cache():
+    assert convert_legacy_cache({
+        "users": [{"bob": user("bob", 1001)}, {"alice": user("alice", 1000)}],
+        "groups": [],
+    }) == {
+        "users": {"bob": user("bob", 1001), "alice": user("alice", 1000)},
+        "groups": {},
+    }
+
+    cache_data = {"users": {"bob": user("bob", 1001)}, "groups": {}}
+    assert convert_legacy_cache(cache_data) == cache_data
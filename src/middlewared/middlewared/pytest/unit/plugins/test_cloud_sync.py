@@ -1,13 +1,16 @@
 # flake8: noqa
-import io
-import textwrap
-from unittest.mock import Mock
+import asyncio
+import json
+from unittest.mock import Mock, patch
 
 import pytest
 
 from middlewared.plugins.cloud_sync import (
-    get_dataset_recursive, FsLockManager, lsjson_error_excerpt, RcloneVerboseLogCutter
+    CredentialsService, CloudSyncService, get_dataset_recursive, FsLockManager, lsjson_error_excerpt,
+    rclone_session_key, RcloneJsonLogReader, RcloneSessions, RemoteListingCache,
 )
+from middlewared.pytest.unit.middleware import Middleware
+from middlewared.service_exception import CallError
 
 
 def test__get_dataset_recursive_1():
@@ -210,48 +213,323 @@ def test__lsjson_error_excerpt(error, excerpt):
     assert lsjson_error_excerpt(error) == excerpt
 
 
-def INFO(v):
-    return textwrap.dedent(f"""\
-        2020/01/22 22:32:{v:02d} INFO  : 
-        Transferred:   	  752.465G / 27.610 TBytes, 3%, 7.945 MBytes/s, ETA 5w6d1h16m55s
-        Errors:               478 (retrying may help)
-        Checks:                89 / 89, 100%
-        Transferred:           75 / 3546, 2%
-        Elapsed time:  26h56m23.1s
-        Transferring:
-         *         Cam (2018)/Cam (2018) WEBDL-1080p.mkv:  0% /3.470G, 0/s, -
-         * Call Me by Your Name (…2017) Bluray-1080p.mkv:  0% /9.839G, 0/s, -
-         * Can't Take It Back (20…(2017) WEBDL-1080p.mkv:  0% /3.035G, 0/s, -
-         * Candleshoe (1977)/Cand… (1977) WEBDL-720p.mkv:  0% /2.865G, 0/s, -
-    
-    """)
-
-
-@pytest.mark.parametrize("input,output", [
-    (f"WELCOME TO RCLONE\n{INFO(1)}{INFO(2)}BYE!\n", f"WELCOME TO RCLONE\n{INFO(1)}BYE!\n"),
-    (f"WELCOME TO RCLONE\n{INFO(1)}{INFO(2)}{INFO(3)}{INFO(4)}{INFO(5)}{INFO(6)}BYE!\n",
-     f"WELCOME TO RCLONE\n{INFO(1)}{INFO(6)}BYE!\n"),
-    (f"WELCOME TO RCLONE\n{INFO(1)}{INFO(2)[:300]}\nKilled (9)",
-     f"WELCOME TO RCLONE\n{INFO(1)}{INFO(2)[:300]}\nKilled (9)"),
-    (f"2020/01/27 13:16:15 INFO  : S3 bucket ixsystems: Waiting for transfers to finish\n"
-     f"{INFO(1)}{INFO(2)}{INFO(3)}{INFO(4)}{INFO(5)}{INFO(6)}BYE!\n",
-     f"2020/01/27 13:16:15 INFO  : S3 bucket ixsystems: Waiting for transfers to finish\n{INFO(1)}{INFO(6)}BYE!\n")
-])
-def test__RcloneVerboseLogCutter(input, output):
-    cutter = RcloneVerboseLogCutter(5)
-    f = io.StringIO(input)
+def STATS(v, **kwargs):
+    return json.dumps({
+        "level": "info",
+        "msg": f"\nTransferred:   \t  {v} MBytes / 10 MBytes, {v * 10}%, 1 MBytes/s, ETA {10 - v}s\n",
+        "source": "accounting/stats.go:417",
+        "stats": dict({
+            "bytes": v * 1048576,
+            "checks": 3,
+            "elapsedTime": v,
+            "errors": 0,
+            "eta": 10 - v,
+            "speed": 1048576,
+            "totalBytes": 10485760,
+            "totalChecks": 3,
+            "totalTransfers": 10,
+            "transfers": v,
+            "transferring": [
+                {"bytes": 524288, "eta": 1, "name": f"file{v}", "percentage": 50, "size": 1048576, "speed": 524288},
+            ],
+        }, **kwargs),
+        "time": f"2020-01-22T22:32:{v:02d}.000000+00:00",
+    }) + "\n"
+
+
+def test__RcloneJsonLogReader__log():
+    reader = RcloneJsonLogReader(5)
+
     out = ""
-    while True:
-        line = f.readline()
-        if not line:
-            break
+    for line in [
+        "WELCOME TO RCLONE\n",
+        json.dumps({
+            "level": "info", "msg": "Copied (new)", "object": "file0", "time": "2020-01-22T22:32:00.123456789+01:00",
+        }) + "\n",
+    ] + [STATS(v) for v in range(1, 8)] + ["Killed (9)"]:
+        text, progress = reader.notify(line)
+        if text:
+            out += text
+
+    assert out == (
+        "WELCOME TO RCLONE\n"
+        "2020/01/22 22:32:00 INFO  : file0: Copied (new)\n"
+        "2020/01/22 22:32:01 INFO  : \nTransferred:   \t  1 MBytes / 10 MBytes, 10%, 1 MBytes/s, ETA 9s\n"
+        "2020/01/22 22:32:06 INFO  : \nTransferred:   \t  6 MBytes / 10 MBytes, 60%, 1 MBytes/s, ETA 4s\n"
+        "Killed (9)"
+    )
+
+
+def test__RcloneJsonLogReader__progress():
+    reader = RcloneJsonLogReader(5)
+
+    reader.notify(STATS(1))
+    percent, description, extra = reader.notify(STATS(3, elapsedTime=2))[1]
+
+    assert percent == 30
+    assert description == "3 MiB / 10 MiB, 1 MiB/s, ETA 7 seconds"
+    assert extra == {
+        "bytes": 3145728,
+        "total_bytes": 10485760,
+        "bytes_per_second": 1048576,
+        "transfers": 3,
+        "total_transfers": 10,
+        "files_per_second": 2,
+        "checks": 3,
+        "total_checks": 3,
+        "errors": 0,
+        "elapsed_time": 2,
+        "eta": 7,
+        "transferring": [
+            {"name": "file3", "bytes": 524288, "size": 1048576, "percent": 50, "bytes_per_second": 524288, "eta": 1},
+        ],
+    }
+
+
+def test__RcloneJsonLogReader__progress_total_unknown():
+    percent, description, extra = RcloneJsonLogReader(5).notify(STATS(0, totalBytes=0, eta=None))[1]
+
+    assert percent is None
+    assert description == "0 bytes, 1 MiB/s"
+
+
+def task(**kwargs):
+    return dict({
+        "credentials": {"provider": "S3", "attributes": {"access_key_id": "key"}},
+        "attributes": {"bucket": "bucket", "folder": "/folder", "region": "us-east-1"},
+        "encryption": False,
+        "filename_encryption": False,
+        "encryption_password": "",
+        "encryption_salt": "",
+    }, **kwargs)
+
+
+def test__rclone_session_key__path_independent():
+    assert rclone_session_key(task()) == rclone_session_key(
+        task(attributes={"bucket": "other", "folder": "/", "region": "us-east-1"})
+    )
+
+
+@pytest.mark.parametrize("other", [
+    task(credentials={"provider": "S3", "attributes": {"access_key_id": "other"}}),
+    task(attributes={"bucket": "bucket", "folder": "/folder", "region": "eu-west-1"}),
+    task(encryption=True, encryption_password="password"),
+    {"credentials": {"provider": "S3", "attributes": {"access_key_id": "key"}}},
+])
+def test__rclone_session_key__configuration_dependent(other):
+    assert rclone_session_key(task()) != rclone_session_key(other)
+
+
+def test__RemoteListingCache():
+    cache = RemoteListingCache(size=2, ttl=30)
+    cache.put(1, "key", "bucket/a", [{"Name": "a"}])
+    cache.put(1, "key", "bucket/b", [{"Name": "b"}])
+
+    listing = cache.get(1, "key", "bucket/a")
+    listing[0]["Decrypted"] = "x"
+    assert cache.get(1, "key", "bucket/a") == [{"Name": "a"}]
+    assert cache.get(1, "other key", "bucket/a") is None
+
+    # `bucket/b` is least recently used
+    cache.put(2, "key", "bucket/a", [])
+    assert cache.get(1, "key", "bucket/b") is None
+    assert cache.get(2, "key", "bucket/a") == []
+
+    cache.invalidate(1)
+    assert cache.get(1, "key", "bucket/a") is None
+    assert cache.get(2, "key", "bucket/a") == []
+
+
+def test__RemoteListingCache__ttl():
+    cache = RemoteListingCache(ttl=30)
+    with patch("middlewared.plugins.cloud_sync.time.monotonic", Mock(return_value=100)):
+        cache.put(1, "key", "", [])
+        assert cache.get(1, "key", "") == []
+
+    with patch("middlewared.plugins.cloud_sync.time.monotonic", Mock(return_value=130)):
+        assert cache.get(1, "key", "") is None
+
+
+class FakeRcloneSession:
+    def __init__(self, config):
+        self.config = config
+        self.alive = False
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+
+    async def start(self):
+        self.alive = True
+        return self
+
+    async def call(self, method, params):
+        self.calls.append((method, params))
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(0.01)
+            if method == "operations/list":
+                return {"list": [{"Name": "a"}, {"Name": "b"}, {"Name": "bad"}]}
+            if "bad" in params["arg"]:
+                raise CallError("failed to decrypt")
+            return {"result": [f"decrypted {name}" for name in params["arg"]]}
+        finally:
+            self.running -= 1
+
+    async def stop(self):
+        self.alive = False
+
+
+@pytest.mark.asyncio
+async def test__RcloneSessions__stop():
+    sessions = RcloneSessions()
+    with patch("middlewared.plugins.cloud_sync.RcloneSession", FakeRcloneSession):
+        started = []
+        for credentials_id in (1, 2):
+            async with sessions.use(credentials_id, task()) as session:
+                started.append(session)
+
+    await sessions.stop()
+
+    assert not any(session.alive for session in started)
+    assert not sessions.sessions
+
 
-        result = cutter.notify(line)
-        if result:
-             out += result
+@pytest.mark.asyncio
+async def test__RcloneSessions__reused():
+    sessions = RcloneSessions()
+    with patch("middlewared.plugins.cloud_sync.RcloneSession", FakeRcloneSession):
+        async with sessions.use(1, task()) as first:
+            pass
+        async with sessions.use(1, task(attributes={"bucket": "other", "folder": "/", "region": "us-east-1"})) as second:
+            pass
 
-    result = cutter.flush()
-    if result:
-        out += result
+    assert first is second
+
+
+@pytest.mark.asyncio
+async def test__RcloneSessions__does_not_evict_sessions_in_use():
+    sessions = RcloneSessions(size=1)
+    with patch("middlewared.plugins.cloud_sync.RcloneSession", FakeRcloneSession):
+        async with sessions.use(1, task()) as in_use:
+            async with sessions.use(2, task()) as other:
+                pass
+            await asyncio.sleep(0)
+
+            assert in_use.alive
+
+            async with sessions.use(3, task()):
+                pass
+            await asyncio.sleep(0)
+
+            assert in_use.alive
+            assert not other.alive
+
+
+@pytest.mark.asyncio
+async def test__RcloneSessions__invalidated_session_is_stopped_by_last_user():
+    sessions = RcloneSessions()
+    with patch("middlewared.plugins.cloud_sync.RcloneSession", FakeRcloneSession):
+        async with sessions.use(1, task()) as session:
+            async with sessions.use(1, task()):
+                await sessions.invalidate(1)
+            await asyncio.sleep(0)
+
+            assert session.alive
+
+        await asyncio.sleep(0)
+
+    assert not session.alive
+    assert not sessions.sessions and not sessions.in_use and not sessions.retired
+
+
+@pytest.mark.asyncio
+async def test__RcloneSessions__reap_skips_sessions_in_use():
+    sessions = RcloneSessions(idle_timeout=0)
+    with patch("middlewared.plugins.cloud_sync.RcloneSession", FakeRcloneSession):
+        async with sessions.use(1, task()) as session:
+            session.used_at = 0
+            await sessions.reap()
+
+            assert session.alive
+
+        await sessions.reap()
+
+    assert not session.alive
+
+
+@pytest.fixture
+def rclone_sessions():
+    sessions = RcloneSessions()
+    with patch("middlewared.plugins.cloud_sync.RcloneSession", FakeRcloneSession), \
+            patch("middlewared.plugins.cloud_sync.RCLONE_SESSIONS", sessions), \
+            patch("middlewared.plugins.cloud_sync.REMOTE_LISTING_CACHE", RemoteListingCache()):
+        yield sessions
+
+
+def ls_config(**kwargs):
+    return task(credentials={"id": 1, "provider": "S3", "attributes": {"access_key_id": "key"}}, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test__CloudSyncService__ls__cached(rclone_sessions):
+    service = CloudSyncService(Middleware())
+
+    assert await service.ls(ls_config(), "bucket/a") == [{"Name": "a"}, {"Name": "b"}, {"Name": "bad"}]
+    await service.ls(ls_config(), "bucket/a")
+    await service.ls(ls_config(), "bucket/b")
+    await service.ls(ls_config(encryption=True, encryption_password="password"), "bucket/a")
+
+    calls = [
+        params["fs"]
+        for session in [await task for task in rclone_sessions.sessions.values()]
+        for method, params in session.calls
+    ]
+    assert calls == ["remote:bucket/a", "remote:bucket/b", "remote:bucket/a"]
+
+
+@pytest.mark.asyncio
+async def test__CloudSyncService__ls__decrypt_fallback(rclone_sessions):
+    service = CloudSyncService(Middleware())
+    service.DECRYPT_FILENAMES_CONCURRENCY = 2
+
+    result = await service.ls(
+        ls_config(encryption=True, filename_encryption=True, encryption_password="password"), "bucket",
+    )
 
-    assert out == output
+    assert result == [
+        {"Name": "a", "Decrypted": "decrypted a"},
+        {"Name": "b", "Decrypted": "decrypted b"},
+        {"Name": "bad"},
+    ]
+    [session] = [await task for task in rclone_sessions.sessions.values()]
+    assert [params["arg"] for method, params in session.calls[1:]] == [["a", "b", "bad"], ["a"], ["b"], ["bad"]]
+    assert session.max_running == 2
+
+
+@pytest.mark.parametrize("error", [None, "access denied"])
+@pytest.mark.asyncio
+async def test__CredentialsService__verify__private_session(rclone_sessions, error):
+    started = []
+
+    class Session(FakeRcloneSession):
+        async def start(self):
+            started.append(self)
+            return await super().start()
+
+        async def call(self, method, params):
+            if error:
+                raise CallError(error)
+            return {"list": []}
+
+    service = CredentialsService(Middleware())
+    with patch("middlewared.plugins.cloud_sync.RcloneSession", Session), \
+            patch.object(service, "_validate", Mock(return_value=asyncio.sleep(0))):
+        result = await service.verify({"provider": "S3", "attributes": {"access_key_id": "key"}})
+
+    assert result["valid"] is (error is None)
+    assert [session.config for session in started] == [
+        {"credentials": {"provider": "S3", "attributes": {"access_key_id": "key"}, "name": ""}},
+    ]
+    assert not started[0].alive
+    assert not rclone_sessions.sessions
@@ -1,6 +1,10 @@
+import asyncio
 from contextlib import asynccontextmanager
 import datetime
-from unittest.mock import patch
+import shutil
+import sqlite3
+import threading
+from unittest.mock import Mock, patch
 
 import pytest
 import sqlalchemy as sa
@@ -11,6 +15,7 @@ from sqlalchemy.orm import relationship
 from middlewared.sqlalchemy import EncryptedText, JSON, Time
 
 import middlewared.plugins.datastore  # noqa
+from middlewared.plugins.datastore.cache import DatastoreQueryCache
 import middlewared.plugins.datastore.connection  # noqa
 import middlewared.plugins.datastore.schema  # noqa
 import middlewared.plugins.datastore.util  # noqa
@@ -24,9 +29,13 @@ Model = declarative_base()
 
 
 @asynccontextmanager
-async def datastore_test():
-    m = Middleware()
-    with patch("middlewared.plugins.datastore.connection.FREENAS_DATABASE", ":memory:"):
+async def datastore_test(m=None, database=":memory:"):
+    m = m or Middleware()
+    query_cache = DatastoreQueryCache()
+    with patch("middlewared.plugins.datastore.connection.FREENAS_DATABASE", database), \
+            patch("middlewared.plugins.datastore.cache.QUERY_CACHE", query_cache), \
+            patch("middlewared.plugins.datastore.connection.QUERY_CACHE", query_cache), \
+            patch("middlewared.plugins.datastore.read.QUERY_CACHE", query_cache):
         with patch("middlewared.plugins.datastore.schema.Model", Model):
             with patch("middlewared.plugins.datastore.util.Model", Model):
                 ds = DatastoreService(m)
@@ -34,13 +43,14 @@ async def datastore_test():
 
                 for part in ds.parts:
                     if hasattr(part, "connection"):
-                        Model.metadata.create_all(bind=part.connection)
+                        await m.run_in_executor(part.thread_pool, Model.metadata.create_all, bind=part.connection)
                         break
                 else:
                     raise RuntimeError("Could not find part that provides connection")
 
                 m["datastore.execute"] = ds.execute
                 m["datastore.execute_write"] = ds.execute_write
+                m["datastore.execute_write_many"] = ds.execute_write_many
                 m["datastore.fetchall"] = ds.fetchall
 
                 m["datastore.query"] = ds.query
@@ -557,6 +567,73 @@ async def test__custom_pk_delete():
         assert await ds.query("test.custompk", [], {"count": True}) == 1
 
 
+@pytest.mark.asyncio
+async def test__custom_pk_bulk_write():
+    async with datastore_test() as ds:
+        await ds.execute("INSERT INTO test_custompk VALUES ('ID1', 'Test 1')")
+        await ds.execute("INSERT INTO test_custompk VALUES ('ID2', 'Test 2')")
+
+        assert await ds.bulk_write(
+            "test.custompk",
+            [{"identifier": "ID3", "name": "Test 3"}],
+            [["ID1", {"name": "Updated"}]],
+            [],
+            {"prefix": "custom_"},
+        ) == ["ID3"]
+
+        assert await ds.query("test.custompk", [], {"prefix": "custom_"}) == [
+            {"identifier": "ID1", "name": "Updated"},
+            {"identifier": "ID2", "name": "Test 2"},
+            {"identifier": "ID3", "name": "Test 3"},
+        ]
+        assert ds.middleware.call_hook_inline.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test__bulk_write__integer_pk():
+    async with datastore_test() as ds:
+        assert await ds.bulk_write("account.bsdgroups", [{"bsdgrp_gid": 1010}, {"bsdgrp_gid": 2020}], [], []) == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test__bulk_write__deletes():
+    async with datastore_test() as ds:
+        await ds.execute("INSERT INTO test_custompk VALUES ('ID1', 'Test 1')")
+        await ds.execute("INSERT INTO test_custompk VALUES ('ID2', 'Test 2')")
+        await ds.insert("account.bsdgroups", {"bsdgrp_gid": 1010})
+
+        assert await ds.bulk_write(
+            "test.custompk",
+            [{"identifier": "ID3", "name": "Test 3"}],
+            [],
+            [["account.bsdgroups", 1], ["test.custompk", "ID1"]],
+            {"prefix": "custom_"},
+        ) == ["ID3"]
+
+        assert await ds.query("test.custompk", [], {"prefix": "custom_"}) == [
+            {"identifier": "ID2", "name": "Test 2"},
+            {"identifier": "ID3", "name": "Test 3"},
+        ]
+        assert await ds.query("account.bsdgroups", [], {"count": True}) == 0
+
+
+@pytest.mark.parametrize("inserts,updates,deletes", [
+    ([{"identifier": "ID3", "name": "Test 3"}, {"identifier": "ID2", "name": "Duplicate"}], [], []),
+    ([{"identifier": "ID3", "name": "Test 3"}], [["ID4", {"name": "Missing"}]], []),
+    ([{"identifier": "ID3", "name": "Test 3"}], [], [["test.custompk", "ID4"]]),
+])
+@pytest.mark.asyncio
+async def test__bulk_write__rolled_back(inserts, updates, deletes):
+    async with datastore_test() as ds:
+        await ds.execute("INSERT INTO test_custompk VALUES ('ID2', 'Test 2')")
+
+        with pytest.raises(Exception):
+            await ds.bulk_write("test.custompk", inserts, updates, deletes, {"prefix": "custom_"})
+
+        assert await ds.query("test.custompk", [], {"prefix": "custom_"}) == [{"identifier": "ID2", "name": "Test 2"}]
+        ds.middleware.call_hook_inline.assert_not_called()
+
+
 @pytest.mark.asyncio
 async def test__delete_by_filter():
     async with datastore_test() as ds:
@@ -770,3 +847,263 @@ async def test__null_order_by(order_by, result):
         await ds.insert("test.null", {"value": 1})
 
         assert [row["id"] for row in await ds.query("test.null", [], {"order_by": order_by})] == result
+
+
+def connection_part(ds):
+    return [part for part in ds.parts if hasattr(part, "connection")][0]
+
+
+class ThreadedMiddleware(Middleware):
+    async def run_in_executor(self, executor, method, *args, **kwargs):
+        return await asyncio.get_event_loop().run_in_executor(executor, lambda: method(*args, **kwargs))
+
+
+@pytest.mark.asyncio
+async def test__wal__read_after_write(tmp_path):
+    async with datastore_test(ThreadedMiddleware(), str(tmp_path / "freenas-v1.db")) as ds:
+        assert connection_part(ds).read_connections is not None
+        assert (await ds.fetchall("PRAGMA journal_mode"))[0][0] == "wal"
+
+        gid = await ds.insert("account.bsdgroups", {"bsdgrp_gid": 1010})
+        await ds.update("account.bsdgroups", gid, {"bsdgrp_gid": 2020})
+
+        assert await ds.query("account.bsdgroups") == [{"id": gid, "bsdgrp_gid": 2020}]
+        assert (await ds.query("account.bsdgroups", [("bsdgrp_gid", "=", 2020)], {"count": True})) == 1
+
+
+@pytest.mark.asyncio
+async def test__wal__insert_pk(tmp_path):
+    async with datastore_test(ThreadedMiddleware(), str(tmp_path / "freenas-v1.db")) as ds:
+        assert [await ds.insert("test.null", {"value": i}) for i in range(3)] == [1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test__wal__read_connection_is_read_only(tmp_path):
+    async with datastore_test(ThreadedMiddleware(), str(tmp_path / "freenas-v1.db")) as ds:
+        with pytest.raises(sa.exc.OperationalError):
+            await ds.fetchall("INSERT INTO test_null VALUES (1, 1)")
+
+
+@pytest.mark.asyncio
+async def test__wal__post_execute_write_order(tmp_path):
+    m = ThreadedMiddleware()
+    async with datastore_test(m, str(tmp_path / "freenas-v1.db")) as ds:
+        await asyncio.gather(*[ds.insert("test.null", {"value": i}) for i in range(20)])
+
+        assert [call[0][2] for call in m.call_hook_inline.call_args_list] == [[i] for i in range(20)]
+
+
+@pytest.mark.asyncio
+async def test__wal__reads_do_not_wait_for_writes(tmp_path):
+    async with datastore_test(ThreadedMiddleware(), str(tmp_path / "freenas-v1.db")) as ds:
+        await ds.insert("test.null", {"value": 1})
+
+        part = connection_part(ds)
+        write_started = threading.Event()
+        write_release = threading.Event()
+
+        def slow_write():
+            # Hold the write transaction open like a slow multi-statement write would
+            dbapi_connection = part.connection.connection
+            dbapi_connection.execute("BEGIN")
+            dbapi_connection.execute("INSERT INTO test_null (value) VALUES (2)")
+            write_started.set()
+            write_release.wait(10)
+            dbapi_connection.execute("COMMIT")
+
+        write = asyncio.get_event_loop().run_in_executor(part.thread_pool, slow_write)
+        await asyncio.get_event_loop().run_in_executor(None, write_started.wait)
+
+        try:
+            # Readers are served while the write transaction is still open and see the last committed state
+            results = await asyncio.wait_for(asyncio.gather(*[ds.query("test.null") for i in range(50)]), 5)
+            assert results == [[{"id": 1, "value": 1}]] * 50, results[0]
+        finally:
+            write_release.set()
+            await write
+
+        assert await ds.query("test.null") == [{"id": 1, "value": 1}, {"id": 2, "value": 2}]
+
+
+@pytest.mark.asyncio
+async def test__wal__checkpoint(tmp_path):
+    database = tmp_path / "freenas-v1.db"
+    async with datastore_test(ThreadedMiddleware(), str(database)) as ds:
+        await ds.insert("test.null", {"value": 1})
+        assert (tmp_path / "freenas-v1.db-wal").stat().st_size > 0
+
+        await ds.checkpoint()
+
+        assert (tmp_path / "freenas-v1.db-wal").stat().st_size == 0
+        # A copy of the database file alone has all committed changes
+        shutil.copy(database, tmp_path / "copy.db")
+        copy = sqlite3.connect(str(tmp_path / "copy.db"))
+        try:
+            assert copy.execute("SELECT value FROM test_null").fetchall() == [(1,)]
+        finally:
+            copy.close()
+
+        # Read connections were reopened
+        assert await ds.query("test.null") == [{"id": 1, "value": 1}]
+
+
+@pytest.mark.asyncio
+async def test__wal__replace(tmp_path):
+    database = tmp_path / "freenas-v1.db"
+    async with datastore_test(ThreadedMiddleware(), str(database)) as ds:
+        await ds.insert("test.null", {"value": 1})
+        await ds.checkpoint()
+        shutil.copy(database, tmp_path / "new.db")
+
+        # This change only lives in the write-ahead log of the database that is being replaced
+        await ds.insert("test.null", {"value": 2})
+
+        await ds.replace(str(tmp_path / "new.db"))
+
+        assert not (tmp_path / "new.db").exists()
+        assert await ds.query("test.null") == [{"id": 1, "value": 1}]
+        assert await ds.insert("test.null", {"value": 3}) == 2
+
+
+@pytest.mark.asyncio
+async def test__cache__hit():
+    async with datastore_test() as ds:
+        ds.register_cache("account.bsdgroups")
+        await ds.execute("INSERT INTO `account_bsdgroups` VALUES (10, 1010)")
+
+        first = await ds.query("account.bsdgroups", [["bsdgrp_gid", "=", 1010]], {"prefix": "bsdgrp_"})
+        first[0]["gid"] = 0
+        second = await ds.query("account.bsdgroups", [["bsdgrp_gid", "=", 1010]], {"prefix": "bsdgrp_"})
+
+        # Cached results must not be affected by callers modifying them
+        assert second == [{"id": 10, "gid": 1010}]
+        assert await ds.query(
+            "account.bsdgroups", [["bsdgrp_gid", "=", 1010]], {"prefix": "bsdgrp_", "count": True},
+        ) == 1
+        assert ds.cache_stats() == {"account.bsdgroups": {"hits": 1, "misses": 2, "invalidations": 0, "entries": 2}}
+
+
+@pytest.mark.asyncio
+async def test__cache__extend_is_not_cached():
+    async with datastore_test() as ds:
+        ds.middleware["group.extend"] = lambda group: dict(group, extended=True)
+        ds.register_cache("account.bsdgroups")
+        await ds.execute("INSERT INTO `account_bsdgroups` VALUES (10, 1010)")
+
+        assert await ds.query("account.bsdgroups") == [{"id": 10, "bsdgrp_gid": 1010}]
+        assert await ds.query("account.bsdgroups", [], {"extend": "group.extend", "get": True}) == {
+            "id": 10, "bsdgrp_gid": 1010, "extended": True,
+        }
+        assert await ds.query("account.bsdgroups", [], {"select": ["bsdgrp_gid"]}) == [{"bsdgrp_gid": 1010}]
+        assert ds.cache_stats()["account.bsdgroups"]["hits"] == 2
+
+
+@pytest.mark.parametrize("write", [
+    lambda ds: ds.insert("account.bsdgroups", {"bsdgrp_gid": 3030}),
+    lambda ds: ds.update("account.bsdgroups", 10, {"bsdgrp_gid": 3030}),
+    lambda ds: ds.delete("account.bsdgroups", 20),
+    lambda ds: ds.sql("UPDATE account_bsdgroups SET bsdgrp_gid = 3030"),
+])
+@pytest.mark.asyncio
+async def test__cache__invalidated_by_write(write):
+    async with datastore_test() as ds:
+        ds.register_cache("account.bsdgroups")
+        await ds.execute("INSERT INTO `account_bsdgroups` VALUES (10, 1010)")
+        await ds.execute("INSERT INTO `account_bsdgroups` VALUES (20, 2020)")
+
+        before = await ds.query("account.bsdgroups")
+        await write(ds)
+
+        assert await ds.query("account.bsdgroups") != before
+        assert ds.cache_stats()["account.bsdgroups"]["hits"] == 0
+
+
+@pytest.mark.asyncio
+async def test__cache__invalidated_by_joined_table_write():
+    async with datastore_test() as ds:
+        ds.register_cache("account.bsdusers")
+        ds.register_cache("account.bsdgroups")
+        await ds.execute("INSERT INTO `account_bsdgroups` VALUES (10, 1010)")
+        await ds.execute("INSERT INTO `account_bsdusers` VALUES (5, 55, 10)")
+
+        assert (await ds.query("account.bsdusers", [], {"get": True}))["bsdusr_group"]["bsdgrp_gid"] == 1010
+        await ds.query("account.bsdgroups")
+        await ds.update("account.bsdusers", 5, {"bsdusr_uid": 66})
+
+        # Writing to users does not affect cached groups
+        await ds.query("account.bsdgroups")
+        assert ds.cache_stats()["account.bsdgroups"]["hits"] == 1
+
+        await ds.update("account.bsdgroups", 10, {"bsdgrp_gid": 2020})
+
+        user = await ds.query("account.bsdusers", [], {"get": True})
+        assert user["bsdusr_uid"] == 66
+        assert user["bsdusr_group"]["bsdgrp_gid"] == 2020
+
+
+@pytest.mark.asyncio
+async def test__write_generations():
+    async with datastore_test() as ds:
+        before = ds.write_generations(["account.bsdgroups", "account.bsdusers"])
+
+        await ds.insert("account.bsdgroups", {"bsdgrp_gid": 1010})
+        after_insert = ds.write_generations(["account.bsdgroups", "account.bsdusers"])
+        assert after_insert != before
+        # Writes to other tables do not matter
+        assert ds.write_generations(["account.bsdusers"]) == [before[0], [before[1][1]]]
+
+        await ds.sql("UPDATE account_bsdgroups SET bsdgrp_gid = 3030")
+        assert ds.write_generations(["account.bsdgroups", "account.bsdusers"]) != after_insert
+
+
+@pytest.mark.asyncio
+async def test__cache__invalidated_by_many_to_many_write():
+    async with datastore_test() as ds:
+        ds.register_cache("tasks.smarttest")
+        await ds.execute("INSERT INTO storage_disk VALUES (10)")
+        await ds.execute("INSERT INTO storage_disk VALUES (20)")
+        await ds.insert("tasks.smarttest", {"disks": [10]}, {"prefix": "smarttest_"})
+
+        assert (await ds.query("tasks.smarttest", [], {"prefix": "smarttest_", "get": True}))["disks"] == [{"id": 10}]
+
+        await ds.update("tasks.smarttest", 1, {"disks": [20]}, {"prefix": "smarttest_"})
+        assert (await ds.query("tasks.smarttest", [], {"prefix": "smarttest_", "get": True}))["disks"] == [{"id": 20}]
+
+
+def test__query_cache__concurrent_write_is_not_cached():
+    cache = DatastoreQueryCache()
+    cache.register("account_bsdgroups", {"account_bsdgroups"})
+
+    hit, result, generation = cache.get("account_bsdgroups", "key")
+    assert not hit
+    # Write happens while the query is running
+    cache.invalidate("account_bsdgroups")
+    cache.put("account_bsdgroups", "key", ["stale"], generation)
+
+    assert cache.get("account_bsdgroups", "key")[0] is False
+
+
+@pytest.mark.asyncio
+async def test__extend_batch():
+    async with datastore_test() as ds:
+        batches = []
+
+        def extend_batch(rows, context):
+            batches.append(len(rows))
+            return [dict(row, gid=row["gid"] + context) for row in rows]
+
+        ds.middleware["group.extend_context"] = lambda extra: 1
+        ds.middleware["group.extend_batch"] = extend_batch
+        ds.middleware["group.extend"] = Mock()
+        await ds.execute("INSERT INTO `account_bsdgroups` VALUES (10, 1010)")
+        await ds.execute("INSERT INTO `account_bsdgroups` VALUES (20, 2020)")
+
+        assert await ds.query("account.bsdgroups", [], {
+            "prefix": "bsdgrp_",
+            "extend": "group.extend",
+            "extend_batch": "group.extend_batch",
+            "extend_context": "group.extend_context",
+            "select": ["gid"],
+        }) == [{"gid": 1011}, {"gid": 2021}]
+        assert batches == [2]
+        ds.middleware["group.extend"].assert_not_called()
@@ -1,10 +1,14 @@
+import asyncio
+from datetime import datetime
 import textwrap
+from unittest.mock import patch
 
 from asynctest import CoroutineMock, Mock
 import pytest
 
 from middlewared.plugins.disk_.smart_attributes import DiskService as SmartAttributesDiskService
-from middlewared.plugins.disk_.temperature import get_temperature
+from middlewared.plugins.disk_.sync import DiskService as SyncDiskService
+from middlewared.plugins.disk_.temperature import DiskService as TemperatureDiskService, get_temperature
 from middlewared.pytest.unit.middleware import Middleware
 
 
@@ -55,3 +59,115 @@ async def test__disk_service__sata_dom_lifetime_left():
     """))
 
     assert abs(await SmartAttributesDiskService(m).sata_dom_lifetime_left("ada1") - 0.8926) < 1e-4
+
+
+def temperature_disk_service(temperatures, delay=0):
+    service = TemperatureDiskService(Middleware())
+    service.samples = []
+
+    async def sample_temperature(name, powermode):
+        service.samples.append((name, powermode))
+        await asyncio.sleep(delay)
+        return temperatures[name]
+
+    service.sample_temperature = sample_temperature
+    return service
+
+
+@pytest.mark.asyncio
+async def test__disk_service__temperatures__cached():
+    service = temperature_disk_service({"ada0": 30, "ada1": None})
+
+    assert await service.temperatures(["ada0", "ada1"], "NEVER") == {"ada0": 30, "ada1": None}
+    assert await service.temperature("ada0", "NEVER") == 30
+    assert len(service.samples) == 2
+
+    # Cache is per power mode
+    await service.temperatures(["ada0"], "STANDBY")
+    assert len(service.samples) == 3
+
+    samples = await service.temperatures(["ada0"], "NEVER", {"max_age": 0, "with_age": True})
+    assert len(service.samples) == 4
+    assert samples["ada0"]["temperature"] == 30
+    assert 0 <= samples["ada0"]["age"] < 1
+
+
+@pytest.mark.asyncio
+async def test__disk_service__temperatures__concurrent_callers_share_pass():
+    service = temperature_disk_service({"ada0": 30, "ada1": 31}, delay=0.1)
+
+    await asyncio.gather(*[service.temperatures(["ada0", "ada1"], "NEVER") for i in range(5)])
+
+    assert sorted(service.samples) == [("ada0", "NEVER"), ("ada1", "NEVER")]
+
+
+@pytest.mark.asyncio
+async def test__disk_service__sync_all__bulk_diff():
+    def sys_disk(name, serial, lunid=None):
+        return {
+            "name": name, "ident": serial, "serial": serial, "lunid": lunid,
+            "serial_lunid": f"{serial}_{lunid}" if lunid else None, "rotationrate": None, "type": "SSD",
+            "size": 1024, "subsystem": "da", "number": 0, "model": "Disk",
+        }
+
+    def db_disk(identifier, name, expiretime=None, **kwargs):
+        return dict({
+            "disk_identifier": identifier, "disk_name": name, "disk_serial": name, "disk_rotationrate": None,
+            "disk_type": "SSD", "disk_size": "1024", "disk_subsystem": "da", "disk_number": 0, "disk_model": "Disk",
+            "disk_expiretime": expiretime, "disk_kmip_uid": None,
+        }, **kwargs)
+
+    sys_disks = {
+        "sda": sys_disk("sda", "sda"),
+        "sdb": sys_disk("sdb", "sdb"),
+        # Multipath
+        "sdc": sys_disk("sdc", "sdc", "lun"),
+        "sdd": sys_disk("sdd", "sdc", "lun"),
+        "sde": sys_disk("sde", "sde"),
+    }
+    db_disks = [
+        db_disk("{serial}sda", "sda"),
+        db_disk("{serial}sdb", "sdx"),
+        db_disk("{serial_lunid}sdc_lun", "sdc", disk_serial="sdc"),
+        db_disk("{serial}gone", "gone"),
+        db_disk("{serial}expired", "expired", datetime(2000, 1, 1)),
+    ]
+
+    m = Middleware()
+    m["failover.licensed"] = Mock(return_value=False)
+    m["device.get_disks"] = Mock(return_value=sys_disks)
+    m["disk.device_to_identifier"] = lambda name, disks: (
+        f"{{serial_lunid}}{disks[name]['serial_lunid']}" if disks[name]["serial_lunid"]
+        else f"{{serial}}{disks[name]['serial']}"
+    )
+    m["datastore.query"] = Mock(return_value=db_disks)
+    m["datastore.bulk_write"] = Mock()
+    m["iscsi.extent.query"] = Mock(return_value=[{"id": 7}])
+    m["iscsi.targetextent.query"] = Mock(return_value=[{"id": 3, "target": 1}])
+    m["iscsi.target.active_sessions_for_targets"] = Mock(return_value=[])
+    m["service.query"] = Mock(return_value={"state": "RUNNING"})
+    m["etc.generate"] = Mock()
+    m["service.reload"] = Mock(return_value=True)
+    m["enclosure.sync_disk"] = Mock()
+    m["disk.restart_services_after_sync"] = Mock()
+
+    with patch("middlewared.plugins.disk_.sync.osc.IS_FREEBSD", False):
+        assert await SyncDiskService(m).sync_all(Mock()) == "OK"
+
+    [(table, inserts, updates, deletes)] = [call[0] for call in m["datastore.bulk_write"].call_args_list]
+    assert table == "storage.disk"
+    assert [disk["disk_identifier"] for disk in inserts] == ["{serial}sde"]
+    assert {identifier: (disk["disk_name"], disk["disk_expiretime"] is None) for identifier, disk in updates} == {
+        "{serial}sdb": ("sdb", True),
+        "{serial}gone": ("gone", False),
+    }
+    assert deletes == [
+        ["services.iscsitargettoextent", 3],
+        ["services.iscsitargetextent", 7],
+        ["storage.disk", "{serial}expired"],
+    ]
+    m["service.reload"].assert_called_once_with("iscsitarget")
+    assert [call[0][0] for call in m["enclosure.sync_disk"].call_args_list] == [
+        "{serial}sda", "{serial}sdb", "{serial_lunid}sdc_lun", "{serial}sde",
+    ]
+    m["disk.restart_services_after_sync"].assert_called_once_with()
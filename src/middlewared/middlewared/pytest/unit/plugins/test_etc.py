@@ -0,0 +1,88 @@
+import asyncio
+from contextlib import contextmanager
+from unittest.mock import Mock, patch
+
+import pytest
+
+from middlewared.plugins.etc import EtcService
+from middlewared.pytest.unit.middleware import Middleware
+
+
+class Renderer:
+    def __init__(self):
+        self.rendered = []
+
+    async def render(self, path):
+        self.rendered.append(path)
+        await asyncio.sleep(0)
+        return f"{path} {len(self.rendered)}\n"
+
+
+@contextmanager
+def etc_service(tmp_path, groups, inputs=None):
+    m = Middleware()
+    m["datastore.write_generations"] = Mock(return_value={"test.table": 1})
+
+    service = EtcService(m)
+    service.files_dir = ""
+    renderer = Renderer()
+    service._renderers = {"mako": renderer}
+    service._outfile = lambda entry: str(tmp_path / entry["path"])
+
+    with patch.dict(EtcService.GROUPS, groups, clear=True), patch.dict(EtcService.INPUTS, inputs or {}, clear=True):
+        yield m, service, renderer
+
+
+@pytest.fixture
+def fingerprinted(tmp_path):
+    with etc_service(tmp_path, {"test": [{"type": "mako", "path": "test.conf"}]}, {"test": ["test.table"]}) as (
+        m, service, renderer,
+    ):
+        yield m, service, renderer, tmp_path / "test.conf"
+
+
+@pytest.mark.asyncio
+async def test__etc__skips_unchanged_group(fingerprinted):
+    m, service, renderer, outfile = fingerprinted
+
+    await service.generate("test")
+    await service.generate("test")
+
+    assert renderer.rendered == ["test.conf"]
+    assert service.stats["test"]["skipped"] == 1
+
+    m["datastore.write_generations"].return_value = {"test.table": 2}
+    await service.generate("test")
+
+    assert len(renderer.rendered) == 2
+
+
+@pytest.mark.parametrize("change", ["edit", "remove"])
+@pytest.mark.asyncio
+async def test__etc__regenerates_group_changed_on_disk(fingerprinted, change):
+    m, service, renderer, outfile = fingerprinted
+
+    await service.generate("test")
+    if change == "edit":
+        outfile.write_text("edited by someone else\n")
+    else:
+        outfile.unlink()
+    await service.generate("test")
+
+    assert len(renderer.rendered) == 2
+    assert outfile.read_text() == "test.conf 2\n"
+
+
+@pytest.mark.asyncio
+async def test__etc__checkpoint_dependencies(tmp_path):
+    groups = {
+        name: [{"type": "mako", "path": f"{name}.conf"}]
+        for name in ["user", "system_dataset", "nginx", "ssl", "motd"]
+    }
+    with etc_service(tmp_path, groups) as (m, service, renderer):
+        with patch.object(EtcService, "DEPENDENCIES", {"nginx": ["ssl"]}):
+            await service.generate_checkpoint("initial")
+
+    assert sorted(renderer.rendered[:2]) == ["system_dataset.conf", "user.conf"]
+    assert renderer.rendered.index("ssl.conf") < renderer.rendered.index("nginx.conf")
+    assert sorted(renderer.rendered) == sorted(f"{name}.conf" for name in groups)
@@ -0,0 +1,172 @@
+import copy
+
+from middlewared.plugins.iscsi_.scst_linux import scst_diff, scst_model
+
+TARGETS = "/sys/kernel/scst_tgt/targets/iscsi"
+HANDLERS = "/sys/kernel/scst_tgt/handlers"
+
+
+def extent(id, name, **kwargs):
+    return dict({
+        "id": id,
+        "name": name,
+        "type": "DISK",
+        "disk": f"zvol/tank/{name}",
+        "path": f"zvol/tank/{name}",
+        "serial": f"serial{id}",
+        "naa": f"0x{id}",
+        "vendor": "TrueNAS",
+        "blocksize": 512,
+        "ro": False,
+        "xen": True,
+        "rpm": "SSD",
+    }, **kwargs)
+
+
+def target(id, name, initiator=None):
+    return {
+        "id": id,
+        "name": name,
+        "groups": [{"portal": 1, "initiator": initiator, "authmethod": "NONE", "auth": None}],
+    }
+
+
+def model(extents, targets, associations):
+    return scst_model(
+        {"basename": "iqn.2005-10.org.freenas.ctl"},
+        targets,
+        {e["id"]: e for e in extents},
+        {1: {"listen": [{"ip": "0.0.0.0", "port": 3260}]}},
+        {1: {"initiators": ["iqn.1991-05.com.microsoft:a", "iqn.1991-05.com.microsoft:b"]}},
+        [],
+        [{"target": t, "extent": e, "lunid": lunid} for t, e, lunid in associations],
+    )
+
+
+def test__scst_model():
+    m = model([extent(1, "disk1")], [target(1, "t1", 1), target(2, "t2")], [(1, 1, 0), (2, 2, 0)])
+
+    assert m["devices"] == {
+        "disk1": {
+            "handler": "vdisk_blockio",
+            "params": {"filename": "/dev/zvol/tank/disk1", "blocksize": "512", "read_only": "0"},
+            "attributes": {
+                "usn": "serial1",
+                "naa_id": "0x1",
+                "prod_id": "iSCSI Disk",
+                "t10_vend_id": "TrueNAS",
+                "t10_dev_id": "serial1",
+            },
+        },
+    }
+    assert m["targets"] == {
+        "iqn.2005-10.org.freenas.ctl:t1": {
+            "attributes": {"enabled": "1", "per_portal_acl": "1"},
+            "incoming_users": [],
+            "outgoing_user": None,
+            "initiators": ["iqn.1991-05.com.microsoft:a#*", "iqn.1991-05.com.microsoft:b#*"],
+            "luns": {0: "disk1"},
+        },
+        # Extent 2 is disabled or locked
+        "iqn.2005-10.org.freenas.ctl:t2": {
+            "attributes": {"enabled": "1", "per_portal_acl": "1"},
+            "incoming_users": [],
+            "outgoing_user": None,
+            "initiators": ["*#*"],
+            "luns": {},
+        },
+    }
+
+
+def test__scst_diff__noop():
+    m = model([extent(1, "disk1")], [target(1, "t1")], [(1, 1, 0)])
+
+    assert scst_diff(m, copy.deepcopy(m)) == []
+
+
+def test__scst_diff__add_lun():
+    old = model([extent(1, "disk1")], [target(1, "t1"), target(2, "t2")], [(1, 1, 0)])
+    new = model([extent(1, "disk1"), extent(2, "disk2")], [target(1, "t1"), target(2, "t2")], [(1, 1, 0), (2, 2, 3)])
+
+    assert scst_diff(old, new) == [
+        (f"{HANDLERS}/vdisk_blockio/mgmt", "add_device disk2 filename=/dev/zvol/tank/disk2; blocksize=512; read_only=0",
+         None),
+        ("/sys/kernel/scst_tgt/devices/disk2/usn", "serial2", None),
+        ("/sys/kernel/scst_tgt/devices/disk2/naa_id", "0x2", None),
+        ("/sys/kernel/scst_tgt/devices/disk2/prod_id", "iSCSI Disk", None),
+        ("/sys/kernel/scst_tgt/devices/disk2/t10_vend_id", "TrueNAS", None),
+        ("/sys/kernel/scst_tgt/devices/disk2/t10_dev_id", "serial2", None),
+        (f"{TARGETS}/iqn.2005-10.org.freenas.ctl:t2/ini_groups/security_group/luns/mgmt", "add disk2 3", None),
+    ]
+
+
+def test__scst_diff__recreate_device():
+    old = model([extent(1, "disk1")], [target(1, "t1")], [(1, 1, 0)])
+    new = model([extent(1, "disk1", ro=True, serial="new")], [target(1, "t1")], [(1, 1, 0)])
+
+    luns = f"{TARGETS}/iqn.2005-10.org.freenas.ctl:t1/ini_groups/security_group/luns/mgmt"
+    writes = scst_diff(old, new)
+    assert writes[:3] == [
+        (luns, "del 0", None),
+        (f"{HANDLERS}/vdisk_blockio/mgmt", "del_device disk1", None),
+        (f"{HANDLERS}/vdisk_blockio/mgmt", "add_device disk1 filename=/dev/zvol/tank/disk1; blocksize=512; read_only=1",
+         None),
+    ]
+    # Re-created device has all of its attributes set
+    assert len(writes[3:-1]) == 5
+    assert writes[-1] == (luns, "add disk1 0", None)
+
+
+def test__scst_diff__update_device_attribute():
+    old = model([extent(1, "disk1")], [target(1, "t1")], [(1, 1, 0)])
+    new = model([extent(1, "disk1", vendor="Other")], [target(1, "t1")], [(1, 1, 0)])
+
+    assert scst_diff(old, new) == [("/sys/kernel/scst_tgt/devices/disk1/t10_vend_id", "Other", None)]
+
+
+def test__scst_diff__add_and_remove_targets():
+    old = model([extent(1, "disk1")], [target(1, "t1")], [(1, 1, 0)])
+    new = model([extent(1, "disk1")], [target(2, "t2", 1)], [(2, 1, 5)])
+
+    t2 = f"{TARGETS}/iqn.2005-10.org.freenas.ctl:t2"
+    assert scst_diff(old, new) == [
+        (f"{TARGETS}/mgmt", "del_target iqn.2005-10.org.freenas.ctl:t1", f"{TARGETS}/iqn.2005-10.org.freenas.ctl:t1"),
+        (f"{TARGETS}/mgmt", "add_target iqn.2005-10.org.freenas.ctl:t2", None),
+        (f"{t2}/ini_groups/mgmt", "create security_group", None),
+        (f"{t2}/ini_groups/security_group/initiators/mgmt", "add iqn.1991-05.com.microsoft:a#*", None),
+        (f"{t2}/ini_groups/security_group/initiators/mgmt", "add iqn.1991-05.com.microsoft:b#*", None),
+        (f"{t2}/ini_groups/security_group/luns/mgmt", "add disk1 5", None),
+        (f"{t2}/per_portal_acl", "1", None),
+        (f"{t2}/enabled", "1", None),
+    ]
+
+
+def test__scst_diff__remove_in_order():
+    names = ["t3", "t1", "t4", "t2"]
+    old = model(
+        [extent(i, f"disk{i}") for i in range(1, 5)],
+        [target(i, name) for i, name in enumerate(names, 1)],
+        [(i, i, 0) for i in range(1, 5)],
+    )
+    new = model([], [], [])
+
+    writes = scst_diff(old, new)
+    assert [value for path, value, only_if_exists in writes] == [
+        f"del_target iqn.2005-10.org.freenas.ctl:{name}" for name in sorted(names)
+    ] + [
+        f"del_device disk{i}" for i in range(1, 5)
+    ]
+
+
+def test__scst_diff__initiators_and_users():
+    old = model([extent(1, "disk1")], [target(1, "t1")], [(1, 1, 0)])
+    new = copy.deepcopy(old)
+    new["targets"]["iqn.2005-10.org.freenas.ctl:t1"]["initiators"] = ["iqn.1991-05.com.microsoft:a#*"]
+    new["targets"]["iqn.2005-10.org.freenas.ctl:t1"]["incoming_users"] = ["user secretsecret"]
+
+    t1 = f"{TARGETS}/iqn.2005-10.org.freenas.ctl:t1"
+    assert scst_diff(old, new) == [
+        (f"{TARGETS}/mgmt", "add_target_attribute iqn.2005-10.org.freenas.ctl:t1 IncomingUser user secretsecret", None),
+        (f"{t1}/ini_groups/security_group/initiators/mgmt", "del *#*", None),
+        (f"{t1}/ini_groups/security_group/initiators/mgmt", "add iqn.1991-05.com.microsoft:a#*", None),
+    ]
@@ -0,0 +1,114 @@
+import threading
+import time
+from unittest.mock import Mock
+
+from middlewared.plugins.reporting.rrd_utils import RRDBase, RRDExportCache
+
+
+class RRD:
+    name = 'cpu'
+
+    def __init__(self, step=10, delay=0):
+        self.step = step
+        self.delay = delay
+        self.calls = 0
+
+    def export(self, identifier, starttime, endtime, aggregate=True):
+        self.calls += 1
+        self.args = (starttime, endtime)
+        time.sleep(self.delay)
+        return {'name': self.name, 'identifier': identifier, 'step': self.step, 'data': [[self.calls]]}
+
+
+def test__rrd_export_cache__hit():
+    rrd = RRD()
+    cache = RRDExportCache()
+
+    assert cache.export(rrd, None, 'end-1h', 'now') == cache.export(rrd, None, 'end-1h', 'now')
+    assert rrd.calls == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test__rrd_export_cache__key():
+    rrd = RRD()
+    cache = RRDExportCache()
+
+    cache.export(rrd, 'ada0', 'end-1h', 'now')
+    cache.export(rrd, 'ada1', 'end-1h', 'now')
+    cache.export(rrd, 'ada0', 'end-1d', 'now')
+    cache.export(rrd, 'ada0', 'end-1h', 'now', aggregate=False)
+
+    assert rrd.calls == 4
+
+
+def test__rrd_export_cache__aligns_absolute_times_to_step():
+    rrd = RRD(step=60)
+    cache = RRDExportCache()
+
+    cache.export(rrd, None, '1600000005', '1600003605')
+    assert rrd.args == ('1600000000', '1600003610')
+
+    # Step of this span is known now
+    cache.export(rrd, None, '1600000013', '1600003613')
+    assert rrd.args == ('1599999960', '1600003620')
+    cache.export(rrd, None, '1600000017', '1600003617')
+    cache.export(rrd, None, '1600000019', '1600003619')
+
+    assert rrd.calls == 2
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test__rrd_export_cache__expires_after_step():
+    rrd = RRD(step=0)
+    cache = RRDExportCache()
+
+    cache.export(rrd, None, 'end-1h', 'now')
+    time.sleep(0.01)
+    cache.export(rrd, None, 'end-1h', 'now')
+
+    assert rrd.calls == 2
+
+
+def test__rrd_export_cache__concurrent_requests_share_export():
+    rrd = RRD(delay=0.2)
+    cache = RRDExportCache()
+    results = []
+
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.export(rrd, None, 'end-1h', 'now')))
+        for i in range(5)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert rrd.calls == 1
+    assert len(results) == 5
+
+
+def test__rrd_export_cache__size():
+    rrd = RRD()
+    cache = RRDExportCache(size=2)
+
+    for ident in ('ada0', 'ada1', 'ada2'):
+        cache.export(rrd, ident, 'end-1h', 'now')
+
+    assert len(cache.entries) == 2
+
+
+def test__rrd_base__mean_aggregation():
+    class TestPlugin(RRDBase):
+        pass
+
+    rrd = TestPlugin(Mock())
+    rrd.xport = Mock(return_value={
+        'meta': {'start': 0, 'end': 20, 'step': 10, 'legend': ['a', 'b']},
+        'data': [[1.0, None], [2.0, 4.0], [None, 8.0]],
+    })
+
+    assert rrd.export(None, 'end-1h', 'now')['aggregations'] == {
+        'min': [1.0, 4.0],
+        'mean': [1.5, 6.0],
+        'max': [2.0, 8.0],
+    }
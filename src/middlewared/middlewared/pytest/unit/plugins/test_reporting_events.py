@@ -0,0 +1,59 @@
+import threading
+from unittest.mock import Mock
+
+from middlewared.plugins.reporting.events import RealtimeSampler
+
+
+class Sampler(RealtimeSampler):
+    def __init__(self):
+        super().__init__(Mock())
+        self.samples = 0
+        self.sampled = threading.Event()
+
+    def sample(self):
+        self.samples += 1
+        self.sampled.set()
+        return {'sample': self.samples}
+
+
+def test__realtime_sampler__subscribers_share_samples():
+    sampler = Sampler()
+    sampler.subscribe('a', 30)
+    sampler.subscribe('b', 30)
+    try:
+        assert sampler.wait(0) == (1, {'sample': 1})
+        assert sampler.wait(0) == (1, {'sample': 1})
+        assert sampler.samples == 1
+    finally:
+        sampler.unsubscribe('a')
+        sampler.unsubscribe('b')
+
+
+def test__realtime_sampler__stops_without_subscribers():
+    sampler = Sampler()
+    sampler.subscribe('a', 30)
+    sampler.wait(0)
+    thread = sampler.thread
+
+    sampler.unsubscribe('a')
+    thread.join(5)
+
+    assert not thread.is_alive()
+    assert sampler.thread is None
+
+
+def test__realtime_sampler__shorter_interval_wakes_sampler():
+    sampler = Sampler()
+    sampler.subscribe('a', 300)
+    try:
+        sample_id, data = sampler.wait(0)
+        sampler.sampled.clear()
+
+        sampler.subscribe('b', 2)
+
+        # Without waking up the sampler the next sample would only be taken in 300 seconds
+        assert sampler.sampled.wait(30)
+        assert sampler.wait(sample_id)[1] == {'sample': 2}
+    finally:
+        sampler.unsubscribe('a')
+        sampler.unsubscribe('b')
@@ -0,0 +1,321 @@
+import copy
+from unittest.mock import Mock, patch
+
+import pytest
+
+from middlewared.plugins.zfs import get_snapshots_scope, ZFSDatasetService, ZFSSnapshot
+from middlewared.plugins.zfs_.lock_state import LockStateIndex, ZFSDatasetLockStateService, zfs_events
+from middlewared.pytest.unit.helpers import resolve_query_schemas
+from middlewared.pytest.unit.middleware import Middleware
+
+resolve_query_schemas(ZFSDatasetService.query, ZFSSnapshot.query)
+
+
+def legacy_flatten_datasets(datasets):
+    return sum([[copy.deepcopy(ds)] + legacy_flatten_datasets(ds['children']) for ds in datasets], [])
+
+
+def make_tree(pool, count, fanout=10):
+    root = {'id': pool, 'name': pool, 'properties': {'used': {'parsed': 0}}, 'children': []}
+    level = [root]
+    created = 1
+    while created < count:
+        next_level = []
+        for parent in level:
+            for i in range(fanout):
+                if created >= count:
+                    break
+                name = f'{parent["id"]}/ds{i}'
+                child = {'id': name, 'name': name, 'properties': {'used': {'parsed': created}}, 'children': []}
+                parent['children'].append(child)
+                next_level.append(child)
+                created += 1
+        level = next_level
+    return [root]
+
+
+@pytest.mark.parametrize("children", [True, False])
+def test__flatten_datasets__order(children):
+    tree = make_tree('tank', 200, fanout=3) + make_tree('backup', 50, fanout=4)
+
+    flat = ZFSDatasetService(None).flatten_datasets(tree, children)
+
+    assert [ds['id'] for ds in flat] == [ds['id'] for ds in legacy_flatten_datasets(tree)]
+
+
+def test__flatten_datasets__children():
+    tree = make_tree('tank', 200, fanout=3)
+
+    assert ZFSDatasetService(None).flatten_datasets(tree) == legacy_flatten_datasets(tree)
+
+
+def test__flatten_datasets__children_ids():
+    tree = make_tree('tank', 13, fanout=3)
+
+    flat = {ds['id']: ds for ds in ZFSDatasetService(None).flatten_datasets(tree, False)}
+
+    assert flat['tank']['children'] == ['tank/ds0', 'tank/ds1', 'tank/ds2']
+    assert flat['tank/ds0']['children'] == ['tank/ds0/ds0', 'tank/ds0/ds1', 'tank/ds0/ds2']
+    assert flat['tank/ds2/ds0']['children'] == []
+    # Source tree must not be altered
+    assert tree[0]['children'][0]['id'] == 'tank/ds0'
+
+
+@pytest.mark.parametrize("children", [True, False])
+def test__flatten_datasets__large(children):
+    tree = make_tree('tank', 5000)
+
+    flat = ZFSDatasetService(None).flatten_datasets(tree, children)
+
+    legacy = legacy_flatten_datasets(tree)
+    if not children:
+        legacy = [dict(ds, children=[child['id'] for child in ds['children']]) for ds in legacy]
+
+    assert len(flat) == 5000
+    assert flat == legacy
+
+
+def test__query_for_quota_alert():
+    def dataset(name, quota, refquota):
+        return {'id': name, 'properties': {
+            'name': {'rawvalue': name},
+            'quota': {'rawvalue': quota},
+            'refquota': {'rawvalue': refquota},
+            'available': {'rawvalue': '0'},
+            'org.freenas:quota_warning': {'rawvalue': '50'},
+            'org.freenas:description': {'rawvalue': 'Not needed'},
+        }}
+
+    service = ZFSDatasetService(None)
+    with patch.object(service, 'query', return_value=[
+        dataset('tank', '0', '0'),
+        dataset('tank/quota', '1024', '0'),
+        dataset('tank/refquota', '0', '1024'),
+        dataset('tank/invalid', '-', '0'),
+    ]) as query:
+        datasets = service.query_for_quota_alert()
+
+    assert 'usedbydataset' in query.call_args[0][1]['extra']['properties']
+    assert [ds['name']['rawvalue'] for ds in datasets] == ['tank/quota', 'tank/refquota']
+    assert set(datasets[0]) == {'name', 'quota', 'refquota', 'available', 'org.freenas:quota_warning'}
+
+
+class FakeSnapshot:
+    def __init__(self, zfs, name):
+        self.zfs = zfs
+        self.name = name
+
+    def __getstate__(self):
+        assert self.zfs.open, "snapshot accessed after libzfs handle was closed"
+        dataset, snapshot_name = self.name.split("@")
+        return {"id": self.name, "name": self.name, "dataset": dataset, "snapshot_name": snapshot_name,
+                "properties": {}}
+
+
+class FakeDataset:
+    def __init__(self, zfs, name):
+        self.zfs = zfs
+        self.name = name
+
+    @property
+    def snapshots(self):
+        self.zfs.iterated = (self.name, False)
+        return self.zfs.snapshots_of(lambda dataset: dataset == self.name)
+
+    @property
+    def snapshots_recursive(self):
+        self.zfs.iterated = (self.name, True)
+        return self.zfs.snapshots_of(lambda dataset: dataset == self.name or dataset.startswith(f"{self.name}/"))
+
+
+class FakeZFS:
+    def __init__(self, names, datasets=None):
+        self.names = names
+        self.datasets = datasets or []
+        self.open = False
+        self.iterated = None
+
+    def __enter__(self):
+        self.open = True
+        return self
+
+    def __exit__(self, *args):
+        self.open = False
+
+    @property
+    def snapshots(self):
+        self.iterated = (None, True)
+        return self.snapshots_of(lambda dataset: True)
+
+    def snapshots_of(self, match):
+        for name in self.names:
+            assert self.open, "snapshots iterated after libzfs handle was closed"
+            if match(name.split("@")[0]):
+                yield FakeSnapshot(self, name)
+
+    def get_dataset(self, name):
+        return FakeDataset(self, name)
+
+    def datasets_serialized(self, **kwargs):
+        return copy.deepcopy(self.datasets)
+
+
+@pytest.mark.parametrize("args,result", [
+    ((), ["tank@a", "tank/ds@b"]),
+    (([], {}), ["tank@a", "tank/ds@b"]),
+    (([["snapshot_name", "=", "b"]], {}), ["tank/ds@b"]),
+])
+def test__snapshot_query__consumed_within_handle(args, result):
+    with patch("middlewared.plugins.zfs.libzfs.ZFS", lambda: FakeZFS(["tank@a", "tank/ds@b"])):
+        snapshots = ZFSSnapshot(None).query(*args)
+
+    assert isinstance(snapshots, list)
+    assert [s["name"] for s in snapshots] == result
+
+
+@pytest.mark.parametrize("filters,scope", [
+    ([], None),
+    ([["dataset", "=", "tank/ds"]], ("tank/ds", False)),
+    ([["pool", "=", "tank"]], ("tank", True)),
+    ([["name", "^", "tank/ds@auto"]], ("tank/ds", False)),
+    ([["id", "^", "tank/ds/"]], ("tank/ds", True)),
+    ([["OR", [["dataset", "=", "tank/ds"], ["dataset", "=", "tank"]]]], None),
+])
+def test__get_snapshots_scope(filters, scope):
+    assert get_snapshots_scope(filters) == scope
+
+
+SNAPSHOTS = ["tank@a", "tank/ds@b", "tank/ds/child@c", "other@d"]
+
+
+@pytest.mark.parametrize("filters,iterated,result", [
+    ([["dataset", "=", "tank/ds"]], ("tank/ds", False), ["tank/ds@b"]),
+    ([["pool", "=", "tank"]], ("tank", True), ["tank@a", "tank/ds@b", "tank/ds/child@c"]),
+    ([["id", "^", "tank/ds/"]], ("tank/ds", True), ["tank/ds/child@c"]),
+    (
+        [["OR", [["snapshot_name", "=", "a"], ["dataset", "=", "other"], ["pool", "=", "none"]]]],
+        (None, True),
+        ["tank@a", "other@d"],
+    ),
+])
+def test__snapshot_query__scope(filters, iterated, result):
+    zfs = FakeZFS(SNAPSHOTS)
+    with patch("middlewared.plugins.zfs.libzfs.ZFS", lambda: zfs):
+        snapshots = ZFSSnapshot(None).query(filters, {"select": ["name", "dataset"], "order_by": ["name"]})
+
+    assert zfs.iterated == iterated
+    assert [s["name"] for s in snapshots] == sorted(result)
+
+
+@pytest.mark.parametrize("about_to_lock,locked_ids", [
+    (None, ["tank/enc", "tank/enc/child"]),
+    ("tank/open", ["tank/enc", "tank/enc/child", "tank/open", "tank/open/child"]),
+])
+def test__dataset_query__locked_datasets(about_to_lock, locked_ids):
+    def dataset(name, encrypted, key_loaded, children=()):
+        return {"id": name, "name": name, "mountpoint": f"/mnt/{name}", "encrypted": encrypted,
+                "key_loaded": key_loaded, "properties": {}, "children": list(children)}
+
+    zfs = FakeZFS([], [dataset("tank", False, False, [
+        dataset("tank/enc", True, False, [dataset("tank/enc/child", True, False)]),
+        dataset("tank/open", True, True, [dataset("tank/open/child", True, True)]),
+    ])])
+    m = Middleware()
+    m["cache.get"] = Mock(side_effect=KeyError) if about_to_lock is None else Mock(return_value=about_to_lock)
+    with patch("middlewared.plugins.zfs.libzfs.ZFS", lambda: zfs):
+        locked = ZFSDatasetService(m).locked_datasets()
+
+    assert locked == [{"id": id, "mountpoint": f"/mnt/{id}"} for id in locked_ids]
+
+
+def lock_state_index():
+    return LockStateIndex([
+        {"id": "tank/enc", "mountpoint": "/mnt/tank/enc", "encryption_root": "tank/enc", "key_loaded": False},
+        {"id": "tank/enc/child", "mountpoint": "/mnt/tank/enc/child", "encryption_root": "tank/enc",
+         "key_loaded": False},
+        {"id": "tank/other", "mountpoint": "/mnt/tank/other", "encryption_root": "tank/other", "key_loaded": True},
+        {"id": "tank/other/own", "mountpoint": "/mnt/tank/other/own", "encryption_root": "tank/other/own",
+         "key_loaded": True},
+        {"id": "tank/zvol", "mountpoint": None, "encryption_root": "tank/zvol", "key_loaded": False},
+    ])
+
+
+@pytest.mark.parametrize("path,locked", [
+    ("/mnt/tank/enc", True),
+    ("/mnt/tank/enc/", True),
+    ("/mnt/tank/enc/child/dir", True),
+    ("/mnt/tank/encrypted", False),
+    ("/mnt/tank/other/dir", False),
+    ("/mnt/tank", False),
+    ("/", False),
+])
+def test__lock_state_index__path_locked(path, locked):
+    assert lock_state_index().path_locked(path) is locked
+
+
+def test__lock_state_index__set_key_loaded():
+    index = lock_state_index()
+
+    index.set_key_loaded("tank/enc", True, False)
+    assert not index.path_locked("/mnt/tank/enc/child")
+
+    index.set_key_loaded("tank/other", False, False)
+    assert index.path_locked("/mnt/tank/other")
+    assert [ds["id"] for ds in index.locked_datasets()] == ["tank/other", "tank/zvol"]
+
+    index.set_key_loaded("tank/other", False, True)
+    assert [ds["id"] for ds in index.locked_datasets()] == ["tank/other", "tank/other/own", "tank/zvol"]
+
+
+def test__lock_state_index__about_to_lock():
+    index = lock_state_index()
+
+    assert index.path_locked("/mnt/tank/other/own/dir", "tank/other")
+    assert [ds["id"] for ds in index.locked_datasets("tank/other")] == [
+        "tank/enc", "tank/enc/child", "tank/other", "tank/other/own", "tank/zvol",
+    ]
+
+
+@pytest.mark.asyncio
+async def test__lock_state__set_key_loaded_while_building_index():
+    datasets = [{"id": "tank/enc", "mountpoint": "/mnt/tank/enc", "encryption_root": "tank/enc", "key_loaded": False}]
+
+    async def query(*args):
+        result = copy.deepcopy(datasets)
+        if len(queries) == 0:
+            # Key is loaded after its status was queried for the index being built
+            datasets[0]["key_loaded"] = True
+            await service.set_key_loaded("tank/enc", True, False)
+        queries.append(result)
+        return result
+
+    queries = []
+    m = Middleware()
+    m["zfs.dataset.query"] = query
+    m["cache.get"] = Mock(side_effect=KeyError)
+    service = ZFSDatasetLockStateService(m)
+
+    # Index built from the stale key status must not be kept
+    await service.path_locked("/mnt/tank/enc")
+    assert service.index is None
+
+    assert not await service.path_locked("/mnt/tank/enc")
+    assert [ds["id"] for ds in await service.locked_datasets()] == []
+    assert len(queries) == 2
+
+
+@pytest.mark.parametrize("data,invalidated", [
+    ({"class": "sysevent.fs.zfs.pool_import"}, True),
+    ({"class": "sysevent.fs.zfs.pool_export"}, True),
+    ({"class": "sysevent.fs.zfs.history_event", "history_dsname": "tank/enc"}, True),
+    ({"class": "sysevent.fs.zfs.history_event", "history_dsname": "tank/enc@snap"}, False),
+    ({"class": "sysevent.fs.zfs.vdev_online"}, False),
+])
+@pytest.mark.asyncio
+async def test__lock_state__zfs_events(data, invalidated):
+    m = Middleware()
+    m["zfs.dataset.lock_state.invalidate"] = Mock()
+
+    await zfs_events(m, data)
+
+    assert m["zfs.dataset.lock_state.invalidate"].called is invalidated
@@ -34,7 +34,10 @@ async def test__normal_service(caplog, method):
     middleware.add_service(MockService(middleware))
 
     fut = asyncio.Future()
-    application = Application(middleware, asyncio.get_event_loop(), Mock(), Mock(send_str=AsyncMock(side_effect=fut.set_result)))
+    application = Application(
+        middleware, asyncio.get_event_loop(), Mock(),
+        Mock(closed=False, send_str=AsyncMock(side_effect=fut.set_result)),
+    )
     application.authenticated = True
     application.handshake = True
     await application.on_message({"id": "1", "msg": "method", "method": f"mock.{method}", "params": [{"password": "secret"}]})
@@ -72,7 +75,10 @@ async def test__job_service(caplog, method):
     middleware._resolve_methods()
 
     fut = asyncio.Future()
-    application = Application(middleware, asyncio.get_event_loop(), Mock(), Mock(send_str=AsyncMock(side_effect=fut.set_result)))
+    application = Application(
+        middleware, asyncio.get_event_loop(), Mock(),
+        Mock(closed=False, send_str=AsyncMock(side_effect=fut.set_result)),
+    )
     application.authenticated = True
     application.handshake = True
     await application.on_message({"id": "1", "msg": "method", "method": f"job.{method}", "params": [{"password": "secret"}]})
@@ -84,3 +90,49 @@ async def test__job_service(caplog, method):
     result = json.loads(await fut)
 
     assert result["result"][0]["arguments"] == [{"password": "********"}]
+
+
+@pytest.mark.asyncio
+async def test__send_event__subscriptions():
+    with patch("middlewared.main.multiprocessing"):
+        middleware = Middleware()
+    middleware.loop = asyncio.get_event_loop()
+    middleware.event_register("foo.query", "Foo")
+    middleware.event_register("bar.query", "Bar")
+
+    def application():
+        app = Application(middleware, asyncio.get_event_loop(), Mock(), Mock(closed=False, send_str=AsyncMock()))
+        app.on_open()
+        return app
+
+    foo, wildcard, bar, closed = application(), application(), application(), application()
+    await foo.subscribe("1", "foo.query")
+    await foo.subscribe("2", "foo.query")
+    await wildcard.subscribe("1", "*")
+    await bar.subscribe("1", "bar.query")
+    await closed.subscribe("1", "foo.query")
+    closed.response.closed = True
+    for app in (foo, wildcard, bar, closed):
+        app.response.send_str.reset_mock()
+
+    middleware.send_event("foo.query", "CHANGED", id=1, fields={"name": "foo"})
+    await asyncio.sleep(0.1)
+
+    message = foo.response.send_str.call_args[0][0]
+    assert json.loads(message) == {"msg": "changed", "collection": "foo.query", "id": 1, "fields": {"name": "foo"}}
+    wildcard.response.send_str.assert_called_once_with(message)
+    bar.response.send_str.assert_not_called()
+    closed.response.send_str.assert_not_called()
+    assert middleware.event_subscriptions.stats()["foo.query"] == {"sent": 2, "dropped": 1}
+
+    # Still subscribed with the other id
+    await foo.unsubscribe("1")
+    await closed.on_close()
+    middleware.send_event("foo.query", "CHANGED", id=1)
+    await asyncio.sleep(0.1)
+
+    assert foo.response.send_str.call_count == 2
+    assert middleware.event_subscriptions.stats()["foo.query"] == {"sent": 4, "dropped": 1}
+
+    await foo.unsubscribe("2")
+    assert middleware.event_subscriptions.get("foo.query") == {wildcard}
@@ -1,11 +1,14 @@
+import copy
+
 import pytest
 from mock import Mock
 
 from middlewared.service import job
 from middlewared.service_exception import ValidationErrors
 from middlewared.schema import (
-    accepts, Bool, Cron, Dict, Dir, Error, File, Float, Int, IPAddr, List, Str, UnixPerm,
+    accepts, Bool, compile_validator, Cron, Dict, Dir, Error, File, Float, Int, IPAddr, List, Str, UnixPerm,
 )
+from middlewared.validators import Email
 
 
 def test__nonhidden_after_hidden():
@@ -631,3 +634,157 @@ def test__schema_str_job_default():
     jobm = Mock()
 
     assert strdef(self, jobm, 'foo') == 'BAR'
+
+
+def user_create_schema():
+    return Dict(
+        'user_create',
+        Int('uid'),
+        Str('username', required=True, max_length=16),
+        Int('group'),
+        Bool('group_create', default=False),
+        Str('home', default='/nonexistent'),
+        Str('home_mode', default='755'),
+        Str('shell', default='/usr/bin/zsh'),
+        Str('full_name', required=True),
+        Str('email', validators=[Email()], null=True, default=None),
+        Str('password', private=True),
+        Bool('password_disabled', default=False),
+        Bool('locked', default=False),
+        Bool('microsoft_account', default=False),
+        Bool('smb', default=True),
+        Bool('sudo', default=False),
+        Str('sshpubkey', null=True, max_length=None),
+        List('groups', default=[]),
+        Dict('attributes', additional_attrs=True),
+    )
+
+
+def query_options_schema():
+    return Dict(
+        'query-options',
+        Bool('relationships', default=True),
+        Str('extend', default=None, null=True),
+        Str('extend_context', default=None, null=True),
+        Str('prefix', default=None, null=True),
+        Dict('extra', additional_attrs=True),
+        List('order_by', default=[]),
+        List('select', default=[]),
+        Bool('count', default=False),
+        Bool('get', default=False),
+        Int('offset', default=0),
+        Int('limit', default=0),
+    )
+
+
+USER_CREATE = {
+    'username': 'john', 'full_name': 'John Doe', 'group_create': True, 'password': 'secret',
+    'email': 'john@example.com', 'groups': [1, 2, 3], 'attributes': {'preferences': {'theme': 'dark'}},
+}
+QUERY_OPTIONS = {'order_by': ['-id'], 'extra': {'passwords': True}, 'limit': 10}
+
+
+def legacy_accepts(*schema):
+    def wrap(f):
+        def nf(self, *args):
+            args = copy.deepcopy(list(args))
+            verrors = ValidationErrors()
+            for i, attr in enumerate(schema):
+                args[i] = attr.clean(args[i])
+                try:
+                    attr.validate(args[i])
+                except ValidationErrors as e:
+                    verrors.extend(e)
+            if verrors:
+                raise verrors
+            return f(self, *args)
+        return nf
+    return wrap
+
+
+def validation_errors(validate, value):
+    try:
+        validate(value)
+    except ValidationErrors as e:
+        return list(e)
+    return []
+
+
+@pytest.mark.parametrize("schema,value", [
+    (user_create_schema(), {'username': 'john', 'full_name': 'John'}),
+    (user_create_schema(), {'username': 'x' * 17, 'full_name': 'John', 'email': 'invalid'}),
+    (query_options_schema(), {'prefix': 'x' * 2000, 'extra': {'a': 1}}),
+    (List('list', items=[Int('int'), Str('str', max_length=2)]), [1, 'ab', 'abc']),
+    (List('list', items=[Str('str', max_length=2), Dict('dict', Str('a', max_length=2))]), ['ab', {'a': 'abc'}]),
+    (List('list', items=[Str('str', max_length=2)], unique=True), ['ab', 'ab', 'abc']),
+    (Dict('dict', Dict('nested', Str('a', max_length=1)), Int('b')), {'nested': {'a': 'ab'}, 'b': 1}),
+    (Cron('schedule'), {'minute': 'invalid'}),
+])
+def test__compile_validator__same_errors(schema, value):
+    value = schema.clean(value)
+    validate = compile_validator(schema) or (lambda value: None)
+
+    assert validation_errors(validate, value) == validation_errors(schema.validate, value)
+
+
+@pytest.mark.parametrize("schema", [
+    Int('int'),
+    Bool('bool'),
+    Dict('dict', Int('a'), Bool('b'), List('c'), Dict('d', additional_attrs=True)),
+    List('list', items=[Int('int'), Str('str', max_length=2)]),
+])
+def test__compile_validator__skips_what_can_not_fail(schema):
+    assert compile_validator(schema) is None
+
+
+@pytest.mark.parametrize("readonly", [True, False])
+def test__accepts__does_not_modify_arguments(readonly):
+    @accepts(user_create_schema())
+    def create(self, data):
+        return data
+
+    data = copy.deepcopy(USER_CREATE)
+
+    result = (create.readonly_call if readonly else create)(Mock(), data)
+
+    assert data == USER_CREATE
+    assert result['home'] == '/nonexistent'
+    assert result is not data
+
+
+def test__accepts__copies_arguments():
+    @accepts(user_create_schema())
+    def create(self, data):
+        data['attributes']['preferences']['theme'] = 'light'
+        data['groups'].append(4)
+        return data
+
+    data = copy.deepcopy(USER_CREATE)
+
+    create(Mock(), data)
+
+    assert data == USER_CREATE
+
+
+@pytest.mark.parametrize("schema,value", [
+    (user_create_schema, USER_CREATE),
+    (query_options_schema, QUERY_OPTIONS),
+    (user_create_schema, dict(USER_CREATE, username='a' * 17, email='invalid')),
+    (query_options_schema, dict(QUERY_OPTIONS, offset='ten')),
+])
+def test__accepts__legacy_parity(schema, value):
+    def f(self, data):
+        return data
+
+    legacy = legacy_accepts(schema())(f)
+    compiled = accepts(schema())(f)
+
+    def call(method):
+        try:
+            return method(None, copy.deepcopy(value))
+        except Error as e:
+            return [(e.attribute, e.errmsg)]
+        except ValidationErrors as e:
+            return sorted((error.attribute, error.errmsg) for error in e.errors)
+
+    assert call(compiled) == call(compiled.readonly_call) == call(legacy)
@@ -1,10 +1,15 @@
 import asyncio
 import threading
 import time
+from unittest.mock import ANY, Mock, patch
 
 import pytest
 
-from middlewared.service import throttle
+from middlewared.pytest.unit.helpers import resolve_query_schemas
+from middlewared.pytest.unit.middleware import Middleware
+from middlewared.service import CRUDService, throttle
+
+resolve_query_schemas(CRUDService.query)
 
 
 @pytest.mark.timeout(10)
@@ -69,3 +74,40 @@ async def test__async_throttle():
     assert values[0] - start < 1
     assert 1.99 <= values[1] - values[0] < 3
     assert 1.99 <= values[2] - values[1] < 3
+
+
+@pytest.mark.parametrize("filters,datastore_filters,extended_filters", [
+    ([], [], []),
+    ([["name", "=", "a"]], [["name", "=", "a"]], []),
+    ([["name", "^", "a"]], [], [["name", "^", "a"]]),
+    ([["name", "<", "b"]], [], [["name", "<", "b"]]),
+    ([["name", "nin", ["a"]]], [], [["name", "nin", ["a"]]]),
+    ([["hosts", "=", []]], [], [["hosts", "=", []]]),
+    (
+        [["name", "in", ["a", "b"]], ["OR", [["enabled", "=", True], ["name", "=", "c"]]]],
+        [["name", "in", ["a", "b"]], ["OR", [["enabled", "=", True], ["name", "=", "c"]]]],
+        [],
+    ),
+    (
+        [["OR", [["enabled", "=", True], ["hosts", "=", []]]], ["name", "!=", "a"]],
+        [],
+        [["OR", [["enabled", "=", True], ["hosts", "=", []]]], ["name", "!=", "a"]],
+    ),
+])
+@pytest.mark.asyncio
+async def test__crud_service__query__datastore_filters(filters, datastore_filters, extended_filters):
+    class ShareService(CRUDService):
+        class Config:
+            datastore = "sharing.share"
+            datastore_extend = "share.extend"
+            datastore_extend_untouched = ("name", "enabled")
+
+    rows = [{"id": 1, "name": "a", "enabled": True, "hosts": []}, {"id": 2, "name": "b", "enabled": False, "hosts": []}]
+    m = Middleware()
+    m["datastore.query"] = Mock(return_value=rows)
+
+    with patch("middlewared.service.filter_list") as filter_list:
+        await ShareService(m).query(filters, {"limit": 1})
+
+    assert m["datastore.query"].call_args[0][1] == datastore_filters
+    assert filter_list.call_args[0] == (rows, extended_filters, ANY)
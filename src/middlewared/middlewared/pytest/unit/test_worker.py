@@ -0,0 +1,31 @@
+from unittest.mock import Mock, patch
+
+from middlewared.worker import WorkerClient
+
+
+def test__worker_client__reuses_connection():
+    on_connect = Mock()
+    with patch("middlewared.worker.Client", Mock(side_effect=lambda *args, **kwargs: Mock(closed=False))) as client:
+        worker_client = WorkerClient(on_connect)
+        worker_client.call("core.ping")
+        worker_client.call("core.event_send", "event", "ADDED", {})
+
+    client.assert_called_once()
+    on_connect.assert_called_once_with(worker_client.connect())
+    assert worker_client.connect().call.call_count == 2
+
+
+def test__worker_client__reconnects_closed_connection():
+    on_connect = Mock()
+    with patch("middlewared.worker.Client", Mock(side_effect=lambda *args, **kwargs: Mock(closed=False))) as client:
+        worker_client = WorkerClient(on_connect)
+        first = worker_client.connect()
+        first.closed = True
+
+        second = worker_client.connect()
+
+    assert second is not first
+    assert client.call_count == 2
+    assert worker_client.connects == 2
+    # Event subscriptions are set up again on the new connection
+    assert [call[0][0] for call in on_connect.call_args_list] == [first, second]
@@ -0,0 +1,65 @@
+from unittest.mock import patch
+
+from middlewared.utils.credential_cache import CredentialCache
+
+
+def test__credential_cache__hit():
+    cache = CredentialCache()
+    cache.put("api_key", 1, "secret", {"id": 1}, cache.get("api_key", 1, "secret")[2])
+
+    assert cache.get("api_key", 1, "secret")[:2] == (True, {"id": 1})
+    assert cache.get("api_key", 1, "wrong")[:2] == (False, None)
+    assert cache.stats["api_key"] == {"hits": 1, "misses": 2, "invalidations": 0}
+
+
+def test__credential_cache__expired():
+    cache = CredentialCache(ttl=60)
+    with patch("middlewared.utils.credential_cache.time.monotonic", return_value=100):
+        cache.put("password", "root", "secret", True, cache.get("password", "root", "secret")[2])
+
+    with patch("middlewared.utils.credential_cache.time.monotonic", return_value=161):
+        assert cache.get("password", "root", "secret")[:2] == (False, None)
+
+    assert not cache.entries
+
+
+def test__credential_cache__bounded():
+    cache = CredentialCache(size=2)
+    for i in range(3):
+        cache.put("api_key", i, "secret", i, cache.get("api_key", i, "secret")[2])
+
+    assert cache.get("api_key", 0, "secret")[:2] == (False, None)
+    assert cache.get("api_key", 2, "secret")[:2] == (True, 2)
+
+
+def test__credential_cache__invalidate():
+    cache = CredentialCache()
+    cache.put("api_key", 1, "secret", 1, cache.get("api_key", 1, "secret")[2])
+    cache.put("api_key", 2, "secret", 2, cache.get("api_key", 2, "secret")[2])
+    cache.put("password", "root", "secret", True, cache.get("password", "root", "secret")[2])
+
+    cache.invalidate("api_key", 1)
+
+    assert cache.get("api_key", 1, "secret")[:2] == (False, None)
+    assert cache.get("api_key", 2, "secret")[:2] == (True, 2)
+    assert cache.get("password", "root", "secret")[:2] == (True, True)
+
+
+def test__credential_cache__invalidated_while_verifying():
+    cache = CredentialCache()
+    hit, value, generation = cache.get("api_key", 1, "secret")
+    hit, value, other_generation = cache.get("api_key", 2, "secret")
+
+    # Key was changed after it was read from the database for verification
+    cache.invalidate("api_key", 1)
+    cache.put("api_key", 1, "secret", 1, generation)
+    cache.put("api_key", 2, "secret", 2, other_generation)
+
+    assert cache.get("api_key", 1, "secret")[:2] == (False, None)
+    assert cache.get("api_key", 2, "secret")[:2] == (True, 2)
+
+    hit, value, generation = cache.get("api_key", 2, "secret")
+    cache.invalidate("api_key")
+    cache.put("api_key", 2, "secret", 2, generation)
+
+    assert cache.get("api_key", 2, "secret")[:2] == (False, None)
@@ -1,4 +1,6 @@
-from middlewared.utils import filter_list
+import pytest
+
+from middlewared.utils import filter_getattrs, filter_list
 
 
 DATA = [
@@ -84,3 +86,22 @@ def test__filter_list_OR_eq2():
         ['number', '=', 1],
         ['number', '=', 2],
     ]]])) == 2
+
+
+@pytest.mark.parametrize('filters,attrs', [
+    (None, set()),
+    ([['foo', '=', 'foo1'], ['number', '>', 1]], {'foo', 'number'}),
+    ([['OR', [['foo', '=', 'foo1']]]], {'foo'}),
+    (
+        [['number', '=', 1], ['OR', [['foo', '=', 'foo1'], ['list', 'rin', 1], ['id', '=', 1]]]],
+        {'number', 'foo', 'list', 'id'},
+    ),
+    ([['OR', [[['foo', '=', 'foo1'], ['number', '=', 1]], ['list', 'rin', 1]]]], {'foo', 'number', 'list'}),
+])
+def test__filter_getattrs(filters, attrs):
+    assert filter_getattrs(filters) == attrs
+
+
+def test__filter_getattrs__invalid():
+    with pytest.raises(ValueError):
+        filter_getattrs([['foo', '=']])
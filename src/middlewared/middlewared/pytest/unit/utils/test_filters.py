@@ -0,0 +1,212 @@
+import random
+import re
+
+import pytest
+
+from middlewared.service_exception import MatchNotFound
+from middlewared.utils import get
+from middlewared.utils.filters import compile_filters, filter_list
+
+
+def legacy_filter_list(_list, filters=None, options=None):
+    """
+    `filter_list` as it was before filters were compiled, kept as a parity
+    reference.
+    """
+    opmap = {
+        '=': lambda x, y: x == y,
+        '!=': lambda x, y: x != y,
+        '>': lambda x, y: x > y,
+        '>=': lambda x, y: x >= y,
+        '<': lambda x, y: x < y,
+        '<=': lambda x, y: x <= y,
+        '~': lambda x, y: re.match(y, x),
+        'in': lambda x, y: x in y,
+        'nin': lambda x, y: x not in y,
+        'rin': lambda x, y: x is not None and y in x,
+        'rnin': lambda x, y: x is not None and y not in x,
+        '^': lambda x, y: x is not None and x.startswith(y),
+        '!^': lambda x, y: x is not None and not x.startswith(y),
+        '$': lambda x, y: x is not None and x.endswith(y),
+        '!$': lambda x, y: x is not None and not x.endswith(y),
+    }
+
+    filters = filters or {}
+    options = options or {}
+    select = options.get('select')
+
+    rv = []
+    if filters:
+        def filterop(f):
+            name, op, value = f
+            return bool(opmap[op](get(i, name), value))
+
+        for i in _list:
+            valid = True
+            for f in filters:
+                if len(f) == 2:
+                    if not any(filterop(f) for f in f[1]):
+                        valid = False
+                        break
+                elif not filterop(f):
+                    valid = False
+                    break
+            if not valid:
+                continue
+            entry = {s: i[s] for s in select if s in i} if select else i
+            rv.append(entry)
+            if options.get('get') is True:
+                return entry
+    elif select:
+        rv = [{s: i[s] for s in select if s in i} for i in _list]
+    else:
+        rv = _list
+
+    if options.get('count') is True:
+        return len(rv)
+
+    for o in options.get('order_by') or []:
+        if o.startswith('-'):
+            o = o[1:]
+            reverse = True
+        else:
+            reverse = False
+        rv = sorted(rv, key=lambda x: x[o], reverse=reverse)
+
+    if options.get('get') is True:
+        try:
+            return rv[0]
+        except IndexError:
+            raise MatchNotFound()
+
+    if options.get('offset'):
+        rv = rv[options['offset']:]
+
+    if options.get('limit'):
+        return rv[:options['limit']]
+
+    return rv
+
+
+def make_snapshots(count, seed=0):
+    rand = random.Random(seed)
+    return [
+        {
+            'id': f'tank/ds{i % 50}@auto-{i:06d}',
+            'name': f'tank/ds{i % 50}@auto-{i:06d}',
+            'dataset': f'tank/ds{i % 50}',
+            'pool': 'tank',
+            'createtxg': rand.randint(0, count),
+            'holds': [] if i % 7 else ['hold'],
+            'properties': {'used': {'parsed': rand.randint(0, 1 << 30)}},
+        }
+        for i in range(count)
+    ]
+
+
+DATA = make_snapshots(2000)
+
+FILTERS = [
+    [],
+    [['pool', '=', 'tank']],
+    [['dataset', '=', 'tank/ds3']],
+    [['name', '~', r'tank/ds1\d@']],
+    [['name', '^', 'tank/ds4']],
+    [['name', '$', '9']],
+    [['createtxg', '>', 1000], ['createtxg', '<=', 1500]],
+    [['holds', 'rin', 'hold']],
+    [['dataset', 'in', ['tank/ds1', 'tank/ds2']]],
+    [['properties.used.parsed', '>', 1 << 29]],
+    [['OR', [['dataset', '=', 'tank/ds1'], ['createtxg', '<', 10]]]],
+    [['dataset', '=', 'nonexistent']],
+]
+
+OPTIONS = [
+    {},
+    {'count': True},
+    {'get': True},
+    {'limit': 10},
+    {'offset': 5, 'limit': 10},
+    {'offset': 1990},
+    {'order_by': ['createtxg']},
+    {'order_by': ['-createtxg'], 'limit': 25},
+    {'order_by': ['createtxg'], 'offset': 10, 'limit': 25},
+    {'order_by': ['dataset', 'createtxg']},
+    {'order_by': ['dataset', '-createtxg'], 'limit': 5},
+    {'order_by': ['-dataset', '-createtxg'], 'limit': 5},
+    {'order_by': ['createtxg'], 'get': True},
+    {'order_by': ['-createtxg'], 'get': True},
+    {'select': ['name', 'createtxg']},
+    {'select': ['name', 'createtxg'], 'order_by': ['createtxg'], 'limit': 3},
+]
+
+
+@pytest.mark.parametrize('filters', FILTERS)
+@pytest.mark.parametrize('options', OPTIONS)
+def test__filter_list__parity(filters, options):
+    try:
+        expected = legacy_filter_list(DATA, filters, options)
+    except MatchNotFound:
+        with pytest.raises(MatchNotFound):
+            filter_list(DATA, filters, options)
+    else:
+        assert filter_list(DATA, filters, options) == expected
+
+
+def test__filter_list__accepts_iterators():
+    assert filter_list(iter(DATA), [['dataset', '=', 'tank/ds3']], {'order_by': ['-createtxg'], 'limit': 3}) == \
+        legacy_filter_list(DATA, [['dataset', '=', 'tank/ds3']], {'order_by': ['-createtxg'], 'limit': 3})
+
+
+def test__filter_list__limit_stops_early():
+    consumed = []
+
+    def rows():
+        for i in DATA:
+            consumed.append(i)
+            yield i
+
+    assert len(filter_list(rows(), [['pool', '=', 'tank']], {'limit': 3})) == 3
+    assert len(consumed) == 3
+
+
+def test__filter_list__objects():
+    class Row:
+        def __init__(self, name):
+            self.name = name
+
+    rows = [Row('a'), Row('b')]
+    assert filter_list(rows, [['name', '=', 'b']]) == [rows[1]]
+
+
+def test__compile_filters__invalid():
+    with pytest.raises(ValueError):
+        compile_filters([['name', 'like', 'x']])
+
+    with pytest.raises(ValueError):
+        compile_filters([['AND', [['name', '=', 'x']]]])
+
+
+def test__compile_filters__empty():
+    assert compile_filters([]) is None
+
+
+def test__filter_list__no_filters_returns_list():
+    result = filter_list(iter(DATA))
+    assert isinstance(result, list)
+    assert result == DATA
+
+
+LARGE_DATA = make_snapshots(20000, seed=1)
+
+
+@pytest.mark.parametrize('filters,options', [
+    ([['name', '~', r'tank/ds1\d@auto-0\d+5$']], {}),
+    ([['properties.used.parsed', '>', 1 << 29], ['pool', '=', 'tank']], {}),
+    ([], {'order_by': ['dataset', 'createtxg'], 'limit': 50}),
+    ([], {'order_by': ['-createtxg'], 'get': True}),
+    ([['pool', '=', 'tank']], {'limit': 50}),
+])
+def test__filter_list__large(filters, options):
+    assert filter_list(LARGE_DATA, filters, options) == legacy_filter_list(LARGE_DATA, filters, options)
+    assert filter_list(iter(LARGE_DATA), filters, options) == legacy_filter_list(LARGE_DATA, filters, options)
@@ -458,6 +458,8 @@ class List(EnumMixin, Attribute):
         if not self.empty and not value:
             raise Error(self.name, 'Empty value not allowed')
         if self.items:
+            # Never modify the list we were given, `accepts` does not always copy its arguments
+            value = list(value)
             for index, v in enumerate(value):
                 for i in self.items:
                     try:
@@ -595,6 +597,9 @@ class Dict(Attribute):
         if not isinstance(data, dict):
             raise Error(self.name, 'A dict was expected')
 
+        # Never modify the dict we were given, `accepts` does not always copy its arguments
+        data = dict(data)
+
         for key, value in list(data.items()):
             if not self.additional_attrs:
                 if key not in self.attrs:
@@ -896,6 +901,117 @@ def resolve_methods(schemas, to_resolve):
             raise ValueError(f'Not all schemas could be resolved: {to_resolve}')
 
 
+IMMUTABLE_TYPES = (str, int, float, bool, type(None))
+
+
+def copy_value(value):
+    """
+    `copy.deepcopy` for method arguments. These are almost always JSON-like so we only fall back to `copy.deepcopy`
+    for what is not a dict, a list or a scalar.
+    """
+    if isinstance(value, IMMUTABLE_TYPES):
+        return value
+    if type(value) is dict:
+        return {k: copy_value(v) for k, v in value.items()}
+    if type(value) is list:
+        return [copy_value(v) for v in value]
+    return copy.deepcopy(value)
+
+
+def compile_validator(attr):
+    """
+    Returns a function that behaves exactly like `attr.validate` but skips every part of the schema
+    that can't fail (e.g. `Bool` or `Int` without validators) or `None` if `attr.validate` can't fail at all.
+    """
+    cls = type(attr)
+
+    if cls in (Any, Bool, Int, Float):
+        if attr.validators:
+            return attr.validate
+
+        return None
+
+    if cls is Str:
+        if attr.validators:
+            return attr.validate
+
+        name = attr.name
+        max_length = attr.max_length
+
+        def validate_str(value):
+            if value and len(str(value)) > max_length:
+                verrors = ValidationErrors()
+                verrors.add(name, f'Value greater than {max_length} not allowed')
+                raise verrors
+
+        return validate_str
+
+    if cls is Dict:
+        name = attr.name
+        validators = []
+        for child in attr.attrs.values():
+            validator = compile_validator(child)
+            if validator is not None:
+                validators.append((child.name, validator))
+
+        if not validators:
+            return None
+
+        def validate_dict(value):
+            if value is None:
+                return
+
+            verrors = ValidationErrors()
+
+            for key, validator in validators:
+                if key in value:
+                    try:
+                        validator(value[key])
+                    except ValidationErrors as e:
+                        verrors.add_child(name, e)
+
+            if verrors:
+                raise verrors
+
+        return validate_dict
+
+    if cls is List:
+        if attr.unique or attr.validators:
+            return attr.validate
+
+        item_validators = [compile_validator(item) for item in attr.items]
+        # Items are tried in order until one of them passes so if any of them can't fail, neither can the item
+        if not item_validators or None in item_validators:
+            return None
+
+        name = attr.name
+
+        def validate_list(value):
+            if value is None:
+                return
+
+            verrors = ValidationErrors()
+
+            for i, v in enumerate(value):
+                attr_verrors = ValidationErrors()
+                for validator in item_validators:
+                    try:
+                        validator(v)
+                    except ValidationErrors as e:
+                        attr_verrors.add_child(f"{name}.{i}", e)
+                    else:
+                        break
+                else:
+                    verrors.extend(attr_verrors)
+
+            if verrors:
+                raise verrors
+
+        return validate_list
+
+    return attr.validate
+
+
 def accepts(*schema):
     further_only_hidden = False
     for i in schema:
@@ -915,10 +1031,27 @@ def accepts(*schema):
             args_index += f._skip_arg
         assert len(schema) == f.__code__.co_argcount - args_index  # -1 for self
 
-        def clean_and_validate_args(args, kwargs):
+        # Schemas are compiled on the first call as `Ref` and `Patch` are only resolved after all plugins are loaded
+        compiled = {'accepts': None, 'validators': None}
+
+        def get_validators():
+            accepts = tuple(nf.accepts)
+            if compiled['accepts'] != accepts:
+                compiled['validators'] = [compile_validator(attr) for attr in accepts]
+                compiled['accepts'] = accepts
+
+            return compiled['validators']
+
+        def clean_and_validate_args(args, kwargs, copy_args):
             args = list(args)
-            args = args[:args_index] + copy.deepcopy(args[args_index:])
-            kwargs = copy.deepcopy(kwargs)
+            if copy_args:
+                args = args[:args_index] + copy_value(args[args_index:])
+                kwargs = copy_value(kwargs)
+            else:
+                # `clean` never modifies its argument so we only need a container of our own
+                kwargs = dict(kwargs)
+
+            validators = get_validators()
 
             verrors = ValidationErrors()
 
@@ -930,10 +1063,11 @@ def accepts(*schema):
                 value = attr.clean(args[args_index + i])
                 args[args_index + i] = value
 
-                try:
-                    attr.validate(value)
-                except ValidationErrors as e:
-                    verrors.extend(e)
+                if validators[i] is not None:
+                    try:
+                        validators[i](value)
+                    except ValidationErrors as e:
+                        verrors.extend(e)
 
                 i += 1
 
@@ -943,11 +1077,13 @@ def accepts(*schema):
 
                 if kwarg in kwargs:
                     attr = nf.accepts[i]
+                    validator = validators[i]
                     i += 1
 
                     value = kwargs[kwarg]
                 elif len(nf.accepts) >= i + 1:
                     attr = nf.accepts[i]
+                    validator = validators[i]
                     i += 1
                     value = NOT_PROVIDED
                 else:
@@ -957,10 +1093,11 @@ def accepts(*schema):
                 value = attr.clean(value)
                 kwargs[kwarg] = value
 
-                try:
-                    attr.validate(value)
-                except ValidationErrors as e:
-                    verrors.extend(e)
+                if validator is not None:
+                    try:
+                        validator(value)
+                    except ValidationErrors as e:
+                        verrors.extend(e)
 
             if verrors:
                 raise verrors
@@ -969,11 +1106,19 @@ def accepts(*schema):
 
         if asyncio.iscoroutinefunction(f):
             async def nf(*args, **kwargs):
-                args, kwargs = clean_and_validate_args(args, kwargs)
+                args, kwargs = clean_and_validate_args(args, kwargs, True)
+                return await f(*args, **kwargs)
+
+            async def readonly_call(*args, **kwargs):
+                args, kwargs = clean_and_validate_args(args, kwargs, False)
                 return await f(*args, **kwargs)
         else:
             def nf(*args, **kwargs):
-                args, kwargs = clean_and_validate_args(args, kwargs)
+                args, kwargs = clean_and_validate_args(args, kwargs, True)
+                return f(*args, **kwargs)
+
+            def readonly_call(*args, **kwargs):
+                args, kwargs = clean_and_validate_args(args, kwargs, False)
                 return f(*args, **kwargs)
 
         from middlewared.utils.type import copy_function_metadata
@@ -981,6 +1126,8 @@ def accepts(*schema):
         nf.accepts = list(schema)
         nf.wraps = f
         nf.wrap = wrap
+        # Same as `nf` but does not copy the arguments. Only for internal calls of `@readonly_args` methods.
+        nf.readonly_call = readonly_call
 
         return nf
 
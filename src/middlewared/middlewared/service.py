@@ -179,6 +179,15 @@ def pass_app(rest=False):
     return wrapper
 
 
+def readonly_args(fn):
+    """
+    The method never modifies its arguments (beyond what `@accepts` schema cleans) so internal callers may skip
+    copying them.
+    """
+    fn._readonly_args = True
+    return fn
+
+
 def periodic(interval, run_on_start=True):
     def wrapper(fn):
         fn._periodic = PeriodicTaskDescriptor(interval, run_on_start)
@@ -214,7 +223,12 @@ class ServiceBase(type):
     Currently the following options are allowed:
       - datastore: name of the datastore mainly used in the service
       - datastore_extend: datastore `extend` option used in common `query` method
+      - datastore_extend_batch: same as `datastore_extend` but receives a list of all the queried rows at once
+                                (takes precedence over `datastore_extend` in `CRUDService.query`)
+      - datastore_extend_untouched: fields that `datastore_extend` leaves as they are, filters on them are
+                                    evaluated by the datastore instead of filtering extended rows
       - datastore_prefix: datastore `prefix` option used in helper methods
+      - datastore_cache: cache `datastore.query` results for the service datastore until it is written to
       - service: system service `name` option used by `SystemServiceService`
       - service_model: system service datastore model option used by `SystemServiceService` (`service` if used if not provided)
       - service_verb: verb to be used on update (default to `reload`)
@@ -246,6 +260,9 @@ class ServiceBase(type):
             'datastore_prefix': '',
             'datastore_extend': None,
             'datastore_extend_context': None,
+            'datastore_extend_batch': None,
+            'datastore_extend_untouched': (),
+            'datastore_cache': False,
             'service': None,
             'service_model': None,
             'service_verb': 'reload',
@@ -420,11 +437,13 @@ class CRUDService(ServiceChangeMixin, Service):
     async def get_options(self, options):
         options = options or {}
         options['extend'] = self._config.datastore_extend
+        options['extend_batch'] = self._config.datastore_extend_batch
         options['extend_context'] = self._config.datastore_extend_context
         options['prefix'] = self._config.datastore_prefix
         return options
 
     @filterable
+    @readonly_args
     async def query(self, filters=None, options=None):
         if not self._config.datastore:
             raise NotImplementedError(
@@ -438,13 +457,16 @@ class CRUDService(ServiceChangeMixin, Service):
         options = await self.get_options(options)
 
         # In case we are extending which may transform the result in numerous ways
-        # we can only filter the final result.
-        if options['extend']:
+        # we can only filter the final result (except for the fields extend leaves untouched).
+        if options.get('extend') or options.get('extend_batch'):
+            datastore_filters = [f for f in filters if self._is_datastore_filter(f)]
+            filters = [f for f in filters if not self._is_datastore_filter(f)]
+
             datastore_options = options.copy()
             datastore_options.pop('count', None)
             datastore_options.pop('get', None)
             result = await self.middleware.call(
-                'datastore.query', self._config.datastore, [], datastore_options
+                'datastore.query', self._config.datastore, datastore_filters, datastore_options
             )
             return await self.middleware.run_in_thread(
                 filter_list, result, filters, options
@@ -454,6 +476,14 @@ class CRUDService(ServiceChangeMixin, Service):
                 'datastore.query', self._config.datastore, filters, options,
             )
 
+    def _is_datastore_filter(self, f):
+        if len(f) == 2:
+            return f[0] == 'OR' and all(self._is_datastore_filter(i) for i in f[1])
+
+        # SQL comparisons and `NOT IN` treat NULL differently from `filter_list`, only equality (`= NULL` becomes
+        # `IS NULL`) and `in` (NULLs are matched explicitly) are guaranteed to give the same result
+        return f[0] in self._config.datastore_extend_untouched and f[1] in ('=', 'in')
+
     @pass_app(rest=True)
     async def create(self, app, data):
         rv = await self.middleware._call(
@@ -578,7 +608,7 @@ class SharingTaskService(CRUDService):
     @private
     async def sharing_task_extend_context(self, extra):
         return {
-            'locked_datasets': await self.middleware.call('zfs.dataset.locked_datasets'),
+            'locked_datasets': await self.middleware.call('zfs.dataset.lock_state.locked_datasets'),
             'service_extend': (await self.middleware.call(self._config.datastore_extend_context, extra))
             if self._config.datastore_extend_context else {}
         }
@@ -609,11 +639,26 @@ class SharingTaskService(CRUDService):
 
         return data
 
+    @private
+    async def sharing_task_extend_batch(self, rows, context):
+        args = [context['service_extend']] if self._config.datastore_extend_context else []
+
+        if self._config.datastore_extend_batch:
+            rows = await self.middleware.call(self._config.datastore_extend_batch, rows, *args)
+        elif self._config.datastore_extend:
+            rows = [await self.middleware.call(self._config.datastore_extend, data, *args) for data in rows]
+
+        for data in rows:
+            data[self.locked_field] = await self.sharing_task_determine_locked(data, context['locked_datasets'])
+
+        return rows
+
     @private
     async def get_options(self, options):
         return {
             **(await super().get_options(options)),
             'extend': f'{self._config.namespace}.sharing_task_extend',
+            'extend_batch': f'{self._config.namespace}.sharing_task_extend_batch',
             'extend_context': f'{self._config.namespace}.sharing_task_extend_context',
         }
 
@@ -1200,6 +1245,20 @@ class CoreService(Service):
     def threads_stacks(self):
         return get_threads_stacks()
 
+    @private
+    def procpool_stats(self):
+        """
+        Number of calls and their latency ( in seconds ) for every method executed in the process pool.
+        """
+        return self.middleware.get_procpool_stats()
+
+    @private
+    def event_stats(self):
+        """
+        Number of messages sent to and dropped for (closed) websocket clients for every event collection.
+        """
+        return self.middleware.event_subscriptions.stats()
+
     @accepts(Str("method"), List("params", default=[]))
     @job(lock=lambda args: f"bulk:{args[0]}")
     async def bulk(self, job, method, params):
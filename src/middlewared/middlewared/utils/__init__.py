@@ -5,7 +5,6 @@ import itertools
 import logging
 import os
 import sys
-import re
 import subprocess
 import threading
 from datetime import datetime, timedelta
@@ -13,8 +12,8 @@ from functools import wraps
 from threading import Lock
 
 from middlewared.schema import Schemas
-from middlewared.service_exception import MatchNotFound
 from middlewared.utils import osc
+from middlewared.utils.filters import filter_list, partition  # noqa
 
 BUILDTIME = None
 VERSION = None
@@ -63,19 +62,6 @@ async def run(*args, **kwargs):
     return cp
 
 
-def partition(s):
-    rv = ''
-    while True:
-        left, sep, right = s.partition('.')
-        if not sep:
-            return rv + left, right
-        if left[-1] == '\\':
-            rv += left[:-1] + sep
-            s = right
-        else:
-            return rv + left, right
-
-
 def get(obj, path):
     """
     Get a path in obj using dot notation
@@ -99,133 +85,25 @@ def get(obj, path):
     return cur
 
 
-def filter_list(_list, filters=None, options=None):
-
-    opmap = {
-        '=': lambda x, y: x == y,
-        '!=': lambda x, y: x != y,
-        '>': lambda x, y: x > y,
-        '>=': lambda x, y: x >= y,
-        '<': lambda x, y: x < y,
-        '<=': lambda x, y: x <= y,
-        '~': lambda x, y: re.match(y, x),
-        'in': lambda x, y: x in y,
-        'nin': lambda x, y: x not in y,
-        'rin': lambda x, y: x is not None and y in x,
-        'rnin': lambda x, y: x is not None and y not in x,
-        '^': lambda x, y: x is not None and x.startswith(y),
-        '!^': lambda x, y: x is not None and not x.startswith(y),
-        '$': lambda x, y: x is not None and x.endswith(y),
-        '!$': lambda x, y: x is not None and not x.endswith(y),
-    }
-
-    if filters is None:
-        filters = {}
-    if options is None:
-        options = {}
-
-    select = options.get('select')
-
-    rv = []
-    if filters:
-
-        def filterop(f):
-            if len(f) != 3:
-                raise ValueError(f'Invalid filter {f}')
-            name, op, value = f
-            if op not in opmap:
-                raise ValueError('Invalid operation: {}'.format(op))
-            if isinstance(i, dict):
-                source = get(i, name)
-            else:
-                source = getattr(i, name)
-            if opmap[op](source, value):
-                return True
-            return False
-
-        for i in _list:
-            valid = True
-            for f in filters:
-                if len(f) == 2:
-                    op, value = f
-                    if op == 'OR':
-                        for f in value:
-                            if filterop(f):
-                                break
-                        else:
-                            valid = False
-                            break
-                    else:
-                        raise ValueError(f'Invalid operation: {op}')
-                elif not filterop(f):
-                    valid = False
-                    break
-
-            if not valid:
-                continue
-            if select:
-                entry = {}
-                for s in select:
-                    if s in i:
-                        entry[s] = i[s]
-            else:
-                entry = i
-            rv.append(entry)
-            if options.get('get') is True:
-                return entry
-    elif select:
-        rv = []
-        for i in _list:
-            entry = {}
-            for s in select:
-                if s in i:
-                    entry[s] = i[s]
-            rv.append(entry)
-    else:
-        rv = _list
-
-    if options.get('count') is True:
-        return len(rv)
-
-    if options.get('order_by'):
-        for o in options.get('order_by'):
-            if o.startswith('-'):
-                o = o[1:]
-                reverse = True
-            else:
-                reverse = False
-            rv = sorted(rv, key=lambda x: x[o], reverse=reverse)
-
-    if options.get('get') is True:
-        try:
-            return rv[0]
-        except IndexError:
-            raise MatchNotFound()
-
-    if options.get('offset'):
-        rv = rv[options['offset']:]
-
-    if options.get('limit'):
-        return rv[:options['limit']]
-
-    return rv
-
-
 def filter_getattrs(filters):
     """
     Get a set of attributes in a filter list.
+
+    `OR` alternatives can either be single filters or lists of filters.
     """
     attrs = set()
     if not filters:
         return attrs
 
-    f = filters.copy()
+    f = list(filters)
     while f:
         filter_ = f.pop()
-        if len(filter_) == 2:
-            f.append(filter_[1])
-        elif len(filter_) == 3:
+        if len(filter_) == 2 and filter_[0] == 'OR':
+            f.extend(filter_[1])
+        elif len(filter_) == 3 and isinstance(filter_[0], str):
             attrs.add(filter_[0])
+        elif filter_ and all(isinstance(i, (list, tuple)) for i in filter_):
+            f.extend(filter_)
         else:
             raise ValueError('Invalid filter.')
     return attrs
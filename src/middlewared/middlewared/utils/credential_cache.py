@@ -0,0 +1,77 @@
+from collections import defaultdict, OrderedDict
+import hashlib
+import os
+import threading
+import time
+
+
+class CredentialCache:
+    """
+    Bounded cache of successfully verified credentials.
+
+    Entries are keyed by credential kind, identity (username or API key id) and a keyed BLAKE2 digest of the
+    secret, so that secrets themselves are never kept in memory. Keying uses a random per-process key. Entries
+    expire after `ttl` seconds and are dropped explicitly when the underlying credential changes.
+    """
+
+    def __init__(self, size=1024, ttl=60):
+        self.size = size
+        self.ttl = ttl
+        self.key = os.urandom(32)
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.generations = {}
+        self.stats = defaultdict(lambda: {'hits': 0, 'misses': 0, 'invalidations': 0})
+
+    def get(self, kind, identity, secret):
+        """
+        Returns `(hit, value, generation)`.
+
+        On a miss, `generation` must be passed to `put` once the credential is verified so that a value checked
+        against data that was invalidated in the meantime is not cached.
+        """
+        key = (kind, identity, self._digest(secret))
+        with self.lock:
+            generation = self._generation(kind, identity)
+
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() < entry[0]:
+                self.entries.move_to_end(key)
+                self.stats[kind]['hits'] += 1
+                return True, entry[1], generation
+
+            if entry is not None:
+                self.entries.pop(key)
+
+            self.stats[kind]['misses'] += 1
+            return False, None, generation
+
+    def put(self, kind, identity, secret, value, generation):
+        key = (kind, identity, self._digest(secret))
+        with self.lock:
+            if self._generation(kind, identity) != generation:
+                return
+
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, kind, identity=None):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == kind and identity in (None, key[1])]:
+                self.entries.pop(key)
+
+            generation_key = kind if identity is None else (kind, identity)
+            self.generations[generation_key] = self.generations.get(generation_key, 0) + 1
+
+            self.stats[kind]['invalidations'] += 1
+
+    def _generation(self, kind, identity):
+        return self.generations.get(kind, 0), self.generations.get((kind, identity), 0)
+
+    def _digest(self, secret):
+        return hashlib.blake2b(secret.encode('utf-8', 'surrogateescape'), key=self.key, digest_size=32).digest()
+
+
+CREDENTIAL_CACHE = CredentialCache()
@@ -0,0 +1,245 @@
+import heapq
+import itertools
+import operator
+import re
+
+from middlewared.service_exception import MatchNotFound
+
+__all__ = ["compile_filters", "compile_order_by", "filter_list", "partition", "split_path"]
+
+
+def partition(s):
+    rv = ''
+    while True:
+        left, sep, right = s.partition('.')
+        if not sep:
+            return rv + left, right
+        if left[-1] == '\\':
+            rv += left[:-1] + sep
+            s = right
+        else:
+            return rv + left, right
+
+
+def split_path(path):
+    """
+    Split a dot notation path (see `middlewared.utils.get`) into its components once so
+    that it does not have to be re-parsed for every row.
+    """
+    parts = []
+    right = path
+    while right:
+        left, right = partition(right)
+        parts.append(left)
+    return parts
+
+
+def _regex_op(value):
+    return re.compile(value).match
+
+
+def _value_op(op):
+    return lambda value: lambda x: op(x, value)
+
+
+OPMAP = {
+    '=': _value_op(operator.eq),
+    '!=': _value_op(operator.ne),
+    '>': _value_op(operator.gt),
+    '>=': _value_op(operator.ge),
+    '<': _value_op(operator.lt),
+    '<=': _value_op(operator.le),
+    '~': _regex_op,
+    'in': lambda y: lambda x: x in y,
+    'nin': lambda y: lambda x: x not in y,
+    'rin': lambda y: lambda x: x is not None and y in x,
+    'rnin': lambda y: lambda x: x is not None and y not in x,
+    '^': lambda y: lambda x: x is not None and x.startswith(y),
+    '!^': lambda y: lambda x: x is not None and not x.startswith(y),
+    '$': lambda y: lambda x: x is not None and x.endswith(y),
+    '!$': lambda y: lambda x: x is not None and not x.endswith(y),
+}
+
+
+def _compile_getter(name):
+    parts = split_path(name)
+
+    if len(parts) == 1:
+        key = parts[0]
+
+        def getter(i):
+            if isinstance(i, dict):
+                return i.get(key)
+            return getattr(i, name)
+
+        return getter
+
+    def getter(i):
+        if not isinstance(i, dict):
+            return getattr(i, name)
+
+        cur = i
+        for left in parts:
+            if isinstance(cur, dict):
+                cur = cur.get(left)
+            elif isinstance(cur, (list, tuple)):
+                left = int(left)
+                cur = cur[left] if left < len(cur) else None
+        return cur
+
+    return getter
+
+
+def _compile_filter(f):
+    if len(f) != 3:
+        raise ValueError(f'Invalid filter {f}')
+    name, op, value = f
+    if op not in OPMAP:
+        raise ValueError('Invalid operation: {}'.format(op))
+
+    getter = _compile_getter(name)
+    test = OPMAP[op](value)
+    return lambda i: bool(test(getter(i)))
+
+
+def compile_filters(filters):
+    """
+    Compile a query-filters list into a single predicate taking one row.
+
+    Regular expressions are compiled and dotted paths are split once, here, instead of
+    for every row. Returns `None` when there is nothing to filter on.
+    """
+    if not filters:
+        return None
+
+    predicates = []
+    for f in filters:
+        if len(f) == 2:
+            op, value = f
+            if op != 'OR':
+                raise ValueError(f'Invalid operation: {op}')
+
+            alternatives = [_compile_filter(i) for i in value]
+            predicates.append(lambda i, alternatives=alternatives: any(p(i) for p in alternatives))
+        else:
+            predicates.append(_compile_filter(f))
+
+    if len(predicates) == 1:
+        return predicates[0]
+
+    def predicate(i):
+        for p in predicates:
+            if not p(i):
+                return False
+        return True
+
+    return predicate
+
+
+def compile_order_by(order_by):
+    """
+    Compile `order_by` into a list of `(key, reverse)` sort passes.
+
+    Every `order_by` entry is a stable sort applied in turn, so the last entry is the
+    primary sort key. Consecutive entries sharing the same direction are merged into a
+    single composite key so the common case needs only one sort.
+    """
+    passes = []
+    for o in order_by:
+        if o.startswith('-'):
+            o = o[1:]
+            reverse = True
+        else:
+            reverse = False
+
+        if passes and passes[-1][1] == reverse:
+            passes[-1][0].insert(0, o)
+        else:
+            passes.append(([o], reverse))
+
+    result = []
+    for names, reverse in passes:
+        result.append((operator.itemgetter(*names), reverse))
+
+    return result
+
+
+def _select(select, i):
+    entry = {}
+    for s in select:
+        if s in i:
+            entry[s] = i[s]
+    return entry
+
+
+def filter_list(_list, filters=None, options=None):
+    """
+    Filter, order and paginate `_list` (any iterable of dicts or objects) according to
+    query-filters and query-options.
+
+    Filters and `order_by` are compiled once per call. `get` and `limit` without
+    `order_by` stop walking `_list` as soon as enough rows matched, `order_by` with `get`
+    or `limit` uses a partial selection instead of sorting every row.
+    """
+    if options is None:
+        options = {}
+
+    select = options.get('select')
+    count = options.get('count') is True
+    get = options.get('get') is True
+    order_by = options.get('order_by')
+    offset = options.get('offset') or 0
+    limit = options.get('limit') or 0
+
+    predicate = compile_filters(filters)
+
+    if predicate is None and not select and not order_by and not get and not offset and not limit:
+        if count:
+            return len(_list) if isinstance(_list, (list, tuple)) else sum(1 for i in _list)
+        return list(_list)
+
+    if predicate is not None:
+        rv = filter(predicate, _list)
+        if get:
+            # The first match is returned regardless of `order_by` when filtering
+            for i in rv:
+                return _select(select, i) if select else i
+            rv = []
+    else:
+        rv = _list
+
+    if select:
+        rv = (_select(select, i) for i in rv)
+
+    if count:
+        if isinstance(rv, (list, tuple)):
+            return len(rv)
+        return sum(1 for i in rv)
+
+    if order_by:
+        passes = compile_order_by(order_by)
+        if len(passes) == 1:
+            key, reverse = passes[0]
+            if get:
+                try:
+                    return (max if reverse else min)(rv, key=key)
+                except ValueError:
+                    raise MatchNotFound()
+            if limit:
+                return (heapq.nlargest if reverse else heapq.nsmallest)(offset + limit, rv, key=key)[offset:]
+
+        for key, reverse in passes:
+            rv = sorted(rv, key=key, reverse=reverse)
+
+    if get:
+        for i in rv:
+            return i
+        raise MatchNotFound()
+
+    if limit:
+        return list(itertools.islice(rv, offset, offset + limit))
+
+    if offset:
+        return list(itertools.islice(rv, offset, None))
+
+    return rv if isinstance(rv, list) else list(rv)
@@ -5,6 +5,7 @@ import asyncio
 import inspect
 import os
 import setproctitle
+import threading
 
 from . import logger
 from .common.environ import environ_update
@@ -12,9 +13,37 @@ from .utils import LoadPluginsMixin
 import middlewared.utils.osc as osc
 from .utils.service.call import ServiceCallMixin
 
+INTERNAL_SOCKET = 'ws+unix:///var/run/middlewared-internal.sock'
 MIDDLEWARE = None
 
 
+class WorkerClient(object):
+    """
+    Long-lived connection from a process pool worker to middlewared.
+
+    A single websocket is shared by all calls, events and job progress updates of the worker
+    and is transparently re-established if middlewared closes it.
+    """
+
+    def __init__(self, on_connect=None):
+        self.on_connect = on_connect
+        self.connects = 0
+        self._client = None
+        self._lock = threading.Lock()
+
+    def connect(self):
+        with self._lock:
+            if self._client is None or self._client.closed:
+                self._client = Client(INTERNAL_SOCKET, py_exceptions=True)
+                self.connects += 1
+                if self.on_connect:
+                    self.on_connect(self._client)
+            return self._client
+
+    def call(self, method, *params, **kwargs):
+        return self.connect().call(method, *params, **kwargs)
+
+
 class FakeMiddleware(LoadPluginsMixin, ServiceCallMixin):
     """
     Implements same API from real middleware
@@ -22,23 +51,18 @@ class FakeMiddleware(LoadPluginsMixin, ServiceCallMixin):
 
     def __init__(self, overlay_dirs):
         super().__init__(overlay_dirs)
-        self.client = None
+        self.client = WorkerClient(on_connect=receive_events)
         _logger = logger.Logger('worker')
         self.logger = _logger.getLogger()
         _logger.configure_logging('console')
         self.loop = asyncio.get_event_loop()
 
     def _call(self, name, serviceobj, methodobj, params=None, app=None, pipes=None, io_thread=False, job=None):
-        try:
-            with Client('ws+unix:///var/run/middlewared-internal.sock', py_exceptions=True) as c:
-                self.client = c
-                job_options = getattr(methodobj, '_job', None)
-                if job and job_options:
-                    params = list(params) if params else []
-                    params.insert(0, FakeJob(job['id'], self.client))
-                return methodobj(*params)
-        finally:
-            self.client = None
+        job_options = getattr(methodobj, '_job', None)
+        if job and job_options:
+            params = list(params) if params else []
+            params.insert(0, FakeJob(job['id'], self.client))
+        return methodobj(*params)
 
     def _run(self, name, args, job):
         serviceobj, methodobj = self._method_lookup(name)
@@ -61,8 +85,7 @@ class FakeMiddleware(LoadPluginsMixin, ServiceCallMixin):
         return self.client.call(method, *params, timeout=timeout, **kwargs)
 
     def send_event(self, name, event_type, **kwargs):
-        with Client(py_exceptions=True) as c:
-            return c.call('core.event_send', name, event_type, kwargs)
+        return self.client.call('core.event_send', name, event_type, kwargs)
 
 
 class FakeJob(object):
@@ -98,8 +121,7 @@ def main_worker(*call_args):
     return res
 
 
-def receive_events():
-    c = Client('ws+unix:///var/run/middlewared-internal.sock', py_exceptions=True)
+def receive_events(c):
     c.subscribe('core.environ', lambda *args, **kwargs: environ_update(kwargs['fields']))
     c.subscribe('core.reconfigure_logging', lambda *args, **kwargs: logger.reconfigure_logging())
 
@@ -115,4 +137,4 @@ def worker_init(overlay_dirs, debug_level, log_handler):
     setproctitle.setproctitle('middlewared (worker)')
     osc.die_with_parent()
     logger.setup_logging('worker', debug_level, log_handler)
-    receive_events()
+    MIDDLEWARE.client.connect()